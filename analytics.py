@@ -0,0 +1,233 @@
+"""
+Read queries over call_records for dashboards.
+
+Listing uses keyset pagination on (created_at, id) so every page is an
+index range scan regardless of how deep the client pages. Stats are read
+from the hourly call_record_rollups (see rollups.py) over whole hours, or,
+with source="raw", computed exactly over a bounded time window from the
+covering created_at index (see CREATE_CALL_RECORD_INDEXES in db.py). The
+average agent rating leaves out locally classified calls, whose rating is a
+placeholder.
+
+created_at holds the database's local time, so time zone aware bounds are
+converted by the database, in its zone, and the default window ends at its
+clock, the same clock rollups.py buckets by.
+"""
+
+import os
+import json
+import base64
+import datetime
+
+ANALYTICS_DEFAULT_WINDOW_HOURS = float(os.getenv("ANALYTICS_DEFAULT_WINDOW_HOURS", "24"))
+ANALYTICS_MAX_WINDOW_DAYS = float(os.getenv("ANALYTICS_MAX_WINDOW_DAYS", "31"))
+ANALYTICS_MAX_PAGE_SIZE = 200
+
+# Insight columns returned by the listing; transcript only on request
+LIST_COLUMNS = (
+    "id", "record_uuid", "intent", "call_purpose", "call_objective_met", "key_results",
+    "customer_statements_analysis", "non_payment_reasons", "sentiment_start",
+    "sentiment_end", "overall_sentiment", "agent_performance_rating",
+    "agent_performance_feedback", "action_required", "summary", "classified_locally", "created_at",
+)
+
+TRANSCRIPT_COLUMN = """(
+    SELECT transcript FROM call_transcripts t WHERE t.transcript_hash = call_records.transcript_hash
+) AS transcript"""
+
+GROUP_BY = {
+    "none": None,
+    "call_purpose": "call_purpose",
+    "hour": "date_trunc('hour', created_at)",
+    "day": "date_trunc('day', created_at)",
+}
+ROLLUP_GROUP_BY = {
+    "none": None,
+    "call_purpose": "call_purpose",
+    "hour": "bucket_start",
+    "day": "date_trunc('day', bucket_start)",
+}
+
+RAW_STATS = """
+    SELECT {group}
+        count(*) AS total,
+        count(*) FILTER (WHERE overall_sentiment = 'Negative') AS negative,
+        count(*) FILTER (WHERE overall_sentiment = 'Neutral') AS neutral,
+        count(*) FILTER (WHERE overall_sentiment = 'Positive') AS positive,
+        count(*) FILTER (WHERE call_objective_met) AS objective_met,
+        count(*) FILTER (WHERE action_required) AS action_required,
+        avg(agent_performance_rating) FILTER (WHERE NOT classified_locally)::float AS avg_agent_rating
+    FROM call_records
+    WHERE {where}
+    {group_clause}
+"""
+
+ROLLUP_STATS = """
+    SELECT {group}
+        coalesce(sum(calls), 0)::bigint AS total,
+        coalesce(sum(calls) FILTER (WHERE overall_sentiment = 'Negative'), 0)::bigint AS negative,
+        coalesce(sum(calls) FILTER (WHERE overall_sentiment = 'Neutral'), 0)::bigint AS neutral,
+        coalesce(sum(calls) FILTER (WHERE overall_sentiment = 'Positive'), 0)::bigint AS positive,
+        coalesce(sum(calls) FILTER (WHERE call_objective_met), 0)::bigint AS objective_met,
+        coalesce(sum(calls) FILTER (WHERE action_required), 0)::bigint AS action_required,
+        (sum(rating_sum)::float / nullif(sum(rated_calls), 0)) AS avg_agent_rating
+    FROM call_record_rollups
+    WHERE {where}
+    {group_clause}
+"""
+
+
+# Aware bounds in the database's zone; a missing until is the database's clock
+DB_LOCAL_BOUNDS = """
+    SELECT $1::timestamptz AT TIME ZONE current_setting('TimeZone'),
+           coalesce($2::timestamptz AT TIME ZONE current_setting('TimeZone'), LOCALTIMESTAMP)
+"""
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+def encode_cursor(created_at: datetime.datetime, record_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), record_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.datetime.fromisoformat(created_at), int(record_id)
+    except (ValueError, TypeError):
+        raise InvalidQuery("Invalid cursor")
+
+
+def is_aware(value) -> bool:
+    return value is not None and value.tzinfo is not None
+
+
+async def db_local_bounds(db, since=None, until=None):
+    """
+    since and until as the database-local times created_at holds; naive bounds
+    are taken as database-local already and until defaults to the database's now
+    """
+    if until is not None and not is_aware(since) and not is_aware(until):
+        return since, until
+    # Naive values would be sent as UTC, so only the aware ones are converted
+    aware = [value if is_aware(value) else None for value in (since, until)]
+    rows = await db.fetch(DB_LOCAL_BOUNDS, *aware)
+    local_since, local_until = rows[0]
+    return (local_since if aware[0] else since), (local_until if aware[1] or until is None else until)
+
+
+def time_window(since, until, max_days: float = ANALYTICS_MAX_WINDOW_DAYS):
+    """
+    Validate database-local bounds (see db_local_bounds); since defaults to
+    ANALYTICS_DEFAULT_WINDOW_HOURS before until, capped at max_days
+    """
+    since = since or until - datetime.timedelta(hours=ANALYTICS_DEFAULT_WINDOW_HOURS)
+    if since >= until:
+        raise InvalidQuery("'since' must be before 'until'")
+    if max_days and until - since > datetime.timedelta(days=max_days):
+        raise InvalidQuery(f"Time window is limited to {max_days:g} days")
+    return since, until
+
+
+def hour_window(since, until):
+    """Widen [since, until) to whole hours, the rollup granularity"""
+    floor = since.replace(minute=0, second=0, microsecond=0)
+    ceil = until.replace(minute=0, second=0, microsecond=0)
+    if ceil < until:
+        ceil += datetime.timedelta(hours=1)
+    return floor, ceil
+
+
+def build_filters(since, until, overall_sentiment=None, action_required=None,
+                  call_purpose=None, call_objective_met=None, time_column: str = "created_at"):
+    """WHERE clause and its arguments; the window is always bounded"""
+    clauses = [f"{time_column} >= $1", f"{time_column} < $2"]
+    args = [since, until]
+    for column, value in (("overall_sentiment", overall_sentiment),
+                          ("action_required", action_required),
+                          ("call_purpose", call_purpose),
+                          ("call_objective_met", call_objective_met)):
+        if value is not None:
+            args.append(value)
+            clauses.append(f"{column} = ${len(args)}")
+    return " AND ".join(clauses), args
+
+
+async def list_call_records(db, filters: dict, limit: int = 50, cursor: str = None,
+                            include_transcript: bool = False) -> dict:
+    """Newest first; pass next_cursor back to get the following page"""
+    since, until = await db_local_bounds(db, filters.pop("since", None), filters.pop("until", None))
+    since, until = time_window(since, until)
+    where, args = build_filters(since, until, **filters)
+    if cursor:
+        created_at, record_id = decode_cursor(cursor)
+        args.extend([created_at, record_id])
+        where += f" AND (created_at, id) < (${len(args) - 1}, ${len(args)})"
+
+    limit = max(1, min(limit, ANALYTICS_MAX_PAGE_SIZE))
+    columns = LIST_COLUMNS + ((TRANSCRIPT_COLUMN,) if include_transcript else ())
+    rows = await db.fetch(f"""
+        SELECT {", ".join(columns)} FROM call_records
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT {limit + 1}
+    """, *args)
+
+    items = [dict(row) for row in rows[:limit]]
+    for item in items:
+        item["record_uuid"] = str(item["record_uuid"]) if item["record_uuid"] else None
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def call_record_stats(db, filters: dict, group_by: str = "none", source: str = "raw") -> dict:
+    """
+    Sentiment distribution, objective-met rate and average rating, optionally
+    grouped. source="rollup" reads call_record_rollups over the window
+    widened to whole hours and is not limited to ANALYTICS_MAX_WINDOW_DAYS.
+    """
+    if group_by not in GROUP_BY:
+        raise InvalidQuery(f"group_by must be one of {', '.join(GROUP_BY)}")
+    since, until = await db_local_bounds(db, filters.pop("since", None), filters.pop("until", None))
+    if source == "rollup":
+        since, until = hour_window(*time_window(since, until, max_days=0))
+        where, args = build_filters(since, until, time_column="bucket_start", **filters)
+        group, query = ROLLUP_GROUP_BY[group_by], ROLLUP_STATS
+    else:
+        since, until = time_window(since, until)
+        where, args = build_filters(since, until, **filters)
+        group, query = GROUP_BY[group_by], RAW_STATS
+
+    rows = await db.fetch(query.format(
+        group=f"{group} AS bucket," if group else "",
+        where=where,
+        group_clause="GROUP BY 1 ORDER BY 1" if group else "",
+    ), *args)
+
+    groups = []
+    for row in rows:
+        total = row["total"]
+        group_stats = {
+            "total": total,
+            "sentiment_distribution": {
+                "Negative": row["negative"], "Neutral": row["neutral"], "Positive": row["positive"],
+            },
+            "objective_met_rate": row["objective_met"] / total if total else None,
+            "action_required_rate": row["action_required"] / total if total else None,
+            "avg_agent_rating": row["avg_agent_rating"],
+        }
+        if group:
+            group_stats = {group_by: row["bucket"], **group_stats}
+        groups.append(group_stats)
+
+    result = {"since": since, "until": until, "group_by": group_by, "source": source}
+    if group:
+        result["groups"] = groups
+    else:
+        result.update(groups[0])
+    return result
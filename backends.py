@@ -0,0 +1,330 @@
+"""
+LLM backends behind LLMClient.
+
+A backend turns a prompt into text with two coroutines:
+- generate(model, prompt, response_schema=None, json_output=False, prefix=None) -> str
+- stream(model, prompt, response_schema=None, json_output=False, prefix=None) -> async iterator of str
+and raises exceptions with an HTTP-style `code` attribute where it has one,
+so LLMClient's retry and circuit-breaker logic applies to every backend.
+warm_up() sets up whatever the backend needs (SDK client, recorded
+responses); it runs on first use or from the service's startup warm-up, so
+importing the service never loads the Gemini SDK. prefix is the static start of the prompt (see prompts.py); backends that
+cannot cache it simply send the whole prompt.
+
+Backends, selected with LLM_BACKEND:
+- gemini: the Google Gemini API (default); with LLM_CONTEXT_CACHE the
+  prompt prefix is stored as cached content and requests send only the rest,
+- replay: serves responses previously recorded with LLM_RECORD_FILE,
+  keyed by model and prompt, without any network access,
+- synthetic: returns well-formed insights after a log-normal delay and
+  fails a configurable fraction of calls, for benchmarking the service
+  under simulated LLM latency.
+"""
+
+import os
+import re
+import json
+import random
+import time
+import asyncio
+import hashlib
+
+from llm import estimate_tokens
+from metrics import LLM_TOKENS
+
+SYNTHETIC_LATENCY_MS = float(os.getenv("SYNTHETIC_LATENCY_MS", "800"))
+SYNTHETIC_LATENCY_SIGMA = float(os.getenv("SYNTHETIC_LATENCY_SIGMA", "0.25"))
+SYNTHETIC_FAILURE_RATE = float(os.getenv("SYNTHETIC_FAILURE_RATE", "0"))
+SYNTHETIC_THROTTLE_RATE = float(os.getenv("SYNTHETIC_THROTTLE_RATE", "0"))
+SYNTHETIC_STREAM_CHUNK = 64
+LLM_CONTEXT_CACHE = os.getenv("LLM_CONTEXT_CACHE", "false").lower() == "true"
+LLM_CONTEXT_CACHE_TTL = int(os.getenv("LLM_CONTEXT_CACHE_TTL", "3600"))
+# Gemini refuses to cache less than this (1,024 tokens for 2.5 Flash, more for Pro models)
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+BATCH_TRANSCRIPT = re.compile(r"^\s*Transcript (\d+):", re.MULTILINE)
+
+
+def count_tokens(backend: str, prompt_tokens: int, output_tokens: int, cached_tokens: int = 0):
+    LLM_TOKENS.inc(prompt_tokens or 0, backend=backend, direction="prompt")
+    LLM_TOKENS.inc(output_tokens or 0, backend=backend, direction="output")
+    if cached_tokens:
+        # Already part of the prompt count, billed at the cached rate
+        LLM_TOKENS.inc(cached_tokens, backend=backend, direction="cached")
+
+
+class BackendError(Exception):
+    """Failure with an HTTP-style status code, as raised by the Gemini SDK"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def prompt_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, api_key: str = None, context_cache: bool = LLM_CONTEXT_CACHE,
+                 context_cache_ttl: int = LLM_CONTEXT_CACHE_TTL,
+                 context_cache_min_tokens: int = LLM_CONTEXT_CACHE_MIN_TOKENS):
+        self.api_key = api_key
+        self.types = None
+        self._client = None
+        self.context_cache = context_cache
+        self.context_cache_ttl = context_cache_ttl
+        self.context_cache_min_tokens = context_cache_min_tokens
+        self._contexts = {}  # (model, prefix) -> (cached content name or None, renew at)
+        self._context_lock = asyncio.Lock()
+
+    def warm_up(self):
+        # google.genai takes about half a second to import, so it is loaded on first use
+        if self._client is None:
+            if not self.api_key:
+                raise Exception("GEMINI_API_KEY not found in .env")
+            from google import genai
+            from google.genai import types
+            self.types = types
+            self._client = genai.Client(api_key=self.api_key)
+
+    @property
+    def client(self):
+        self.warm_up()
+        return self._client
+
+    def _count_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            count_tokens(self.name, usage.prompt_token_count, usage.candidates_token_count,
+                         usage.cached_content_token_count)
+
+    async def _cached_context(self, model: str, prefix: str):
+        """Name of the cached content holding prefix, created on first use; None when unavailable"""
+        entry = self._contexts.get((model, prefix))
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        if self._context_lock.locked():
+            # Another request is creating or renewing a context; send this one in full rather than wait
+            return None
+        async with self._context_lock:
+            entry = self._contexts.get((model, prefix))
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            try:
+                cached = await self.client.aio.caches.create(
+                    model=model, config=self.types.CreateCachedContentConfig(
+                        contents=[prefix], ttl=f"{self.context_cache_ttl}s"))
+                name = cached.name
+            except Exception as e:
+                # e.g. a prefix below the model's minimum cacheable size; sent in full until renewal
+                print(f"Context cache unavailable for {model}: {e}")
+                name = None
+            # Renewed before the server expires it
+            self._contexts[(model, prefix)] = (name, time.monotonic() + self.context_cache_ttl * 0.9)
+            return name
+
+    async def _contents(self, model: str, prompt: str, prefix: str):
+        """(contents, cached content name) with the prefix replaced by its cached context when possible"""
+        if not (self.context_cache and prefix and prompt.startswith(prefix)):
+            return prompt, None
+        if estimate_tokens(prefix) < self.context_cache_min_tokens:
+            # Too short to cache: creating the context would only fail
+            return prompt, None
+        cached = await self._cached_context(model, prefix)
+        return (prompt[len(prefix):], cached) if cached else (prompt, None)
+
+    def _config(self, response_schema, json_output: bool, cached_content: str = None):
+        self.warm_up()
+        options = {"cached_content": cached_content} if cached_content else {}
+        if response_schema is not None:
+            options.update(response_mime_type="application/json", response_schema=response_schema)
+        elif json_output:
+            options.update(response_mime_type="application/json")
+        return self.types.GenerateContentConfig(**options) if options else None
+
+    async def generate(self, model: str, prompt: str, response_schema=None, json_output: bool = False,
+                       prefix: str = None) -> str:
+        contents, cached = await self._contents(model, prompt, prefix)
+        response = await self.client.aio.models.generate_content(
+            model=model, contents=contents, config=self._config(response_schema, json_output, cached))
+        self._count_usage(response)
+        if not response.candidates:
+            raise Exception("No content returned from LLM")
+        return response.candidates[0].content.parts[0].text
+
+    async def stream(self, model: str, prompt: str, response_schema=None, json_output: bool = False,
+                     prefix: str = None):
+        contents, cached = await self._contents(model, prompt, prefix)
+        chunks = await self.client.aio.models.generate_content_stream(
+            model=model, contents=contents, config=self._config(response_schema, json_output, cached))
+        async for chunk in chunks:
+            # Usage totals arrive with the final chunk
+            self._count_usage(chunk)
+            if chunk.text:
+                yield chunk.text
+
+
+class RecordingBackend:
+    """Wraps a backend and appends every successful response to a JSONL file"""
+
+    def __init__(self, backend, path: str):
+        self.backend = backend
+        self.path = path
+        self.name = f"{backend.name}+record"
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def _record(self, model: str, prompt: str, text: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": prompt_key(model, prompt), "model": model, "response": text},
+                               ensure_ascii=False) + "\n")
+
+    async def generate(self, model: str, prompt: str, **kwargs) -> str:
+        text = await self.backend.generate(model, prompt, **kwargs)
+        self._record(model, prompt, text)
+        return text
+
+    async def stream(self, model: str, prompt: str, **kwargs):
+        chunks = []
+        async for text in self.backend.stream(model, prompt, **kwargs):
+            chunks.append(text)
+            yield text
+        self._record(model, prompt, "".join(chunks))
+
+
+class ReplayBackend:
+    """Serves responses recorded by RecordingBackend; unknown prompts fail with 404"""
+    name = "replay"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = None
+
+    def warm_up(self):
+        if self.responses is None:
+            responses = {}
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        responses[entry["key"]] = entry["response"]
+            self.responses = responses
+            print(f"Replay backend loaded {len(responses)} recorded responses from {self.path}")
+
+    def _lookup(self, model: str, prompt: str) -> str:
+        self.warm_up()
+        text = self.responses.get(prompt_key(model, prompt))
+        if text is None:
+            raise BackendError(404, "No recorded response for this prompt")
+        return text
+
+    async def generate(self, model: str, prompt: str, **kwargs) -> str:
+        text = self._lookup(model, prompt)
+        count_tokens(self.name, estimate_tokens(prompt), estimate_tokens(text))
+        return text
+
+    async def stream(self, model: str, prompt: str, **kwargs):
+        text = self._lookup(model, prompt)
+        count_tokens(self.name, estimate_tokens(prompt), estimate_tokens(text))
+        for i in range(0, len(text), SYNTHETIC_STREAM_CHUNK):
+            yield text[i:i + SYNTHETIC_STREAM_CHUNK]
+
+
+class SyntheticBackend:
+    """
+    Deterministic fake insights with realistic timing. Values are derived
+    from a hash of the prompt so identical prompts get identical answers;
+    latency and failures are random.
+    """
+    name = "synthetic"
+
+    def __init__(self, latency_ms: float = SYNTHETIC_LATENCY_MS,
+                 sigma: float = SYNTHETIC_LATENCY_SIGMA,
+                 failure_rate: float = SYNTHETIC_FAILURE_RATE,
+                 throttle_rate: float = SYNTHETIC_THROTTLE_RATE):
+        self.latency = latency_ms / 1000.0
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+
+    def warm_up(self):
+        pass
+
+    def _delay(self) -> float:
+        # Log-normal with the configured mean, like real LLM latency
+        return self.latency * random.lognormvariate(-self.sigma ** 2 / 2, self.sigma)
+
+    def _maybe_fail(self):
+        roll = random.random()
+        if roll < self.throttle_rate:
+            raise BackendError(429, "Synthetic rate limit")
+        if roll < self.throttle_rate + self.failure_rate:
+            raise BackendError(503, "Synthetic upstream failure")
+
+    @staticmethod
+    def insight(seed: str) -> dict:
+        rng = random.Random(seed)
+        sentiments = ["Negative", "Neutral", "Positive"]
+        objective_met = rng.random() < 0.6
+        return {
+            "customer_intent": rng.choice(["Arrange payment", "Dispute charge", "Request extension"]),
+            "call_purpose": rng.choice(["Payment reminder", "Collection", "Dispute resolution"]),
+            "call_objective_met": objective_met,
+            "key_results": "Customer agreed to a payment plan." if objective_met else "No agreement reached.",
+            "customer_statements_analysis": "Synthetic analysis of customer statements.",
+            "non_payment_reasons": rng.choice(["None stated", "Job loss", "Medical expenses"]),
+            "sentiment_start": rng.choice(sentiments),
+            "sentiment_end": rng.choice(sentiments),
+            "overall_sentiment": rng.choice(sentiments),
+            "agent_performance_rating": rng.randint(4, 10),
+            "agent_performance_feedback": "Synthetic agent feedback.",
+            "action_required": rng.random() < 0.5,
+            "summary": "Synthetic summary of the call.",
+        }
+
+    def _response(self, prompt: str) -> str:
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        batch_ids = BATCH_TRANSCRIPT.findall(prompt)
+        if "JSON array" in prompt and batch_ids:
+            return json.dumps([{"transcript_id": int(n), **self.insight(f"{seed}:{n}")} for n in batch_ids])
+        return json.dumps(self.insight(seed))
+
+    async def generate(self, model: str, prompt: str, **kwargs) -> str:
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        text = self._response(prompt)
+        count_tokens(self.name, estimate_tokens(prompt), estimate_tokens(text))
+        return text
+
+    async def stream(self, model: str, prompt: str, **kwargs):
+        text = self._response(prompt)
+        pieces = [text[i:i + SYNTHETIC_STREAM_CHUNK] for i in range(0, len(text), SYNTHETIC_STREAM_CHUNK)]
+        # Half the latency before the first chunk, the rest spread over the output
+        total = self._delay()
+        await asyncio.sleep(total / 2)
+        self._maybe_fail()
+        count_tokens(self.name, estimate_tokens(prompt), estimate_tokens(text))
+        for piece in pieces:
+            yield piece
+            await asyncio.sleep(total / 2 / len(pieces))
+
+
+def create_backend(name: str, api_key: str = None, record_file: str = None, replay_file: str = None):
+    if name == "gemini":
+        backend = GeminiBackend(api_key)
+    elif name == "replay":
+        if not replay_file:
+            raise Exception("LLM_REPLAY_FILE is required with LLM_BACKEND=replay")
+        backend = ReplayBackend(replay_file)
+    elif name == "synthetic":
+        backend = SyntheticBackend()
+    else:
+        raise Exception("LLM_BACKEND must be 'gemini', 'replay' or 'synthetic'")
+
+    if record_file:
+        backend = RecordingBackend(backend, record_file)
+    return backend
@@ -0,0 +1,325 @@
+"""
+Concurrent load test and latency benchmark for the insights API.
+
+Replays the TEST_TRANSCRIPTS dataset from test_pipeline.py against a running
+server with many requests in flight, instead of one blocking request per
+second. Two load models are supported:
+- closed loop (default): --concurrency workers each send their next request
+  as soon as the previous one returns,
+- open loop (--rate): requests arrive as a Poisson process at --rate req/s
+  no matter how fast the server answers; latency is measured from the
+  scheduled arrival time so queueing delay is not hidden.
+
+With --stub-llm the server is started in a child process on the synthetic
+LLM backend (see backends.py) with configurable latency and failure rate,
+so the FastAPI, parsing and database overhead can be measured on its own.
+
+With --startup it measures cold start instead: the time `import main` takes
+in a fresh interpreter (with the slowest packages from -X importtime) and
+the time until a new uvicorn process answers /health/live. It exits with
+status 1 when the median import time is over --import-budget-ms, so CI can
+keep the import-time budget.
+
+Usage:
+python benchmark.py --concurrency 16 --requests 200 --bypass-cache
+python benchmark.py --rate 25 --duration 60
+python benchmark.py --stub-llm --stub-latency-ms 800 --concurrency 64 --requests 1000
+python benchmark.py --startup --startup-runs 10 --import-budget-ms 800
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import subprocess
+import sys
+import multiprocessing
+from typing import Any, Dict, List
+
+import httpx
+
+from test_pipeline import TEST_TRANSCRIPTS
+
+IMPORT_BUDGET_MS = 800.0
+IMPORT_PROBE = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def run_stub_server(port: int, latency_ms: float, failure_rate: float):
+    """Child process: the real app on the synthetic LLM backend"""
+    os.environ.update({
+        "LLM_BACKEND": "synthetic",
+        "SYNTHETIC_LATENCY_MS": str(latency_ms),
+        "SYNTHETIC_FAILURE_RATE": str(failure_rate),
+    })
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_stub_server(port: int, latency_ms: float, failure_rate: float) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=run_stub_server, args=(port, latency_ms, failure_rate), daemon=True)
+    process.start()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/docs", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Stub server did not start - check DATABASE_URL")
+
+
+# Load generation
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadTester:
+    def __init__(self, args):
+        self.args = args
+        self.url = args.url.rstrip("/") + args.endpoint
+        self.samples = []  # (latency_ms, status or error string)
+
+    def payload(self, i: int) -> Dict[str, Any]:
+        case = TEST_TRANSCRIPTS[i % len(TEST_TRANSCRIPTS)]
+        return {"transcript": case["transcript"], "bypass_cache": self.args.bypass_cache}
+
+    async def send(self, client: httpx.AsyncClient, i: int, scheduled: float):
+        try:
+            response = await client.post(self.url, json=self.payload(i))
+            outcome = response.status_code
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        self.samples.append(((time.perf_counter() - scheduled) * 1000.0, outcome))
+
+    async def closed_loop(self, client: httpx.AsyncClient):
+        counter = iter(range(self.args.requests or 100))
+
+        async def worker():
+            for i in counter:
+                await self.send(client, i, time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, client: httpx.AsyncClient):
+        total = self.args.requests or int(self.args.rate * self.args.duration)
+        start = time.perf_counter()
+        scheduled = start
+        tasks = []
+        for i in range(total):
+            scheduled += random.expovariate(self.args.rate)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.send(client, i, scheduled)))
+        await asyncio.gather(*tasks)
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(timeout=self.args.timeout, limits=limits) as client:
+            # One warm-up request so connection setup is not in the numbers
+            await client.post(self.url, json=self.payload(0))
+            started = time.perf_counter()
+            if self.args.rate:
+                await self.open_loop(client)
+            else:
+                await self.closed_loop(client)
+            elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        ok = sorted(latency for latency, outcome in self.samples if outcome == 200)
+        errors = {}
+        for _, outcome in self.samples:
+            if outcome != 200:
+                errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+        total = len(self.samples)
+        return {
+            "config": {
+                "url": self.url,
+                "mode": "open_loop" if self.args.rate else "closed_loop",
+                "concurrency": self.args.concurrency,
+                "rate": self.args.rate,
+                "requests": total,
+                "bypass_cache": self.args.bypass_cache,
+                "stub_llm": self.args.stub_llm,
+                "stub_latency_ms": self.args.stub_latency_ms if self.args.stub_llm else None,
+                "stub_failure_rate": self.args.stub_failure_rate if self.args.stub_llm else None,
+            },
+            "summary": {
+                "duration_s": elapsed,
+                "successful": len(ok),
+                "failed": total - len(ok),
+                "error_rate": (total - len(ok)) / total if total else 0.0,
+                "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+                "errors": errors,
+            },
+            "latency_ms": {
+                "mean": sum(ok) / len(ok) if ok else 0.0,
+                "p50": percentile(ok, 50),
+                "p90": percentile(ok, 90),
+                "p95": percentile(ok, 95),
+                "p99": percentile(ok, 99),
+                "max": ok[-1] if ok else 0.0,
+            },
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+
+# Cold start
+def import_main(env: dict, importtime: bool = False) -> subprocess.CompletedProcess:
+    options = ["-X", "importtime"] if importtime else []
+    result = subprocess.run([sys.executable, *options, "-c", IMPORT_PROBE], capture_output=True, text=True, env=env)
+    if result.returncode:
+        raise SystemExit(f"import main failed:\n{result.stderr[-2000:]}")
+    return result
+
+
+def import_time(env: dict) -> float:
+    """Milliseconds `import main` takes in a fresh interpreter"""
+    return float(import_main(env).stdout.split()[-1]) * 1000
+
+
+def slowest_packages(env: dict, top: int = 10) -> dict:
+    """Self time per top-level package while importing main, from -X importtime"""
+    packages = {}
+    for line in import_main(env, importtime=True).stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[0].startswith("import time:") or "self" in parts[0]:
+            continue
+        package = parts[2].strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(parts[0].split(":")[1]) / 1000
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {package: round(ms, 1) for package, ms in slowest}
+
+
+def time_to_live(env: dict, port: int, timeout: float = 30) -> float:
+    """Milliseconds from starting a uvicorn process until /health/live answers"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--log-level", "warning"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health/live", timeout=1).status_code == 200:
+                    return (time.perf_counter() - started) * 1000
+            except httpx.HTTPError:
+                time.sleep(0.02)
+        raise SystemExit(f"Server did not answer /health/live within {timeout:.0f}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def measure_startup(args) -> Dict[str, Any]:
+    env = dict(os.environ)
+    imports = [import_time(env) for _ in range(args.startup_runs)]
+    median = statistics.median(imports)
+    return {
+        "config": {"runs": args.startup_runs, "import_budget_ms": args.import_budget_ms,
+                   "llm_backend": env.get("LLM_BACKEND", "gemini")},
+        "import_ms": {"median": median, "min": min(imports), "max": max(imports)},
+        "slowest_packages_ms": slowest_packages(env),
+        "time_to_live_ms": time_to_live(env, args.stub_port),
+        "within_budget": median <= args.import_budget_ms,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def print_startup_report(report: Dict[str, Any]):
+    imports = report["import_ms"]
+    print("\n" + "=" * 60)
+    print("🚀 STARTUP REPORT")
+    print("=" * 60)
+    print(f"import main: median {imports['median']:.0f} ms | min {imports['min']:.0f} | max {imports['max']:.0f} "
+          f"(budget {report['config']['import_budget_ms']:.0f} ms, {report['config']['runs']} runs)")
+    print(f"Process start to /health/live: {report['time_to_live_ms']:.0f} ms")
+    print("Slowest packages (self time):")
+    for package, ms in report["slowest_packages_ms"].items():
+        print(f"   {package:<24} {ms:7.1f} ms")
+    if not report["within_budget"]:
+        print("❌ Import time is over budget")
+
+
+def print_report(report: Dict[str, Any]):
+    config, summary, latency = report["config"], report["summary"], report["latency_ms"]
+    print("\n" + "=" * 60)
+    print("📈 LOAD TEST REPORT")
+    print("=" * 60)
+    print(f"Target: {config['url']} ({config['mode']}, concurrency {config['concurrency']}"
+          + (f", {config['rate']} req/s" if config['rate'] else "") + ")")
+    if config["stub_llm"]:
+        print(f"LLM: synthetic ({config['stub_latency_ms']} ms mean latency, "
+              f"{config['stub_failure_rate'] * 100:.0f}% failures)")
+    print(f"Requests: {config['requests']} | Successful: {summary['successful']} | Failed: {summary['failed']}")
+    print(f"Error Rate: {summary['error_rate'] * 100:.1f}%")
+    print(f"Throughput: {summary['throughput_rps']:.2f} req/s over {summary['duration_s']:.1f}s")
+    print(f"Latency (ms): p50 {latency['p50']:.0f} | p95 {latency['p95']:.0f} | "
+          f"p99 {latency['p99']:.0f} | max {latency['max']:.0f}")
+    if summary["errors"]:
+        print(f"Errors: {summary['errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the insights API with the validation dataset")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server base URL")
+    parser.add_argument("--endpoint", default="/analyze_call")
+    parser.add_argument("--concurrency", type=int, default=10, help="Workers (closed loop) / max connections")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Total requests (default: 100 closed loop, rate x duration open loop)")
+    parser.add_argument("--rate", type=float, default=0, help="Open-loop arrival rate in req/s")
+    parser.add_argument("--duration", type=float, default=30, help="Open-loop duration when --requests is 0")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--bypass-cache", action="store_true", help="Send bypass_cache so every request hits the LLM")
+    parser.add_argument("--stub-llm", action="store_true", help="Start a local server on the synthetic LLM backend")
+    parser.add_argument("--stub-latency-ms", type=float, default=800)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0, help="Fraction of synthetic calls failing with 503")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--startup", action="store_true", help="Measure import time and time to /health/live instead")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Fresh interpreters timed with --startup")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Median `import main` time allowed with --startup")
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.startup:
+        report = measure_startup(args)
+        print_startup_report(report)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Startup results saved to '{args.output}'")
+        raise SystemExit(0 if report["within_budget"] else 1)
+
+    server = None
+    if args.stub_llm:
+        server = start_stub_server(args.stub_port, args.stub_latency_ms, args.stub_failure_rate)
+        args.url = f"http://127.0.0.1:{args.stub_port}"
+    try:
+        report = asyncio.run(LoadTester(args).run())
+    finally:
+        if server:
+            server.terminate()
+
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Benchmark results saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Offline bulk processing of transcript archives.
+
+Streams a JSONL or CSV file through analyze_transcript with bounded
+concurrency and RPM/TPM token buckets, checkpointing progress by record
+offset so an interrupted backfill resumes where it stopped.
+
+Usage:
+python bulk_process.py calls.jsonl --output insights.jsonl --concurrency 16 --rpm 900
+python bulk_process.py calls.csv --db --batch-size 500 --resume
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Any, Dict, Iterator, Tuple
+
+from fastapi import HTTPException
+
+import main
+from db import DatabaseUnavailable
+from ratelimit import TokenBucket
+
+CHECKPOINT_EVERY = 100  # completed records between checkpoint writes
+
+
+def iter_records(path: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield (offset, record) one at a time; offset counts records, not bytes.
+    JSONL records are yielded as raw lines and parsed by the worker so one
+    malformed line is reported instead of aborting the run.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            yield from enumerate(csv.DictReader(f))
+        else:
+            yield from enumerate(f)
+
+
+def parse_record(record) -> Dict[str, Any]:
+    if isinstance(record, dict):
+        return record
+    record = record.strip()
+    if not record:
+        return {}
+    data = json.loads(record)
+    if not isinstance(data, dict):
+        raise ValueError("record is not a JSON object")
+    return data
+
+
+class BulkProcessor:
+    def __init__(self, args):
+        self.args = args
+        self.input_path = os.path.abspath(args.input)
+        self.checkpoint_path = args.checkpoint or args.input + ".checkpoint"
+        self.errors_path = args.errors or args.input + ".errors.jsonl"
+        self.requests = TokenBucket(args.rpm) if args.rpm else None
+        self.tokens = TokenBucket(args.tpm) if args.tpm else None
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+
+        self.start_offset = 0
+        self.next_offset = 0  # everything below this is durably written
+        self.done = set()     # completed offsets at or above next_offset
+        self.written = set()  # offsets past the checkpoint already in the output or errors file
+        self.pending_rows = []
+        self.pending_offsets = []
+        self.processed = 0
+        self.failed = 0
+        self.output = None
+        self.errors = None
+        self._since_checkpoint = 0
+        self._flush_lock = asyncio.Lock()
+
+    # Checkpointing
+    def load_checkpoint(self):
+        if not self.args.resume or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("input") != self.input_path:
+            raise SystemExit(f"Checkpoint {self.checkpoint_path} belongs to {checkpoint.get('input')}")
+        self.start_offset = self.next_offset = checkpoint["next_offset"]
+        print(f"Resuming from record {self.start_offset}")
+
+    def save_checkpoint(self):
+        checkpoint = {
+            "input": self.input_path,
+            "next_offset": self.next_offset,
+            "processed": self.processed,
+            "failed": self.failed,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def mark_done(self, offsets):
+        """Advance the contiguous watermark once offsets are durable"""
+        self.done.update(offsets)
+        while self.next_offset in self.done:
+            self.done.remove(self.next_offset)
+            self.next_offset += 1
+        self._since_checkpoint += len(offsets)
+        if self._since_checkpoint >= CHECKPOINT_EVERY:
+            self.save_checkpoint()
+            self._since_checkpoint = 0
+
+    # Output
+    def open_output(self, path: str):
+        """
+        Open an output file. On resume, records finished after the checkpoint
+        (they complete out of order) are already in it: note their offsets so
+        they are skipped instead of being written twice.
+        """
+        if not self.start_offset:
+            return open(path, "w", encoding="utf-8")
+        try:
+            with open(path, "rb+") as f:
+                position = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Cut short by the interruption; the record runs again
+                        f.truncate(position)
+                        break
+                    position += len(line)
+                    offset = json.loads(line).get("offset")
+                    if isinstance(offset, int) and offset >= self.start_offset:
+                        self.written.add(offset)
+        except FileNotFoundError:
+            pass
+        return open(path, "a", encoding="utf-8")
+
+    def record_uuid(self, offset: int) -> uuid.UUID:
+        # Deterministic per input record, so re-processing after a resume
+        # never writes the same call twice
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"file://{self.input_path}#{offset}")
+
+    def write_error(self, offset: int, record_id, error: str):
+        self.failed += 1
+        self.errors.write(json.dumps({"offset": offset, "id": record_id, "error": error}, ensure_ascii=False) + "\n")
+        self.errors.flush()
+
+    async def write_result(self, offset: int, record_id, transcript: str, insight):
+        record_uuid = self.record_uuid(offset)
+        self.processed += 1
+        if self.output:
+            self.output.write(json.dumps({
+                "offset": offset,
+                "id": record_id,
+                "record_uuid": str(record_uuid),
+                "insights": insight.model_dump(),
+            }, ensure_ascii=False) + "\n")
+            self.output.flush()
+            self.mark_done([offset])
+        else:
+            self.pending_rows.append((record_uuid, transcript, insight))
+            self.pending_offsets.append(offset)
+            if len(self.pending_rows) >= self.args.batch_size:
+                await self.flush_db()
+
+    async def flush_db(self):
+        async with self._flush_lock:
+            rows, offsets = self.pending_rows, self.pending_offsets
+            self.pending_rows, self.pending_offsets = [], []
+            if not rows:
+                return
+            delay = 1.0
+            while True:
+                try:
+                    inserted = await main.db.bulk_insert_call_records_if_absent(rows)
+                    break
+                except DatabaseUnavailable as e:
+                    print(f"Bulk insert of {len(rows)} rows failed, retrying: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60.0)
+            if main.rollups:
+                # Rows skipped as already stored were counted by an earlier run
+                for record_uuid, _, insight in rows:
+                    if record_uuid in inserted:
+                        main.rollups.add(insight)
+                await main.rollups.flush()
+            self.mark_done(offsets)
+
+    # Processing
+    async def process_record(self, offset: int, record):
+        try:
+            try:
+                record = parse_record(record)
+            except ValueError as e:
+                self.write_error(offset, None, f"Invalid record: {e}")
+                self.mark_done([offset])
+                return
+            transcript = record.get(self.args.field)
+            record_id = record.get(self.args.id_field)
+            if not transcript:
+                if record:
+                    self.write_error(offset, record_id, f"Missing '{self.args.field}' field")
+                self.mark_done([offset])
+                return
+
+            if self.requests:
+                await self.requests.acquire()
+            if self.tokens:
+                await self.tokens.acquire(main.estimate_tokens(transcript) + main.prompt_template.prefix_tokens["single"])
+
+            try:
+                insight = await main.analyze_transcript(transcript)
+            except HTTPException as e:
+                self.write_error(offset, record_id, e.detail)
+                self.mark_done([offset])
+                return
+            await self.write_result(offset, record_id, transcript, insight)
+        finally:
+            self.semaphore.release()
+
+    async def run(self):
+        self.load_checkpoint()
+        self.errors = self.open_output(self.errors_path)
+        if self.args.output:
+            self.output = self.open_output(self.args.output)
+        else:
+            await main.db.connect()
+
+        started = time.perf_counter()
+        tasks = set()
+        try:
+            for offset, record in iter_records(self.args.input, self.args.format):
+                if offset < self.start_offset:
+                    continue
+                if self.args.limit and offset >= self.start_offset + self.args.limit:
+                    break
+                if offset in self.written:
+                    self.mark_done([offset])
+                    continue
+                await self.semaphore.acquire()
+                task = asyncio.create_task(self.process_record(offset, record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await self.flush_db()
+        finally:
+            self.save_checkpoint()
+            self.errors.close()
+            if self.output:
+                self.output.close()
+            else:
+                await main.db.close()
+
+        elapsed = time.perf_counter() - started
+        print(f"Processed {self.processed} records ({self.failed} failed) in {elapsed:.1f}s "
+              f"- {self.processed / elapsed if elapsed else 0:.2f} records/s")
+        print(f"Checkpoint: next record {self.next_offset} -> {self.checkpoint_path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-analyze a JSONL/CSV transcript archive")
+    parser.add_argument("input", help="JSONL or CSV file of transcripts")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Input format (default: from extension)")
+    parser.add_argument("--field", default="transcript", help="Record field holding the transcript")
+    parser.add_argument("--id-field", default="id", help="Record field passed through as the caller's id")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max in-flight LLM calls")
+    parser.add_argument("--rpm", type=float, default=0, help="LLM requests per minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="Estimated LLM input tokens per minute (0 = unlimited)")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="Write insights to this JSONL file")
+    output.add_argument("--db", action="store_true", help="Bulk insert insights into call_records")
+    parser.add_argument("--batch-size", type=int, default=200, help="Rows per bulk insert in --db mode")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <input>.checkpoint)")
+    parser.add_argument("--errors", help="Failed records file (default: <input>.errors.jsonl)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many records")
+    args = parser.parse_args(argv)
+    if not args.format:
+        args.format = "csv" if args.input.lower().endswith(".csv") else "jsonl"
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(BulkProcessor(parse_args()).run())
+    except KeyboardInterrupt:
+        sys.exit("Interrupted - rerun with --resume to continue from the last checkpoint")
@@ -0,0 +1,169 @@
+"""
+Content-addressed cache for LLM insights.
+
+Keys are a SHA-256 over the normalized transcript, the prompt version and the
+model name, so a prompt or model change never serves stale extractions.
+Lookups go through an in-memory LRU tier with TTL first and, when enabled,
+the insight_cache table in PostgreSQL second. SingleFlight collapses
+concurrent misses for the same key onto one extraction.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+INSIGHT_CACHE_ENABLED = os.getenv("INSIGHT_CACHE_ENABLED", "true").lower() == "true"
+INSIGHT_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHT_CACHE_MAX_ENTRIES", "10000"))
+INSIGHT_CACHE_TTL = float(os.getenv("INSIGHT_CACHE_TTL", "86400"))
+INSIGHT_CACHE_PERSISTENT = os.getenv("INSIGHT_CACHE_PERSISTENT", "false").lower() == "true"
+INSIGHT_CACHE_DB_TTL = float(os.getenv("INSIGHT_CACHE_DB_TTL", "604800"))
+
+
+def normalize_transcript(transcript: str) -> str:
+    """Canonical form used for hashing: NFKC, case-folded, whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFKC", transcript).casefold().split())
+
+
+def transcript_fingerprint(transcript: str) -> str:
+    return hashlib.sha256(normalize_transcript(transcript).encode("utf-8")).hexdigest()
+
+
+def insight_cache_key(transcript: str, prompt_version: str, model: str) -> str:
+    fingerprint = transcript_fingerprint(transcript)
+    return hashlib.sha256(f"{model}\x00{prompt_version}\x00{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-memory LRU with per-entry TTL and a maximum entry count"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InsightCache:
+    def __init__(self, db=None,
+                 enabled: bool = INSIGHT_CACHE_ENABLED,
+                 max_entries: int = INSIGHT_CACHE_MAX_ENTRIES,
+                 ttl: float = INSIGHT_CACHE_TTL,
+                 persistent: bool = INSIGHT_CACHE_PERSISTENT,
+                 db_ttl: float = INSIGHT_CACHE_DB_TTL):
+        self.enabled = enabled
+        self.memory = LRUCache(max_entries, ttl)
+        self.db = db if persistent else None
+        self.db_ttl = db_ttl
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.db_errors = 0
+
+    async def get(self, key: str):
+        """Return the cached insight dict for key, or None"""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.db:
+            try:
+                value = await self.db.get_cached_insight(key, self.db_ttl)
+            except Exception as e:
+                self.db_errors += 1
+                print("Insight cache read failed:", e)
+            if value is not None:
+                self.db_hits += 1
+                self.memory.put(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: dict):
+        if not self.enabled:
+            return
+        self.memory.put(key, value)
+        if self.db:
+            try:
+                await self.db.put_cached_insight(key, value)
+            except Exception as e:
+                self.db_errors += 1
+                print("Insight cache write failed:", e)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "persistent": self.db is not None,
+            "entries": len(self.memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+            "evictions": self.memory.evictions,
+            "db_errors": self.db_errors,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key onto one in-flight task.
+    The work runs as its own task, so a leader whose client disconnects
+    does not cancel the result the other callers are waiting on.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        """Return (result, coalesced) where coalesced is True for followers"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        self.leaders += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
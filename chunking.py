@@ -0,0 +1,57 @@
+"""
+Splitting long transcripts into token-bounded chunks on speaker turns.
+"""
+
+import re
+
+from llm import estimate_tokens
+
+SPEAKER_TURN = re.compile(r"(?=\b(?:Agent|Customer)\s*:)", re.IGNORECASE)
+
+
+def split_turns(transcript: str) -> list:
+    """Split on 'Agent:' / 'Customer:' markers, keeping each marker with its turn"""
+    return [turn.strip() for turn in SPEAKER_TURN.split(transcript) if turn.strip()]
+
+
+def _split_long_turn(turn: str, max_tokens: int) -> list:
+    """Break a single turn that alone exceeds the budget at word boundaries"""
+    max_chars = max_tokens * 4
+    pieces, current = [], ""
+    for word in turn.split():
+        if current and len(current) + len(word) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_transcript(transcript: str, max_tokens: int, overlap_turns: int = 1) -> list:
+    """
+    Greedily pack speaker turns into chunks of at most max_tokens. The last
+    overlap_turns turns of a chunk are repeated at the start of the next one
+    so each chunk keeps the context of what was just said.
+    """
+    turns = []
+    for turn in split_turns(transcript):
+        if estimate_tokens(turn) > max_tokens:
+            turns.extend(_split_long_turn(turn, max_tokens))
+        else:
+            turns.append(turn)
+
+    chunks, current, used = [], [], 0
+    for turn in turns:
+        tokens = estimate_tokens(turn)
+        if current and used + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current = current[-overlap_turns:] if overlap_turns else []
+            used = sum(estimate_tokens(t) for t in current)
+            if used + tokens > max_tokens:
+                current, used = [], 0
+        current.append(turn)
+        used += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
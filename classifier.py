@@ -0,0 +1,407 @@
+"""
+Local pre-classifier for short, routine calls.
+
+Most pre-due calls are near-identical reminders ending in a promise to pay.
+LocalClassifier predicts call_purpose, overall_sentiment and action_required
+for them without an LLM call, from
+- Hinglish keyword rules, and
+- optionally a naive Bayes model over word uni- and bigrams, trained with
+  `python classifier.py train` on the insights the LLM already stored.
+Each field gets a confidence; when rules and model disagree it is 0. The
+call's confidence is the lowest of the three, and the LLM is used when it
+falls below LOCAL_CLASSIFIER_THRESHOLD. Transcripts that are long or mention
+disputes, hardship, settlements or legal action always go to the LLM.
+
+Fields the classifier cannot judge are filled from templates; the summary
+says the call was classified locally and with what confidence. The agent
+rating and the start/end sentiments are placeholders, so these calls are
+stored with classified_locally set and left out of the rating averages,
+training and the similarity index.
+
+Usage:
+python classifier.py train --since 2025-01-01 --output classifier_model.json
+python classifier.py evaluate --llm --output classifier_report.json
+"""
+
+import os
+import re
+import json
+import math
+import asyncio
+import argparse
+import datetime
+
+from dotenv import load_dotenv
+
+# Before the LOCAL_CLASSIFIER_* settings below are read
+load_dotenv()
+
+from llm import estimate_tokens
+
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "false").lower() == "true"
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8"))
+LOCAL_CLASSIFIER_MAX_TOKENS = int(os.getenv("LOCAL_CLASSIFIER_MAX_TOKENS", "400"))
+LOCAL_CLASSIFIER_MODEL = os.getenv("LOCAL_CLASSIFIER_MODEL")
+
+PLACEHOLDER_AGENT_RATING = 5
+LOCAL_SUMMARY_MARKER = "Classified locally"
+
+FIELDS = ("call_purpose", "overall_sentiment", "action_required")
+
+# Stored call_purpose values are free text; the classifier works on these
+PURPOSE_KEYWORDS = {
+    "Payment Reminder": ("reminder",),
+    "Collection": ("collection",),
+    "Recovery": ("recovery", "settlement", "legal"),
+}
+
+PURPOSE_RULES = {
+    "Payment Reminder": [r"\breminder\b", r"\bdue date\b", r"\bdue (?:hai|next week|kal)\b",
+                         r"\bjust (?:confirming|a reminder)\b", r"\bupcoming (?:emi|payment)\b"],
+    "Collection": [r"\b\d+ (?:din|days) se (?:due|overdue)\b", r"\boverdue\b", r"\bdefault\b",
+                   r"\blate (?:payment )?fees?\b", r"\bbucket\b"],
+    "Recovery": [r"\blegal (?:notice|process|action)\b", r"\bfield (?:agent|team|visit)\b",
+                 r"\brecovery\b", r"\b(?:[6-9]\d|\d{3,}) days\b"],
+}
+
+NEGATIVE_CUES = [r"\bharass", r"\bnot fair\b", r"\bfaltu\b", r"\bmat karo\b", r"\buff\b", r"\bno way\b",
+                 r"\btension\b", r"\bpareshan", r"\bgussa\b", r"\bbakwas\b", r"\birritat", r"\bnot acceptable\b",
+                 r"\bexcuses?\b", r"\bdeep trouble\b", r"\bcomplain", r"\bangry\b", r"\bfrustrat"]
+POSITIVE_CUES = [r"\bthank(?:s| you)\b", r"\bdhanyavaad\b", r"\bshukriya\b", r"\bno problem\b",
+                 r"\bgreat\b", r"\bhappy\b", r"\bdon't worry\b", r"\bdefinitely\b"]
+
+PROMISE_CUES = [r"\bptp\b", r"\bpromise\b", r"\bkar (?:dunga|dungi|doonga|deta|deti|denge)\b",
+                r"\bkarunga\b", r"\bkarungi\b", r"\bpay kar\w*\b", r"\bclear kar\w*\b", r"\bbhej (?:do|dunga)\b"]
+DATE_PATTERN = re.compile(r"\b(\d{1,2}(?:st|nd|rd|th)|monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+                          r"|next week|kal|tomorrow)\b", re.IGNORECASE)
+
+# Calls with these need reasons, disputes or negotiations extracted properly
+COMPLEX_CUES = [r"\bdispute", r"\bsettle", r"\bots\b", r"\blegal\b", r"\bjob (?:nahi|loss|chali)",
+                r"\blost (?:my|his|her) job\b", r"\baccident\b", r"\bhospital\b", r"\bhardship\b",
+                r"\brestructur", r"\bfraud\b", r"\bwrong (?:charge|amount)\b", r"\bgalat\b"]
+
+
+def _compile(patterns):
+    return [re.compile(p, re.IGNORECASE) for p in patterns]
+
+
+def _hits(patterns, text: str) -> int:
+    return sum(1 for p in patterns if p.search(text))
+
+
+def normalize_purpose(call_purpose: str):
+    lowered = call_purpose.lower()
+    for purpose, keywords in PURPOSE_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return purpose
+    return None
+
+
+def tokenize(text: str) -> list:
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NgramModel:
+    """Multinomial naive Bayes per field over word uni- and bigrams"""
+
+    def __init__(self, fields: dict = None):
+        # field -> label -> {"docs": n, "tokens": n, "counts": {ngram: n}}
+        self.fields = fields or {}
+
+    def train(self, examples):
+        """examples: iterable of (transcript, {field: label})"""
+        for transcript, labels in examples:
+            grams = tokenize(transcript)
+            for field, label in labels.items():
+                if label is None:
+                    continue
+                stats = self.fields.setdefault(field, {}).setdefault(
+                    str(label), {"docs": 0, "tokens": 0, "counts": {}})
+                stats["docs"] += 1
+                stats["tokens"] += len(grams)
+                for gram in grams:
+                    stats["counts"][gram] = stats["counts"].get(gram, 0) + 1
+
+    def predict(self, field: str, transcript: str):
+        """(label, probability), or None for a field the model has not seen"""
+        labels = self.fields.get(field)
+        if not labels:
+            return None
+        grams = tokenize(transcript)
+        vocabulary = len({gram for stats in labels.values() for gram in stats["counts"]}) or 1
+        total_docs = sum(stats["docs"] for stats in labels.values())
+        scores = {}
+        for label, stats in labels.items():
+            denominator = stats["tokens"] + vocabulary
+            score = math.log(stats["docs"] / total_docs)
+            for gram in grams:
+                score += math.log((stats["counts"].get(gram, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.fields, f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+
+class LocalClassifier:
+    def __init__(self, model: NgramModel = None,
+                 threshold: float = LOCAL_CLASSIFIER_THRESHOLD,
+                 max_tokens: int = LOCAL_CLASSIFIER_MAX_TOKENS):
+        self.model = model
+        self.threshold = threshold
+        self.max_tokens = max_tokens
+        self.purpose_rules = {purpose: _compile(patterns) for purpose, patterns in PURPOSE_RULES.items()}
+        self.negative = _compile(NEGATIVE_CUES)
+        self.positive = _compile(POSITIVE_CUES)
+        self.promise = _compile(PROMISE_CUES)
+        self.complex = _compile(COMPLEX_CUES)
+
+    @classmethod
+    def from_env(cls):
+        model = NgramModel.load(LOCAL_CLASSIFIER_MODEL) if LOCAL_CLASSIFIER_MODEL else None
+        return cls(model)
+
+    def eligible(self, transcript: str) -> bool:
+        return estimate_tokens(transcript) <= self.max_tokens and not _hits(self.complex, transcript)
+
+    def rule_predictions(self, transcript: str) -> dict:
+        """{field: (label, confidence)} for the fields the rules can decide"""
+        predictions = {}
+
+        purpose_hits = {purpose: _hits(rules, transcript) for purpose, rules in self.purpose_rules.items()}
+        purpose = max(purpose_hits, key=purpose_hits.get)
+        if purpose_hits[purpose]:
+            predictions["call_purpose"] = (purpose, min(0.95, purpose_hits[purpose] / (sum(purpose_hits.values()) + 0.2)))
+
+        negative = _hits(self.negative, transcript)
+        positive = _hits(self.positive, transcript)
+        if negative >= 2:
+            predictions["overall_sentiment"] = ("Negative", min(0.95, 0.6 + 0.1 * negative))
+        elif negative == 1:
+            predictions["overall_sentiment"] = ("Neutral", 0.55)
+        elif positive:
+            # Collection calls are rarely positive; courtesy phrases make them neutral
+            predictions["overall_sentiment"] = ("Neutral", 0.85 if positive <= 3 else 0.6)
+        else:
+            # No cue either way is no evidence; below the threshold unless the model agrees
+            predictions["overall_sentiment"] = ("Neutral", 0.5)
+
+        promises = _hits(self.promise, transcript)
+        if promises and DATE_PATTERN.search(transcript):
+            predictions["action_required"] = (True, 0.9)
+        elif promises:
+            predictions["action_required"] = (True, 0.75)
+        else:
+            predictions["action_required"] = (False, 0.6)
+        return predictions
+
+    def predict(self, transcript: str) -> dict:
+        """{field: (label, confidence)} combining the rules with the n-gram model"""
+        rules = self.rule_predictions(transcript)
+        combined = {}
+        for field in FIELDS:
+            rule = rules.get(field)
+            learned = self.model.predict(field, transcript) if self.model else None
+            if learned and field == "action_required":
+                learned = (learned[0] == "True", learned[1])
+            if rule and learned:
+                if rule[0] == learned[0]:
+                    combined[field] = (rule[0], 1 - (1 - rule[1]) * (1 - learned[1]))
+                else:
+                    combined[field] = (rule[0], 0.0)
+            elif rule or learned:
+                combined[field] = rule or learned
+            else:
+                combined[field] = (None, 0.0)
+        return combined
+
+    def classify(self, transcript: str):
+        """
+        (insight dict, confidence); the insight is None below the threshold
+        and both are None when the call is not eligible
+        """
+        if not self.eligible(transcript):
+            return None, None
+        predictions = self.predict(transcript)
+        confidence = min(conf for _, conf in predictions.values())
+        if confidence < self.threshold:
+            return None, confidence
+        return self.insight(transcript, predictions, confidence), confidence
+
+    def insight(self, transcript: str, predictions: dict, confidence: float) -> dict:
+        purpose = predictions["call_purpose"][0]
+        sentiment = predictions["overall_sentiment"][0]
+        action_required = predictions["action_required"][0]
+        promised = bool(_hits(self.promise, transcript))
+        date = DATE_PATTERN.search(transcript)
+        if promised and date:
+            key_results = f"PTP for {date.group(1)}"
+        elif promised:
+            key_results = "Customer committed to pay"
+        else:
+            key_results = "No commitment recorded"
+        intent = f"{purpose} Response with PTP" if promised else f"{purpose} Acknowledgement"
+        return {
+            "customer_intent": intent,
+            "call_purpose": purpose,
+            "call_objective_met": promised,
+            "key_results": key_results,
+            "customer_statements_analysis": "Routine call; customer statements not analyzed in detail.",
+            "non_payment_reasons": "None stated",
+            "sentiment_start": sentiment,
+            "sentiment_end": sentiment,
+            "overall_sentiment": sentiment,
+            "agent_performance_rating": PLACEHOLDER_AGENT_RATING,
+            "agent_performance_feedback": "Not assessed for locally classified calls.",
+            "action_required": action_required,
+            "summary": f"{purpose} call; {key_results[0].lower() + key_results[1:]}. "
+                       f"({LOCAL_SUMMARY_MARKER}, confidence {confidence:.2f})",
+        }
+
+
+# Training and evaluation
+async def load_training_examples(db, since: datetime.datetime, limit: int) -> list:
+    """LLM-labelled (transcript, labels) pairs, excluding locally classified rows"""
+    rows = await db.fetch("""
+        SELECT t.transcript, r.call_purpose, r.overall_sentiment, r.action_required
+        FROM call_records r JOIN call_transcripts t ON t.transcript_hash = r.transcript_hash
+        WHERE r.created_at >= $1 AND NOT r.classified_locally
+        ORDER BY r.created_at DESC
+        LIMIT $2
+    """, since, limit)
+    return [(row["transcript"], {
+        "call_purpose": normalize_purpose(row["call_purpose"]),
+        "overall_sentiment": row["overall_sentiment"],
+        "action_required": str(row["action_required"]),
+    }) for row in rows]
+
+
+def field_matches(field: str, predicted, reference) -> bool:
+    if field == "call_purpose":
+        return predicted is not None and predicted == normalize_purpose(reference)
+    return predicted == reference
+
+
+async def evaluate(classifier: LocalClassifier, with_llm: bool) -> dict:
+    from test_pipeline import TEST_TRANSCRIPTS
+
+    generate_insights = None
+    if with_llm:
+        from main import generate_insights
+
+    cases, accepted = [], 0
+    agreement = {"expected": {f: 0 for f in FIELDS}, "llm": {f: 0 for f in FIELDS},
+                 "llm_accepted": {f: 0 for f in FIELDS}}
+    llm_results = 0
+    for case in TEST_TRANSCRIPTS:
+        transcript = case["transcript"]
+        predictions = classifier.predict(transcript)
+        confidence = min(conf for _, conf in predictions.values())
+        is_accepted = classifier.eligible(transcript) and confidence >= classifier.threshold
+        accepted += is_accepted
+        entry = {"id": case["id"], "stage": case["stage"], "eligible": classifier.eligible(transcript),
+                 "confidence": round(confidence, 3), "accepted": is_accepted,
+                 "local": {f: predictions[f][0] for f in FIELDS}}
+
+        expected = {"call_purpose": case["expected_call_purpose"],
+                    "overall_sentiment": case["expected_overall_sentiment"],
+                    "action_required": case["expected_action_required"]}
+        for f in FIELDS:
+            agreement["expected"][f] += field_matches(f, predictions[f][0], expected[f])
+
+        if generate_insights:
+            try:
+                insight = (await generate_insights(transcript)).model_dump()
+                entry["llm"] = {f: insight[f] for f in FIELDS}
+                llm_results += 1
+                for f in FIELDS:
+                    match = field_matches(f, predictions[f][0], insight[f])
+                    agreement["llm"][f] += match
+                    agreement["llm_accepted"][f] += match and is_accepted
+            except Exception as e:
+                entry["llm_error"] = str(getattr(e, "detail", e))
+        cases.append(entry)
+
+    total = len(TEST_TRANSCRIPTS)
+    report = {
+        "threshold": classifier.threshold,
+        "model": LOCAL_CLASSIFIER_MODEL,
+        "transcripts": total,
+        "accepted": accepted,
+        "coverage": accepted / total,
+        "agreement_with_expected": {f: n / total for f, n in agreement["expected"].items()},
+        "cases": cases,
+    }
+    if generate_insights:
+        report["agreement_with_llm"] = {f: n / llm_results if llm_results else None
+                                        for f, n in agreement["llm"].items()}
+        report["agreement_with_llm_when_accepted"] = {f: n / accepted if accepted else None
+                                                      for f, n in agreement["llm_accepted"].items()}
+    return report
+
+
+def print_report(report: dict):
+    print(f"Threshold {report['threshold']}: {report['accepted']}/{report['transcripts']} "
+          f"transcripts classified locally ({report['coverage']:.0%})")
+    for key in ("agreement_with_expected", "agreement_with_llm", "agreement_with_llm_when_accepted"):
+        if key in report:
+            rates = ", ".join(f"{f} {rate:.0%}" if rate is not None else f"{f} -"
+                              for f, rate in report[key].items())
+            print(f"{key.replace('_', ' ').capitalize()}: {rates}")
+    for case in report["cases"]:
+        marker = "local" if case["accepted"] else "llm"
+        print(f"  #{case['id']:<3} {case['stage']:<42} conf {case['confidence']:.2f} -> {marker:<5} {case['local']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local pre-classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="Fit the n-gram model on stored LLM insights")
+    train_parser.add_argument("--since", type=datetime.datetime.fromisoformat, required=True)
+    train_parser.add_argument("--limit", type=int, default=50000)
+    train_parser.add_argument("--output", default="classifier_model.json")
+    evaluate_parser = commands.add_parser("evaluate", help="Report agreement on the validation transcripts")
+    evaluate_parser.add_argument("--llm", action="store_true", help="Also compare with the configured LLM")
+    evaluate_parser.add_argument("--threshold", type=float, default=LOCAL_CLASSIFIER_THRESHOLD)
+    evaluate_parser.add_argument("--output", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    if args.command == "train":
+        from db import Database
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            raise SystemExit("DATABASE_URL not found in .env")
+        db = Database(dsn, min_size=1, max_size=1, command_timeout=600, health_check_interval=0)
+        await db.connect()
+        try:
+            examples = await load_training_examples(db, args.since, args.limit)
+        finally:
+            await db.close()
+        model = NgramModel()
+        model.train(examples)
+        model.save(args.output)
+        print(f"Trained on {len(examples)} stored insights, model written to {args.output}")
+        return
+
+    classifier = LocalClassifier.from_env()
+    classifier.threshold = args.threshold
+    report = await evaluate(classifier, args.llm)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,225 @@
+"""
+One LLM budget shared by the worker processes of serve.py.
+
+Each worker process has its own LLMClient. Left alone, every worker would
+run its own AIMD limit and RPM/TPM buckets, and N workers together would
+send N times the Gemini quota. With LLM_COORDINATOR_SOCKET set (serve.py does
+this), LLMClient instead gets its slots and rate tokens from the coordinator
+running in the serve.py parent process, over a local Unix socket:
+- the coordinator owns a single PriorityScheduler, so the AIMD limit,
+  priority classes and tenant quotas apply across all workers,
+- it owns the LLM_RPM / LLM_TPM token buckets,
+- slots held by a worker that disconnects or dies are returned at once.
+
+The protocol is one JSON object per line. A request carries an id and the
+reply echoes it:
+  {"id": 1, "op": "acquire", "priority": "bulk", "tenant": null} -> {"id": 1, "stats": {...}}
+  {"id": 2, "op": "release", "ticket": 1, "outcome": "success"}    (no reply)
+  {"id": 3, "op": "cancel", "ticket": 1}                           (no reply)
+  {"id": 4, "op": "pace", "bucket": "tokens", "amount": 900}        -> {"id": 4}
+"""
+
+import os
+import json
+import time
+import asyncio
+import itertools
+
+from llm import LLM_RPM, LLM_TPM
+from metrics import LLM_QUEUE_WAIT
+from ratelimit import TokenBucket
+from scheduler import PriorityScheduler, current_priority, priority
+
+LLM_COORDINATOR_SOCKET = os.getenv("LLM_COORDINATOR_SOCKET")
+
+STREAM_LIMIT = 1 << 20
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class CoordinatorServer:
+    def __init__(self, path: str, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.path = path
+        self.scheduler = PriorityScheduler()
+        self.buckets = {
+            "requests": TokenBucket(rpm) if rpm else None,
+            "tokens": TokenBucket(tpm) if tpm else None,
+        }
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=STREAM_LIMIT)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.scheduler.limit),
+            "in_flight": self.scheduler.in_flight,
+            "throttle_events": self.scheduler.throttle_events,
+            "classes": self.scheduler.stats(),
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        granted = {}  # ticket id -> scheduler ticket
+        pending = {}  # request id -> task waiting for a slot or rate tokens
+
+        def reply(message: dict):
+            if not writer.is_closing():
+                writer.write(encode(message))
+
+        async def acquire(request_id, priority_class, tenant):
+            with priority(priority_class, tenant):
+                granted[request_id] = await self.scheduler.acquire()
+            reply({"id": request_id, "stats": self.snapshot()})
+
+        async def pace(request_id, bucket, amount):
+            if self.buckets.get(bucket):
+                await self.buckets[bucket].acquire(amount)
+            reply({"id": request_id})
+
+        def run(request_id, coro):
+            task = asyncio.create_task(coro)
+            pending[request_id] = task
+            task.add_done_callback(lambda _: pending.pop(request_id, None))
+
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message["op"]
+                if op == "acquire":
+                    run(message["id"], acquire(message["id"], message.get("priority"), message.get("tenant")))
+                elif op == "pace":
+                    run(message["id"], pace(message["id"], message["bucket"], message.get("amount", 1)))
+                elif op in ("release", "cancel"):
+                    task = pending.get(message["ticket"])
+                    if task:
+                        task.cancel()
+                    ticket = granted.pop(message["ticket"], None)
+                    if ticket is not None:
+                        await self.scheduler.release(message.get("outcome", "cancelled"), ticket)
+        except (ConnectionError, ValueError, KeyError) as e:
+            print("Coordinator connection dropped:", e)
+        finally:
+            # A worker that went away gives back everything it held or waited for
+            for task in list(pending.values()):
+                task.cancel()
+            for ticket in granted.values():
+                await self.scheduler.release("cancelled", ticket)
+            self.connections -= 1
+            writer.close()
+
+
+class CoordinatorClient:
+    """Worker side: one connection per process, opened on first use"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ids = itertools.count(1)
+        self._replies = {}
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+
+    async def _connect(self):
+        if self._writer is not None and not self._writer.is_closing():
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            reader, self._writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+            self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                future = self._replies.pop(message["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        finally:
+            # Coordinator gone: fail everything still waiting so LLMClient can report it
+            for future in self._replies.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("LLM coordinator connection lost"))
+            self._replies.clear()
+            self._writer.close()
+
+    async def send(self, message: dict):
+        """Send a message that gets no reply"""
+        await self._connect()
+        self._writer.write(encode({"id": next(self._ids), **message}))
+
+    async def request(self, message: dict) -> tuple:
+        """Send message with a fresh id and wait for the reply; returns (id, reply)"""
+        await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._replies[request_id] = future
+        self._writer.write(encode({"id": request_id, **message}))
+        try:
+            return request_id, await future
+        except asyncio.CancelledError:
+            self._replies.pop(request_id, None)
+            # Withdraws the request, or returns the slot if it was granted meanwhile
+            if not self._writer.is_closing():
+                self._writer.write(encode({"id": next(self._ids), "op": "cancel", "ticket": request_id}))
+            raise
+
+
+class RemoteBucket:
+    """TokenBucket stand-in drawing from the coordinator's bucket"""
+
+    def __init__(self, client: CoordinatorClient, bucket: str):
+        self.client = client
+        self.bucket = bucket
+
+    async def acquire(self, amount: float = 1):
+        await self.client.request({"op": "pace", "bucket": self.bucket, "amount": amount})
+
+
+class CoordinatedLimiter:
+    """
+    Limiter for LLMClient that takes its slots from the coordinator. limit,
+    in_flight, throttle_events and stats() reflect the whole deployment as of
+    the last slot this worker was granted.
+    """
+
+    def __init__(self, client: CoordinatorClient):
+        self.client = client
+        self.limit = 0
+        self.in_flight = 0
+        self.throttle_events = 0
+        self.classes = {}
+
+    async def acquire(self) -> int:
+        priority_class, tenant = current_priority()
+        started = time.perf_counter()
+        ticket, message = await self.client.request({"op": "acquire", "priority": priority_class, "tenant": tenant})
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - started, priority=priority_class)
+        stats = message["stats"]
+        self.limit = stats["limit"]
+        self.in_flight = stats["in_flight"]
+        self.throttle_events = stats["throttle_events"]
+        self.classes = stats["classes"]
+        return ticket
+
+    async def release(self, outcome: str, ticket: int = None):
+        await self.client.send({"op": "release", "ticket": ticket, "outcome": outcome})
+
+    def stats(self) -> dict:
+        return self.classes
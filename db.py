@@ -0,0 +1,1053 @@
+"""
+PostgreSQL storage layer for call_records.
+
+A pooled replacement for the single shared asyncpg connection. Every pooled
+connection prepares the call_records insert once when it is opened, a
+background task health-checks the pool, and connection failures expire the
+pool so the next acquire reconnects instead of taking the service down.
+
+call_records is range partitioned by month on created_at and keeps only the
+SHA-256 of each transcript; the text itself is stored once in the compressed
+call_transcripts table. A maintenance task creates upcoming partitions and,
+with CALL_RECORDS_RETENTION_MONTHS set, drops expired ones. It runs only for
+a Database created with maintenance=True (the service), never for the CLIs.
+
+The service does not run DDL when it starts: `python storage.py migrate`
+creates and upgrades the schema and records SCHEMA_VERSION, and connect()
+only checks that version. The pool itself is opened on first use (or by
+the service's warm-up), not when the module is imported.
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import datetime
+import contextlib
+import asyncpg
+
+from cache import INSIGHT_CACHE_DB_TTL
+
+# Pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10"))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+# Run the migrations on connect instead of requiring `python storage.py migrate`, for development
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+# Errors that mean the connection (not the query) is broken
+CONNECTION_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    ConnectionError,
+    OSError,
+)
+
+# Monthly partitioned storage layout
+CALL_RECORDS_PARTITIONS_AHEAD = int(os.getenv("CALL_RECORDS_PARTITIONS_AHEAD", "2"))
+CALL_RECORDS_RETENTION_MONTHS = int(os.getenv("CALL_RECORDS_RETENTION_MONTHS", "0"))
+CALL_RECORDS_MAINTENANCE_INTERVAL = float(os.getenv("CALL_RECORDS_MAINTENANCE_INTERVAL", "3600"))
+
+# pg_advisory_lock keys so replicas don't run DDL at the same time
+SCHEMA_LOCK_ID = 7301001
+PARTITION_LOCK_ID = 7301002
+
+# Bumped whenever migrate() changes the schema
+SCHEMA_VERSION = 3
+
+PARTITION_NAME = re.compile(r"^call_records_p(\d{4})_(\d{2})$")
+
+# Raw transcripts, stored once per distinct text and compressed. last_seen_at
+# is refreshed at most daily by inserts so retention can find unused ones.
+CREATE_CALL_TRANSCRIPTS = """
+    CREATE TABLE IF NOT EXISTS call_transcripts (
+        transcript_hash BYTEA PRIMARY KEY,
+        transcript TEXT NOT NULL,
+        last_seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS call_transcripts_last_seen_idx ON call_transcripts (last_seen_at);
+    -- Compress transcripts from 256 bytes instead of ~2 KB, with lz4 where available
+    ALTER TABLE call_transcripts SET (toast_tuple_target = 256);
+    DO $$ BEGIN
+        EXECUTE 'ALTER TABLE call_transcripts ALTER COLUMN transcript SET COMPRESSION lz4';
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'lz4 compression unavailable, call_transcripts uses pglz';
+    END $$;
+"""
+
+# Insight rows reference their transcript by SHA-256 and are range
+# partitioned by month, so retention drops whole partitions. Rows outside
+# every monthly partition land in the default one instead of failing.
+CREATE_CALL_RECORDS = """
+    CREATE TABLE IF NOT EXISTS call_records (
+        id SERIAL,
+        record_uuid UUID NOT NULL,
+        transcript_hash BYTEA NOT NULL,
+        intent TEXT NOT NULL,
+        call_purpose TEXT NOT NULL,
+        call_objective_met BOOLEAN NOT NULL,
+        key_results TEXT NOT NULL,
+        customer_statements_analysis TEXT NOT NULL,
+        non_payment_reasons TEXT NOT NULL,
+        sentiment_start TEXT NOT NULL,
+        sentiment_end TEXT NOT NULL,
+        overall_sentiment TEXT NOT NULL,
+        agent_performance_rating INTEGER NOT NULL,
+        agent_performance_feedback TEXT NOT NULL,
+        action_required BOOLEAN NOT NULL,
+        summary TEXT NOT NULL,
+        classified_locally BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    CREATE TABLE IF NOT EXISTS call_records_default PARTITION OF call_records DEFAULT;
+    -- Unique indexes on a partitioned table must include created_at, so
+    -- record_uuid is only indexed and inserts check for it explicitly
+    CREATE INDEX IF NOT EXISTS call_records_record_uuid_idx ON call_records (record_uuid);
+"""
+
+# Schema version 3 marks rows the local pre-classifier produced; their agent
+# rating and start/end sentiments are placeholders. Earlier rows are found by
+# the marker the classifier writes into the summary.
+ADD_CLASSIFIED_LOCALLY = """
+    ALTER TABLE call_records ADD COLUMN classified_locally BOOLEAN NOT NULL DEFAULT FALSE;
+    UPDATE call_records SET classified_locally = TRUE WHERE summary LIKE '%Classified locally%';
+"""
+
+# An unpartitioned call_records from before this layout is renamed out of the
+# way at startup; `python storage.py migrate-legacy` then moves its rows over.
+RENAME_LEGACY_CALL_RECORDS = """
+    ALTER TABLE call_records ADD COLUMN IF NOT EXISTS record_uuid UUID;
+    ALTER TABLE call_records RENAME TO call_records_legacy;
+    ALTER TABLE call_records_legacy RENAME CONSTRAINT call_records_pkey TO call_records_legacy_pkey;
+    ALTER SEQUENCE call_records_id_seq RENAME TO call_records_legacy_id_seq;
+    DROP INDEX IF EXISTS call_records_record_uuid_idx, call_records_created_idx,
+        call_records_sentiment_created_idx, call_records_purpose_created_idx,
+        call_records_action_required_idx;
+"""
+
+# New ids continue after the legacy ones so migrated rows keep theirs
+CONTINUE_LEGACY_IDS = """
+    SELECT setval(pg_get_serial_sequence('call_records', 'id'),
+                  (SELECT coalesce(max(id), 0) + 1 FROM call_records_legacy), false)
+"""
+
+# Read-path indexes for the analytics API, created on the partitioned parent
+# so every partition gets them. The time-ordered index carries the
+# aggregated columns so stats over a time window are index-only scans.
+CREATE_CALL_RECORD_INDEXES = (
+    """CREATE INDEX IF NOT EXISTS call_records_created_idx
+       ON call_records (created_at DESC, id DESC)
+       INCLUDE (call_purpose, overall_sentiment, call_objective_met, action_required, agent_performance_rating,
+                classified_locally)""",
+    """CREATE INDEX IF NOT EXISTS call_records_sentiment_created_idx
+       ON call_records (overall_sentiment, created_at DESC, id DESC)""",
+    """CREATE INDEX IF NOT EXISTS call_records_purpose_created_idx
+       ON call_records (call_purpose, created_at DESC, id DESC)""",
+    """CREATE INDEX IF NOT EXISTS call_records_action_required_idx
+       ON call_records (created_at DESC, id DESC) WHERE action_required""",
+)
+
+# Hourly pre-aggregates of call_records for dashboards. rated_calls and
+# rating_sum leave out locally classified calls, whose rating is a placeholder.
+CREATE_CALL_RECORD_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS call_record_rollups (
+        bucket_start TIMESTAMP NOT NULL,
+        call_purpose TEXT NOT NULL,
+        overall_sentiment TEXT NOT NULL,
+        call_objective_met BOOLEAN NOT NULL,
+        action_required BOOLEAN NOT NULL,
+        calls BIGINT NOT NULL,
+        rating_sum BIGINT NOT NULL,
+        PRIMARY KEY (bucket_start, call_purpose, overall_sentiment, call_objective_met, action_required)
+    );
+    -- Rows from before schema version 3 count every call as rated
+    ALTER TABLE call_record_rollups ADD COLUMN IF NOT EXISTS rated_calls BIGINT;
+    UPDATE call_record_rollups SET rated_calls = calls WHERE rated_calls IS NULL;
+    ALTER TABLE call_record_rollups ALTER COLUMN rated_calls SET NOT NULL;
+"""
+
+ROLLUP_KEY_COLUMNS = ("bucket_start", "call_purpose", "overall_sentiment", "call_objective_met", "action_required")
+
+UPSERT_CALL_RECORD_ROLLUPS = """
+    INSERT INTO call_record_rollups ({columns}, calls, rated_calls, rating_sum)
+    SELECT * FROM unnest($1::timestamp[], $2::text[], $3::text[], $4::boolean[], $5::boolean[],
+                         $6::bigint[], $7::bigint[], $8::bigint[])
+    ON CONFLICT ({columns}) DO UPDATE
+    SET calls = call_record_rollups.calls + EXCLUDED.calls,
+        rated_calls = call_record_rollups.rated_calls + EXCLUDED.rated_calls,
+        rating_sum = call_record_rollups.rating_sum + EXCLUDED.rating_sum
+""".format(columns=", ".join(ROLLUP_KEY_COLUMNS))
+
+REBUILD_CALL_RECORD_ROLLUPS = """
+    INSERT INTO call_record_rollups ({columns}, calls, rated_calls, rating_sum)
+    SELECT date_trunc('hour', created_at), call_purpose, overall_sentiment, call_objective_met,
+           action_required, count(*), count(*) FILTER (WHERE NOT classified_locally),
+           coalesce(sum(agent_performance_rating) FILTER (WHERE NOT classified_locally), 0)
+    FROM call_records
+    WHERE created_at >= $1 AND created_at < $2
+    GROUP BY 1, 2, 3, 4, 5
+""".format(columns=", ".join(ROLLUP_KEY_COLUMNS))
+
+CREATE_SCHEMA_VERSION = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+CREATE_INSIGHT_CACHE = """
+    CREATE TABLE IF NOT EXISTS insight_cache (
+        cache_key TEXT PRIMARY KEY,
+        insight JSONB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    -- Expired entries are deleted by partition maintenance
+    CREATE INDEX IF NOT EXISTS insight_cache_created_idx ON insight_cache (created_at);
+"""
+
+# Asynchronous analysis jobs. Workers on every replica claim runnable jobs
+# with FOR UPDATE SKIP LOCKED; a claim is a lease, so jobs held by a worker
+# that died are claimed again once locked_until passes. attempts doubles as
+# the fencing token for completing a claimed job.
+CREATE_ANALYSIS_JOBS = """
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id UUID PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'queued',
+        transcript TEXT NOT NULL,
+        bypass_cache BOOLEAN NOT NULL DEFAULT FALSE,
+        webhook_url TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        locked_until TIMESTAMP,
+        result JSONB,
+        error TEXT,
+        webhook_status TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_analysis_jobs_runnable
+        ON analysis_jobs (run_after) WHERE status IN ('queued', 'running');
+    CREATE INDEX IF NOT EXISTS idx_analysis_jobs_finished
+        ON analysis_jobs (finished_at) WHERE finished_at IS NOT NULL;
+    ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS priority TEXT NOT NULL DEFAULT 'near_real_time';
+    ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS tenant TEXT;
+"""
+
+CLAIM_ANALYSIS_JOBS = """
+    UPDATE analysis_jobs j
+    SET status = 'running', attempts = j.attempts + 1, started_at = CURRENT_TIMESTAMP,
+        locked_until = CURRENT_TIMESTAMP + make_interval(secs => $2)
+    FROM (
+        SELECT id FROM analysis_jobs
+        WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+           OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP)
+        ORDER BY run_after
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ) next
+    WHERE j.id = next.id
+    RETURNING j.id, j.transcript, j.bypass_cache, j.webhook_url, j.attempts, j.priority, j.tenant
+"""
+
+JOB_COLUMNS = "id, status, attempts, result, error, webhook_status, created_at, started_at, finished_at"
+
+# Shape of the rows the service inserts; the transcript goes to call_transcripts
+CALL_RECORD_COLUMNS = (
+    "record_uuid", "transcript", "intent", "call_purpose", "call_objective_met", "key_results",
+    "customer_statements_analysis", "non_payment_reasons", "sentiment_start",
+    "sentiment_end", "overall_sentiment", "agent_performance_rating",
+    "agent_performance_feedback", "action_required", "summary", "classified_locally",
+)
+STORED_CALL_RECORD_COLUMNS = ("record_uuid", "transcript_hash") + CALL_RECORD_COLUMNS[2:]
+
+# Postgres array types for unnest()-based bulk inserts, in CALL_RECORD_COLUMNS order
+CALL_RECORD_ARRAY_TYPES = (
+    "uuid[]", "text[]", "text[]", "text[]", "boolean[]", "text[]",
+    "text[]", "text[]", "text[]",
+    "text[]", "text[]", "integer[]",
+    "text[]", "boolean[]", "text[]", "boolean[]",
+)
+
+TRANSCRIPT_HASH = "sha256(convert_to(transcript, 'UTF8'))"
+TOUCH_TRANSCRIPT = """
+    ON CONFLICT (transcript_hash) DO UPDATE SET last_seen_at = EXCLUDED.last_seen_at
+    WHERE call_transcripts.last_seen_at < EXCLUDED.last_seen_at - INTERVAL '1 day'
+"""
+UPSERT_CALL_TRANSCRIPTS = """
+    INSERT INTO call_transcripts (transcript_hash, transcript)
+    SELECT * FROM unnest($1::bytea[], $2::text[])
+""" + TOUCH_TRANSCRIPT
+
+
+def _insert_call_records(rows: str, if_absent: bool = False) -> str:
+    """Insert call_records and their transcripts from a `rows` query shaped like CALL_RECORD_COLUMNS"""
+    absent = "WHERE NOT EXISTS (SELECT 1 FROM call_records c WHERE c.record_uuid = rows.record_uuid)"
+    return f"""
+        WITH rows AS ({rows}),
+        transcripts AS (
+            INSERT INTO call_transcripts (transcript_hash, transcript)
+            SELECT DISTINCT ON (1) {TRANSCRIPT_HASH}, transcript FROM rows
+            {TOUCH_TRANSCRIPT}
+        )
+        INSERT INTO call_records ({", ".join(STORED_CALL_RECORD_COLUMNS)})
+        SELECT record_uuid, {TRANSCRIPT_HASH}, {", ".join(CALL_RECORD_COLUMNS[2:])} FROM rows
+        {absent if if_absent else ""}
+    """
+
+
+_VALUES_ROW = "SELECT " + ", ".join(
+    f"${i}::{t[:-2]} AS {c}" for i, (c, t) in enumerate(zip(CALL_RECORD_COLUMNS, CALL_RECORD_ARRAY_TYPES), 1))
+_UNNEST_ROWS = "SELECT * FROM unnest({}) AS r({})".format(
+    ", ".join(f"${i}::{t}" for i, t in enumerate(CALL_RECORD_ARRAY_TYPES, 1)),
+    ", ".join(CALL_RECORD_COLUMNS),
+)
+INSERT_CALL_RECORD = _insert_call_records(_VALUES_ROW) + " RETURNING id"
+INSERT_CALL_RECORD_IF_ABSENT = _insert_call_records(_VALUES_ROW, if_absent=True)
+BULK_INSERT_CALL_RECORDS = _insert_call_records(_UNNEST_ROWS) + " RETURNING record_uuid, id"
+BULK_INSERT_CALL_RECORDS_IF_ABSENT = _insert_call_records(_UNNEST_ROWS, if_absent=True)
+CALL_RECORD_ID = "SELECT id FROM call_records WHERE record_uuid = $1"
+CALL_RECORD_IDS = "SELECT record_uuid, id FROM call_records WHERE record_uuid = ANY($1::uuid[])"
+
+MIGRATE_LEGACY_BATCH = f"""
+    WITH moved AS (
+        DELETE FROM call_records_legacy
+        WHERE id IN (SELECT id FROM call_records_legacy ORDER BY id LIMIT $1)
+        RETURNING *
+    ),
+    transcripts AS (
+        INSERT INTO call_transcripts (transcript_hash, transcript, last_seen_at)
+        SELECT DISTINCT ON (1) {TRANSCRIPT_HASH}, transcript, coalesce(created_at, CURRENT_TIMESTAMP)
+        FROM moved ORDER BY 1, 3 DESC
+        ON CONFLICT (transcript_hash) DO UPDATE
+        SET last_seen_at = greatest(call_transcripts.last_seen_at, EXCLUDED.last_seen_at)
+    )
+    INSERT INTO call_records (id, {", ".join(STORED_CALL_RECORD_COLUMNS)}, created_at)
+    SELECT id, coalesce(record_uuid, gen_random_uuid()), {TRANSCRIPT_HASH},
+           {", ".join(CALL_RECORD_COLUMNS[2:-1])}, FALSE, coalesce(created_at, CURRENT_TIMESTAMP)
+    FROM moved
+"""
+
+
+def transcript_hash(transcript: str) -> bytes:
+    """Same digest as TRANSCRIPT_HASH computes in SQL"""
+    return hashlib.sha256(transcript.encode("utf-8")).digest()
+
+
+def add_months(month: datetime.datetime, months: int) -> datetime.datetime:
+    year, index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=index + 1, day=1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"call_records_p{month:%Y_%m}"
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+class CallRecordConnection(asyncpg.Connection):
+    """asyncpg connection that carries its prepared call_records insert"""
+    call_record_insert = None
+
+
+async def create_monthly_partitions(conn, first: datetime.datetime, last: datetime.datetime):
+    """Create the monthly partitions from first's month through last, inside the caller's transaction"""
+    await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+    current = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while current <= last:
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(current)} PARTITION OF call_records "
+            f"FOR VALUES FROM ('{current.isoformat()}') TO ('{add_months(current, 1).isoformat()}')")
+        current = add_months(current, 1)
+
+
+def call_record_values(record_uuid, transcript: str, insight) -> tuple:
+    """Map a CallInsight onto CALL_RECORD_COLUMNS"""
+    return (
+        record_uuid, transcript, insight.customer_intent, insight.call_purpose,
+        insight.call_objective_met, insight.key_results, insight.customer_statements_analysis, insight.non_payment_reasons,
+        insight.sentiment_start, insight.sentiment_end, insight.overall_sentiment,
+        insight.agent_performance_rating, insight.agent_performance_feedback,
+        insight.action_required, insight.summary, insight.classified_locally,
+    )
+
+
+class Database:
+    def __init__(self, dsn: str,
+                 min_size: int = DB_POOL_MIN_SIZE,
+                 max_size: int = DB_POOL_MAX_SIZE,
+                 acquire_timeout: float = DB_ACQUIRE_TIMEOUT,
+                 command_timeout: float = DB_COMMAND_TIMEOUT,
+                 health_check_interval: float = DB_HEALTH_CHECK_INTERVAL,
+                 maintenance: bool = False):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.command_timeout = command_timeout
+        self.health_check_interval = health_check_interval
+        # Only the service runs partition maintenance; the CLIs opt out by default
+        self.maintenance = maintenance
+        self.pool = None
+        self.healthy = False
+        self.schema_version = None
+        self._connecting = None
+        self._health_task = None
+        self._maintenance_task = None
+
+    async def connect(self):
+        """Open the connection pool, retrying with backoff, and check the schema version"""
+        if not self.dsn:
+            raise DatabaseUnavailable("DATABASE_URL not found in .env")
+        delay = 1.0
+        for attempt in range(1, DB_CONNECT_RETRIES + 1):
+            try:
+                if DB_MIGRATE_ON_STARTUP:
+                    await self.migrate()
+                self.pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    command_timeout=self.command_timeout,
+                    connection_class=CallRecordConnection,
+                    init=self._init_connection,
+                )
+                break
+            except (*CONNECTION_ERRORS, asyncio.TimeoutError) as e:
+                print(f"Database connect attempt {attempt}/{DB_CONNECT_RETRIES} failed: {e}")
+                if attempt == DB_CONNECT_RETRIES:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+        self.healthy = True
+        self.schema_version = await self.fetch_schema_version()
+        if self.schema_version < SCHEMA_VERSION:
+            print(f"Database schema is at version {self.schema_version}, expected {SCHEMA_VERSION}; "
+                  "run `python storage.py migrate`")
+        if self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        if self.maintenance and CALL_RECORDS_MAINTENANCE_INTERVAL > 0:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def open(self):
+        """Open the pool unless it is open already; one attempt runs at a time"""
+        if self.pool is not None:
+            return
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.create_task(self.connect())
+        await asyncio.shield(self._connecting)
+
+    async def close(self):
+        if self._connecting and not self._connecting.done():
+            self._connecting.cancel()
+        self._connecting = None
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+        self.healthy = False
+
+    @property
+    def schema_current(self) -> bool:
+        return self.schema_version is not None and self.schema_version >= SCHEMA_VERSION
+
+    async def migrate(self):
+        """Create or upgrade the schema to SCHEMA_VERSION; safe to run from several replicas"""
+        conn = await asyncpg.connect(self.dsn, timeout=self.acquire_timeout)
+        try:
+            await conn.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK_ID)
+            legacy = await conn.fetchval(
+                "SELECT relkind = 'r' FROM pg_class WHERE oid = to_regclass('call_records')")
+            async with conn.transaction():
+                if legacy:
+                    print("Unpartitioned call_records renamed to call_records_legacy; "
+                          "run `python storage.py migrate-legacy` to move its rows")
+                    await conn.execute(RENAME_LEGACY_CALL_RECORDS)
+                await conn.execute(CREATE_CALL_TRANSCRIPTS)
+                await conn.execute(CREATE_CALL_RECORDS)
+                if not await conn.fetchval("""
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'call_records' AND column_name = 'classified_locally'"""):
+                    await conn.execute(ADD_CLASSIFIED_LOCALLY)
+                    print("Locally classified calls are now left out of rating averages; "
+                          "rebuild earlier rollups with `python rollups.py --since ...` to apply it to them")
+                    # Rebuilt below to cover the new column
+                    await conn.execute("DROP INDEX IF EXISTS call_records_created_idx")
+                # The monthly partitions exist before the first insert: rows that land in the
+                # default partition would make creating their month's partition fail later
+                month = await conn.fetchval("SELECT date_trunc('month', CURRENT_TIMESTAMP)::timestamp")
+                await create_monthly_partitions(conn, month, add_months(month, CALL_RECORDS_PARTITIONS_AHEAD))
+                if legacy:
+                    await conn.execute(CONTINUE_LEGACY_IDS)
+                for statement in CREATE_CALL_RECORD_INDEXES:
+                    await conn.execute(statement)
+                await conn.execute(CREATE_CALL_RECORD_ROLLUPS)
+                await conn.execute(CREATE_INSIGHT_CACHE)
+                await conn.execute(CREATE_ANALYSIS_JOBS)
+                await conn.execute(CREATE_SCHEMA_VERSION)
+                await conn.execute(
+                    "INSERT INTO schema_version (version) VALUES ($1) ON CONFLICT DO NOTHING", SCHEMA_VERSION)
+        finally:
+            await conn.close()
+        self.schema_version = SCHEMA_VERSION
+
+    async def fetch_schema_version(self) -> int:
+        """Latest migrated schema version, 0 for a database never migrated"""
+        async def operation(conn):
+            if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+                return 0
+            return await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_version")
+        return await self._run(operation)
+
+    @staticmethod
+    async def _init_connection(conn):
+        """Runs once per new pooled connection"""
+        # Not migrated yet: prepared on first insert instead, see _call_record_insert
+        if await conn.fetchval("SELECT to_regclass('call_records')") is not None:
+            conn.call_record_insert = await conn.prepare(INSERT_CALL_RECORD)
+
+    @staticmethod
+    async def _call_record_insert(conn):
+        if conn.call_record_insert is None:
+            conn.call_record_insert = await conn.prepare(INSERT_CALL_RECORD)
+        return conn.call_record_insert
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Borrow a pooled connection, failing fast if none frees up in time"""
+        if self.pool is None:
+            # Opened on first use; a request waits for it no longer than for a connection
+            try:
+                await asyncio.wait_for(self.open(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                raise DatabaseUnavailable("Timed out waiting for the database pool to open")
+            except CONNECTION_ERRORS as e:
+                raise DatabaseUnavailable(f"Database connection failed: {e}")
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseUnavailable("Timed out waiting for a database connection")
+        except CONNECTION_ERRORS as e:
+            self.healthy = False
+            raise DatabaseUnavailable(f"Database connection failed: {e}")
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def _run(self, operation, retry=True):
+        """
+        Run operation(conn), reconnecting and retrying once on a dropped
+        connection. A write may have committed before the connection dropped,
+        so writes that must not run twice pass retry=False, or as retry an
+        operation that is safe to run after them (e.g. an if-absent insert)
+        """
+        if retry is True:
+            retry = operation
+        for attempt in (1, 2):
+            try:
+                async with self.acquire() as conn:
+                    return await (operation if attempt == 1 else retry)(conn)
+            except CONNECTION_ERRORS as e:
+                print(f"Database connection error (attempt {attempt}): {e}")
+                self.healthy = False
+                await self.pool.expire_connections()
+                if attempt == 2 or not retry:
+                    raise DatabaseUnavailable(f"Database connection failed: {e}")
+
+    async def insert_call_record(self, record_uuid, transcript: str, insight) -> int:
+        values = call_record_values(record_uuid, transcript, insight)
+
+        async def operation(conn):
+            return await (await self._call_record_insert(conn)).fetchval(*values)
+
+        async def retry(conn):
+            await conn.execute(INSERT_CALL_RECORD_IF_ABSENT, *values)
+            return await conn.fetchval(CALL_RECORD_ID, record_uuid)
+
+        return await self._run(operation, retry)
+
+    async def insert_call_records(self, records) -> None:
+        """Pipelined insert of (record_uuid, transcript, insight) rows in one transaction"""
+        values = [call_record_values(*record) for record in records]
+
+        async def operation(conn):
+            insert = await self._call_record_insert(conn)
+            async with conn.transaction():
+                await insert.executemany(values)
+
+        async def retry(conn):
+            async with conn.transaction():
+                await conn.executemany(INSERT_CALL_RECORD_IF_ABSENT, values)
+
+        await self._run(operation, retry)
+
+    async def bulk_insert_call_records(self, records) -> dict:
+        """
+        Insert (record_uuid, transcript, insight) rows with a single
+        unnest() statement in one transaction; returns {record_uuid: id}
+        """
+        if not records:
+            return {}
+        rows = [call_record_values(*record) for record in records]
+        columns = [list(column) for column in zip(*rows)]
+
+        async def operation(conn):
+            async with conn.transaction():
+                return await conn.fetch(BULK_INSERT_CALL_RECORDS, *columns)
+
+        async def retry(conn):
+            async with conn.transaction():
+                await conn.execute(BULK_INSERT_CALL_RECORDS_IF_ABSENT, *columns)
+                return await conn.fetch(CALL_RECORD_IDS, columns[0])
+
+        result = await self._run(operation, retry)
+        return {row["record_uuid"]: row["id"] for row in result}
+
+    async def bulk_insert_call_records_if_absent(self, records) -> set:
+        """
+        Like bulk_insert_call_records, but record_uuids already stored are
+        skipped; returns the record_uuids that were actually inserted
+        """
+        if not records:
+            return set()
+        rows = [call_record_values(*record) for record in records]
+        columns = [list(column) for column in zip(*rows)]
+        result = await self._run(lambda conn: conn.fetch(
+            BULK_INSERT_CALL_RECORDS_IF_ABSENT + " RETURNING record_uuid", *columns))
+        return {row["record_uuid"] for row in result}
+
+    async def copy_call_records(self, rows) -> None:
+        """
+        Bulk load rows already shaped like CALL_RECORD_COLUMNS: transcripts
+        are upserted with unnest() and the insight rows loaded via COPY
+        """
+        transcripts = {transcript_hash(row[1]): row[1] for row in rows}
+        stored = [(row[0], transcript_hash(row[1]), *row[2:]) for row in rows]
+
+        async def operation(conn):
+            async with conn.transaction():
+                await conn.execute(UPSERT_CALL_TRANSCRIPTS, list(transcripts), list(transcripts.values()))
+                await conn.copy_records_to_table(
+                    "call_records", records=stored, columns=STORED_CALL_RECORD_COLUMNS)
+
+        await self._run(operation, lambda conn: self._insert_call_record_rows_if_absent(conn, rows))
+
+    @staticmethod
+    async def _insert_call_record_rows_if_absent(conn, rows):
+        await conn.execute(BULK_INSERT_CALL_RECORDS_IF_ABSENT, *[list(column) for column in zip(*rows)])
+
+    async def bulk_insert_call_record_rows_if_absent(self, rows) -> None:
+        """Like copy_call_records, but with an unnest() insert that skips record_uuids already stored"""
+        await self._run(lambda conn: self._insert_call_record_rows_if_absent(conn, rows))
+
+    async def insert_call_record_rows_if_absent(self, rows) -> None:
+        """Row-at-a-time insert that skips record_uuids already stored"""
+        async def operation(conn):
+            for row in rows:
+                try:
+                    await conn.execute(INSERT_CALL_RECORD_IF_ABSENT, *row)
+                except asyncpg.PostgresError as e:
+                    print(f"Dropping call record {row[0]}: {e}")
+
+        await self._run(operation)
+
+    async def fetch(self, query: str, *args) -> list:
+        return await self._run(lambda conn: conn.fetch(query, *args))
+
+    async def stream(self, query: str, *args, batch_size: int = 5000):
+        """
+        Rows of query in lists of up to batch_size, read through a server-side
+        cursor in one read-only snapshot, so memory stays flat however many rows match
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                cursor = await conn.cursor(query, *args)
+                while rows := await cursor.fetch(batch_size):
+                    yield rows
+
+    # Rollups
+    async def upsert_rollups(self, rows) -> None:
+        """Add (bucket_start, call_purpose, overall_sentiment, call_objective_met,
+        action_required, calls, rated_calls, rating_sum) rows onto the stored counts"""
+        if not rows:
+            return
+        # Sorted so concurrent flushes from several replicas lock rows in the same order
+        columns = [list(column) for column in zip(*sorted(rows))]
+
+        async def operation(conn):
+            async with conn.transaction():
+                await conn.execute(UPSERT_CALL_RECORD_ROLLUPS, *columns)
+
+        # The counts are added, so a flush that may have committed is not rerun
+        await self._run(operation, retry=False)
+
+    async def rebuild_rollups(self, since, until) -> None:
+        """Recompute the rollup rows for [since, until) from call_records"""
+        async def operation(conn):
+            async with conn.transaction():
+                await conn.execute("DELETE FROM call_record_rollups WHERE bucket_start >= $1 AND bucket_start < $2",
+                                   since, until)
+                await conn.execute(REBUILD_CALL_RECORD_ROLLUPS, since, until)
+
+        await self._run(operation)
+
+    # Partition maintenance
+    async def create_partitions(self, first: datetime.datetime, last: datetime.datetime) -> None:
+        """Create the monthly partitions covering first..last (inclusive)"""
+        async def operation(conn):
+            async with conn.transaction():
+                await create_monthly_partitions(conn, first, last)
+
+        await self._run(operation)
+
+    async def drop_partitions_before(self, cutoff: datetime.datetime) -> list:
+        """Drop monthly partitions that end at or before cutoff; returns their names"""
+        async def operation(conn):
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+                names = await conn.fetch("""
+                    SELECT c.relname FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'call_records'::regclass
+                """)
+                dropped = []
+                for row in names:
+                    match = PARTITION_NAME.match(row["relname"])
+                    if not match:
+                        continue
+                    month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+                    if add_months(month, 1) <= cutoff:
+                        await conn.execute(f"DROP TABLE {row['relname']}")
+                        dropped.append(row["relname"])
+                return dropped
+
+        return await self._run(operation)
+
+    async def delete_unused_transcripts(self, before: datetime.datetime, batch_size: int = 10000) -> int:
+        """Delete transcripts not referenced since before, in batches"""
+        deleted = 0
+        while True:
+            status = await self._run(lambda conn: conn.execute("""
+                DELETE FROM call_transcripts WHERE transcript_hash IN (
+                    SELECT transcript_hash FROM call_transcripts WHERE last_seen_at < $1 LIMIT $2
+                )
+            """, before, batch_size))
+            count = int(status.split()[-1])
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    async def maintain_partitions(self, retention_months: int = CALL_RECORDS_RETENTION_MONTHS) -> None:
+        """Create upcoming partitions and apply retention"""
+        month = await self._run(lambda conn: conn.fetchval(
+            "SELECT date_trunc('month', CURRENT_TIMESTAMP)::timestamp"))
+        await self.create_partitions(month, add_months(month, CALL_RECORDS_PARTITIONS_AHEAD))
+        if retention_months <= 0:
+            return
+        cutoff = add_months(month, -retention_months)
+        dropped = await self.drop_partitions_before(cutoff)
+        if dropped:
+            print(f"Dropped expired call_records partitions: {', '.join(dropped)}")
+        # last_seen_at is refreshed at most daily, so allow a day of slack
+        deleted = await self.delete_unused_transcripts(cutoff - datetime.timedelta(days=1))
+        if deleted:
+            print(f"Deleted {deleted} transcripts no longer referenced")
+
+    async def _maintenance_loop(self):
+        # First pass right after connecting, off the startup path
+        while True:
+            try:
+                await self.maintain_partitions()
+            except (DatabaseUnavailable, asyncpg.PostgresError) as e:
+                print("Partition maintenance failed:", e)
+            try:
+                deleted = await self.delete_expired_cached_insights()
+                if deleted:
+                    print(f"Deleted {deleted} expired insight cache entries")
+            except (DatabaseUnavailable, asyncpg.PostgresError) as e:
+                print("Insight cache cleanup failed:", e)
+            await asyncio.sleep(CALL_RECORDS_MAINTENANCE_INTERVAL)
+
+    async def migrate_legacy_batch(self, batch_size: int) -> int:
+        """Move up to batch_size rows from call_records_legacy; returns how many moved"""
+        status = await self._run(lambda conn: conn.execute(MIGRATE_LEGACY_BATCH, batch_size))
+        return int(status.split()[-1])
+
+    # Persistent insight cache tier
+    async def get_cached_insight(self, cache_key: str, max_age: float):
+        row = await self._run(lambda conn: conn.fetchval("""
+            SELECT insight FROM insight_cache
+            WHERE cache_key = $1 AND created_at > CURRENT_TIMESTAMP - make_interval(secs => $2)
+        """, cache_key, max_age))
+        return json.loads(row) if row is not None else None
+
+    async def put_cached_insight(self, cache_key: str, insight: dict):
+        await self._run(lambda conn: conn.execute("""
+            INSERT INTO insight_cache (cache_key, insight) VALUES ($1, $2::jsonb)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET insight = EXCLUDED.insight, created_at = CURRENT_TIMESTAMP
+        """, cache_key, json.dumps(insight)))
+
+    async def delete_expired_cached_insights(self, max_age: float = INSIGHT_CACHE_DB_TTL,
+                                             batch_size: int = 10000) -> int:
+        """Delete insight_cache entries older than max_age seconds, in batches"""
+        deleted = 0
+        while True:
+            status = await self._run(lambda conn: conn.execute("""
+                DELETE FROM insight_cache WHERE cache_key IN (
+                    SELECT cache_key FROM insight_cache
+                    WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => $1) LIMIT $2
+                )
+            """, max_age, batch_size))
+            count = int(status.split()[-1])
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    # Analysis job queue
+    async def enqueue_job(self, job_id, transcript: str, bypass_cache: bool, webhook_url: str = None,
+                          priority: str = "near_real_time", tenant: str = None):
+        await self._run(lambda conn: conn.execute("""
+            INSERT INTO analysis_jobs (id, transcript, bypass_cache, webhook_url, priority, tenant)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (id) DO NOTHING
+        """, job_id, transcript, bypass_cache, webhook_url, priority, tenant))
+
+    async def claim_jobs(self, limit: int, lease: float) -> list:
+        # A rerun claim would strand the jobs of a first one that committed; the next poll claims instead
+        return await self._run(lambda conn: conn.fetch(CLAIM_ANALYSIS_JOBS, limit, lease), retry=False)
+
+    async def extend_job_lease(self, job_id, attempt: int, lease: float) -> bool:
+        """Hold a running job for another lease seconds; False if the claim was lost to another worker"""
+        status = await self._run(lambda conn: conn.execute("""
+            UPDATE analysis_jobs SET locked_until = CURRENT_TIMESTAMP + make_interval(secs => $3)
+            WHERE id = $1 AND attempts = $2 AND status = 'running'
+        """, job_id, attempt, lease))
+        return status == "UPDATE 1"
+
+    async def finish_job(self, job_id, attempt: int, result: dict) -> bool:
+        """Store a claimed job's result; False if the claim was lost to another worker"""
+        status = await self._run(lambda conn: conn.execute("""
+            UPDATE analysis_jobs
+            SET status = 'done', result = $3::jsonb, error = NULL, locked_until = NULL,
+                finished_at = CURRENT_TIMESTAMP,
+                webhook_status = CASE WHEN webhook_url IS NULL THEN NULL ELSE 'pending' END
+            WHERE id = $1 AND attempts = $2 AND status = 'running'
+        """, job_id, attempt, json.dumps(result)))
+        return status == "UPDATE 1"
+
+    async def fail_job(self, job_id, attempt: int, error: str, retry_after: float = None) -> bool:
+        """Requeue a claimed job after retry_after seconds, or fail it for good when None"""
+        if retry_after is not None:
+            query = """
+                UPDATE analysis_jobs
+                SET status = 'queued', error = $3, locked_until = NULL,
+                    run_after = CURRENT_TIMESTAMP + make_interval(secs => $4)
+                WHERE id = $1 AND attempts = $2 AND status = 'running'
+            """
+            args = (job_id, attempt, error, retry_after)
+        else:
+            query = """
+                UPDATE analysis_jobs
+                SET status = 'failed', error = $3, locked_until = NULL, finished_at = CURRENT_TIMESTAMP,
+                    webhook_status = CASE WHEN webhook_url IS NULL THEN NULL ELSE 'pending' END
+                WHERE id = $1 AND attempts = $2 AND status = 'running'
+            """
+            args = (job_id, attempt, error)
+        status = await self._run(lambda conn: conn.execute(query, *args))
+        return status == "UPDATE 1"
+
+    async def set_webhook_status(self, job_id, webhook_status: str):
+        await self._run(lambda conn: conn.execute(
+            "UPDATE analysis_jobs SET webhook_status = $2 WHERE id = $1", job_id, webhook_status))
+
+    async def get_job(self, job_id):
+        row = await self._run(lambda conn: conn.fetchrow(
+            f"SELECT {JOB_COLUMNS} FROM analysis_jobs WHERE id = $1", job_id))
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    async def delete_finished_jobs(self, older_than_hours: float) -> int:
+        status = await self._run(lambda conn: conn.execute(
+            "DELETE FROM analysis_jobs WHERE finished_at < CURRENT_TIMESTAMP - make_interval(secs => $1)",
+            older_than_hours * 3600))
+        return int(status.split()[-1])
+
+    # Health checks
+    async def check_health(self) -> bool:
+        try:
+            async with self.acquire() as conn:
+                await conn.fetchval("SELECT 1", timeout=self.acquire_timeout)
+            if not self.schema_current:
+                # Picks up a migration run while the service is up
+                self.schema_version = await self.fetch_schema_version()
+            if not self.healthy:
+                print("Database connection restored")
+            self.healthy = True
+        except (DatabaseUnavailable, *CONNECTION_ERRORS, asyncio.TimeoutError) as e:
+            print("Database health check failed:", e)
+            self.healthy = False
+            if self.pool:
+                await self.pool.expire_connections()
+        return self.healthy
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    def stats(self) -> dict:
+        if self.pool is None:
+            return {"healthy": False, "size": 0, "idle": 0,
+                    "min_size": self.min_size, "max_size": self.max_size}
+        return {
+            "healthy": self.healthy,
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+        }
+
+
+# Write-behind persistence
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "2.0"))
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", "30"))
+
+
+class WriteBehindWriter:
+    """
+    Buffers call_records rows on a bounded in-process queue and flushes them
+    with COPY once WRITE_BEHIND_BATCH_SIZE rows are waiting or
+    WRITE_BEHIND_FLUSH_INTERVAL seconds have passed since the first one.
+    A full queue blocks submitters for up to WRITE_BEHIND_ENQUEUE_TIMEOUT
+    seconds and then rejects them, so a slow database pushes back on clients
+    instead of growing memory without bound.
+    """
+
+    def __init__(self, db: Database,
+                 max_queue: int = WRITE_BEHIND_QUEUE_SIZE,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 enqueue_timeout: float = WRITE_BEHIND_ENQUEUE_TIMEOUT):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.rows_flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_dropped = 0
+        self._closing = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, record_uuid, transcript: str, insight):
+        if self._closing:
+            raise DatabaseUnavailable("Write-behind queue is shutting down")
+        row = call_record_values(record_uuid, transcript, insight)
+        try:
+            await asyncio.wait_for(self.queue.put(row), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseUnavailable("Write-behind queue is full")
+
+    async def drain(self, timeout: float = WRITE_BEHIND_DRAIN_TIMEOUT):
+        """Stop accepting rows and wait for everything queued to be flushed"""
+        self._closing = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Write-behind drain timed out, {self.queue.qsize()} rows not persisted")
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Never let one batch stop the writer; everything queued behind it would be stuck
+                self.failed_flushes += 1
+                self.rows_dropped += len(batch)
+                print(f"Write-behind flush of {len(batch)} rows failed, rows dropped: {e!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: list):
+        delay = 0.5
+        row_at_a_time = False
+        may_have_landed = False
+        while True:
+            try:
+                if row_at_a_time:
+                    await self.db.insert_call_record_rows_if_absent(batch)
+                elif may_have_landed:
+                    await self.db.bulk_insert_call_record_rows_if_absent(batch)
+                else:
+                    await self.db.copy_call_records(batch)
+                break
+            except asyncpg.PostgresError as e:
+                if row_at_a_time:
+                    raise
+                # COPY is all-or-nothing; a retried batch that partly landed
+                # or a single bad row falls back to row-at-a-time inserts
+                print(f"Write-behind COPY failed, inserting rows individually: {e}")
+                row_at_a_time = True
+            except DatabaseUnavailable as e:
+                # The connection may have dropped after the COPY committed
+                may_have_landed = True
+                self.failed_flushes += 1
+                print(f"Write-behind flush of {len(batch)} rows failed, retrying: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        self.rows_flushed += len(batch)
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "rows_flushed": self.rows_flushed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "rows_dropped": self.rows_dropped,
+        }
@@ -0,0 +1,237 @@
+"""
+Accuracy-versus-cost evaluation across models and prompt templates.
+
+Runs insight extraction in-process (main.generate_insights, no HTTP server
+or database) for every model x prompt template x transcript of the
+TEST_TRANSCRIPTS validation set, many calls at a time, and scores each
+answer with PipelineValidator from test_pipeline.py. Every model/template
+cell gets per-field accuracy, latency percentiles and estimated token
+usage. Each run is written to its own JSON file under eval_results/, with
+stable key order so two runs can be compared with `diff` or with the diff
+command below.
+
+The LLM backend and its limits come from the environment as for the
+server; LLM_BACKEND=synthetic or replay runs the matrix without network
+access.
+
+Usage:
+python eval_matrix.py run --models gemini-2.5-flash,gemini-2.5-flash-lite --templates v2,v2-compact
+python eval_matrix.py run --repeat 3 --concurrency 16 --name flash-lite-trial
+python eval_matrix.py diff eval_results/baseline.json eval_results/flash-lite-trial.json
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import datetime
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+# llm, and main in EvalMatrix, read the LLM and prompt settings on import
+load_dotenv()
+
+from llm import estimate_tokens
+from benchmark import percentile
+from test_pipeline import TEST_TRANSCRIPTS, PipelineValidator
+
+RESULTS_DIR = "eval_results"
+
+# compile_summary() keys compared between runs
+ACCURACY_KEYS = (
+    "intent_accuracy", "call_purpose_accuracy", "call_objective_accuracy", "key_results_accuracy",
+    "non_payment_accuracy", "sentiment_start_accuracy", "sentiment_end_accuracy",
+    "overall_sentiment_accuracy", "agent_performance_accuracy", "action_accuracy",
+)
+MATCH_KEYS = (
+    "intent_match", "call_purpose_match", "call_objective_match", "key_results_match", "non_payment_match",
+    "sentiment_start_match", "sentiment_end_match", "overall_sentiment_match",
+    "agent_performance_acceptable", "action_match",
+)
+
+
+def cell_name(model: str, template: str) -> str:
+    return f"{model} / {template}"
+
+
+class EvalMatrix:
+    def __init__(self, args):
+        self.args = args
+        import main
+        from prompts import get_template
+        self.main = main
+        self.models = args.models.split(",") if args.models else [main.GEMINI_MODEL]
+        self.templates = [get_template(v) for v in (args.templates.split(",") if args.templates
+                                                     else [main.PROMPT_VERSION])]
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.calls = {}  # cell -> list of call results
+
+    async def call(self, model: str, template, case: dict, repeat: int):
+        kind, body = template.single(case["transcript"])
+        result = {"id": case["id"], "stage": case["stage"], "repeat": repeat,
+                  "prompt_tokens": template.prefix_tokens[kind] + estimate_tokens(body)}
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                insight = await self.main.generate_insights(case["transcript"], model=model, template=template)
+                result["insights"] = insight.model_dump()
+                result["output_tokens"] = estimate_tokens(json.dumps(result["insights"], ensure_ascii=False))
+            except Exception as e:
+                result["error"] = str(getattr(e, "detail", e))
+                result["output_tokens"] = 0
+            result["latency"] = time.perf_counter() - started
+        self.calls.setdefault(cell_name(model, template.version), []).append(result)
+
+    async def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.call(model, template, case, repeat)
+            for repeat in range(self.args.repeat)
+            for case in TEST_TRANSCRIPTS
+            for model in self.models
+            for template in self.templates
+        ))
+        cells = {}
+        for model in self.models:
+            for template in self.templates:
+                name = cell_name(model, template.version)
+                cells[name] = self.score(model, template.version, self.calls.get(name, []))
+        return {
+            "name": self.args.name,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "backend": self.main.llm.backend.name,
+            "extraction_mode": self.main.EXTRACTION_MODE,
+            "transcripts": len(TEST_TRANSCRIPTS),
+            "repeat": self.args.repeat,
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+            "cells": cells,
+        }
+
+    def score(self, model: str, template: str, calls: List[Dict]) -> Dict[str, Any]:
+        calls = sorted(calls, key=lambda c: (c["id"], c["repeat"]))
+        validator = PipelineValidator()
+        cases = {}
+        for call in calls:
+            expected = next(t for t in TEST_TRANSCRIPTS if t["id"] == call["id"])
+            actual = {"error": call["error"]} if "error" in call else {"insights": call["insights"]}
+            evaluation = validator.evaluate_result(expected, actual)
+            validator.results.append({"test_id": call["id"], "stage": call["stage"], "evaluation": evaluation})
+            case = cases.setdefault(str(call["id"]), {"calls": 0, "errors": 0, "failed_fields": {}})
+            case["calls"] += 1
+            if "error" in call:
+                case["errors"] += 1
+                continue
+            for key in MATCH_KEYS:
+                if not evaluation.get(key, False):
+                    case["failed_fields"][key] = case["failed_fields"].get(key, 0) + 1
+
+        summary = validator.compile_summary()["summary"]
+        latencies = sorted(c["latency"] for c in calls if "error" not in c)
+        prompt_tokens = sum(c["prompt_tokens"] for c in calls)
+        output_tokens = sum(c["output_tokens"] for c in calls)
+        return {
+            "model": model,
+            "template": template,
+            "calls": len(calls),
+            "errors": sum(1 for c in calls if "error" in c),
+            "accuracy": {key: round(summary.get(key, 0.0), 1) for key in ACCURACY_KEYS},
+            "latency_seconds": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p90": round(percentile(latencies, 90), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "max": round(latencies[-1], 3) if latencies else 0.0,
+            },
+            # Estimated with llm.estimate_tokens; the backend's own counts are in /metrics
+            "tokens": {
+                "prompt": prompt_tokens,
+                "output": output_tokens,
+                "per_call": round((prompt_tokens + output_tokens) / len(calls), 1) if calls else 0.0,
+            },
+            "cases": cases,
+        }
+
+
+def save_results(results: Dict[str, Any], directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{results['name']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    return path
+
+
+def print_results(results: Dict[str, Any]):
+    print(f"\n{results['name']}: {results['transcripts']} transcripts x {results['repeat']} "
+          f"on {results['backend']} in {results['elapsed_seconds']}s")
+    for name, cell in results["cells"].items():
+        accuracy = cell["accuracy"]
+        mean = sum(accuracy.values()) / len(accuracy)
+        latency = cell["latency_seconds"]
+        print(f"\n{name}")
+        print(f"   Mean field accuracy: {mean:.1f}%  (errors: {cell['errors']}/{cell['calls']})")
+        print(f"   Latency p50 {latency['p50']:.2f}s  p90 {latency['p90']:.2f}s  p99 {latency['p99']:.2f}s")
+        print(f"   Tokens per call: {cell['tokens']['per_call']:.0f} (estimated)")
+        for key, value in accuracy.items():
+            print(f"      {key:<28} {value:5.1f}%")
+
+
+def diff_results(before: Dict[str, Any], after: Dict[str, Any]):
+    """Print what changed per cell between two saved runs"""
+    print(f"{before['name']} -> {after['name']}")
+    for name in sorted(set(before["cells"]) | set(after["cells"])):
+        old, new = before["cells"].get(name), after["cells"].get(name)
+        if old is None or new is None:
+            print(f"\n{name}: only in {after['name'] if old is None else before['name']}")
+            continue
+        print(f"\n{name}")
+        for key in ACCURACY_KEYS:
+            delta = new["accuracy"][key] - old["accuracy"][key]
+            if delta:
+                print(f"   {key:<28} {old['accuracy'][key]:5.1f}% -> {new['accuracy'][key]:5.1f}% ({delta:+.1f})")
+        for key in ("p50", "p90", "p99"):
+            print(f"   latency {key:<20} {old['latency_seconds'][key]:.2f}s -> {new['latency_seconds'][key]:.2f}s")
+        print(f"   tokens per call{'':<13} {old['tokens']['per_call']:.0f} -> {new['tokens']['per_call']:.0f}")
+        for case_id in sorted(set(old["cases"]) | set(new["cases"]), key=int):
+            was = set(old["cases"].get(case_id, {}).get("failed_fields", {}))
+            now = set(new["cases"].get(case_id, {}).get("failed_fields", {}))
+            if was != now:
+                fixed = ", ".join(sorted(was - now)) or "-"
+                broken = ", ".join(sorted(now - was)) or "-"
+                print(f"   transcript {case_id}: fixed {fixed}; now failing {broken}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate accuracy, latency and tokens per model and prompt template")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the evaluation matrix")
+    run_parser.add_argument("--models", help="Comma-separated models (default: GEMINI_MODEL)")
+    run_parser.add_argument("--templates", help="Comma-separated prompt template versions (default: PROMPT_TEMPLATE)")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Calls per transcript and cell")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="LLM calls in flight at most")
+    run_parser.add_argument("--name", default=datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+    run_parser.add_argument("--output-dir", default=RESULTS_DIR)
+    diff_parser = commands.add_parser("diff", help="Compare two saved runs")
+    diff_parser.add_argument("before")
+    diff_parser.add_argument("after")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.command == "diff":
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        diff_results(before, after)
+        return
+
+    results = asyncio.run(EvalMatrix(args).run())
+    print_results(results)
+    print(f"\nResults saved to {save_results(results, args.output_dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Columnar export of call_records for analytics.
+
+`SELECT *` over call_records sends every free-text column, and with the
+transcript join the whole call text, row by row. The export streams the
+insights as Apache Arrow record batches instead, written as Parquet or as
+the Arrow IPC stream format (GET /call_records/export):
+- the sentiments are dictionary-encoded against one fixed dictionary,
+  call_purpose and intent against a dictionary per batch,
+- booleans are bit-packed and the rating is an int8,
+- the long free-text fields and the transcripts are only included on request.
+Rows come from a server-side cursor, EXPORT_BATCH_ROWS at a time, inside one
+read-only REPEATABLE READ transaction, so memory stays flat whatever the
+table size and every export is a consistent snapshot.
+
+Exports are incremental through watermarks: an opaque (created_at, id)
+position, encoded like the listing cursor. An export covers the rows after
+its starting watermark up to EXPORT_SETTLE_SECONDS ago, so write-behind rows
+and transactions still in flight land in the next export, and hands back
+the watermark to start the next export from.
+
+pyarrow is only needed for exporting and is imported on first use.
+
+Usage:
+python export.py --watermark-file exports/watermark.json
+python export.py --format arrow --since 2025-01-01 --include-text --include-transcripts
+"""
+
+import os
+import json
+import asyncio
+import argparse
+import datetime
+
+from dotenv import load_dotenv
+
+# Before the EXPORT_* settings below and those of db are read
+load_dotenv()
+
+from db import Database
+from analytics import TRANSCRIPT_COLUMN, InvalidQuery, db_local_bounds, decode_cursor, encode_cursor
+from metrics import EXPORTED_ROWS
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", "300"))
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+EXPORT_DIR = "exports"
+
+FORMATS = {
+    # format -> (media type, file extension)
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+SENTIMENTS = ("Negative", "Neutral", "Positive")
+SENTIMENT_COLUMNS = ("sentiment_start", "sentiment_end", "overall_sentiment")
+LABEL_COLUMNS = ("intent", "call_purpose")
+BOOLEAN_COLUMNS = ("call_objective_met", "action_required", "classified_locally")
+EXPORT_COLUMNS = ("id", "record_uuid", "created_at") + LABEL_COLUMNS + SENTIMENT_COLUMNS + BOOLEAN_COLUMNS + (
+    "agent_performance_rating",)
+TEXT_COLUMNS = ("key_results", "customer_statements_analysis", "non_payment_reasons",
+                "agent_performance_feedback", "summary")
+
+SETTLED_UNTIL = "SELECT (CURRENT_TIMESTAMP - make_interval(secs => $1))::timestamp"
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("Columnar export needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def arrow_schema(include_text: bool = False, include_transcripts: bool = False):
+    pa = import_pyarrow()
+    sentiment = pa.dictionary(pa.int8(), pa.string())
+    label = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        pa.field("id", pa.int64(), nullable=False),
+        pa.field("record_uuid", pa.string()),
+        pa.field("created_at", pa.timestamp("us"), nullable=False),
+    ]
+    fields += [pa.field(name, label) for name in LABEL_COLUMNS]
+    fields += [pa.field(name, sentiment) for name in SENTIMENT_COLUMNS]
+    fields += [pa.field(name, pa.bool_()) for name in BOOLEAN_COLUMNS]
+    fields.append(pa.field("agent_performance_rating", pa.int8()))
+    if include_text:
+        fields += [pa.field(name, pa.string()) for name in TEXT_COLUMNS]
+    if include_transcripts:
+        fields.append(pa.field("transcript", pa.string()))
+    return pa.schema(fields)
+
+
+def record_batch(rows: list, schema):
+    """One Arrow record batch from asyncpg rows holding the schema's columns"""
+    pa = import_pyarrow()
+    sentiments = pa.array(SENTIMENTS, pa.string())
+    positions = {value: i for i, value in enumerate(SENTIMENTS)}
+    arrays = []
+    for field in schema:
+        values = [row[field.name] for row in rows]
+        if field.name in SENTIMENT_COLUMNS:
+            # One fixed dictionary, so every batch shares it
+            indices = pa.array([positions.get(v) for v in values], pa.int8())
+            arrays.append(pa.DictionaryArray.from_arrays(indices, sentiments))
+        elif field.name in LABEL_COLUMNS:
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        elif field.name == "record_uuid":
+            arrays.append(pa.array([str(v) if v is not None else None for v in values], pa.string()))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class BytesSink:
+    """Write-only file object whose written bytes are taken out between batches"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def open_writer(sink, schema, file_format: str, compression: str = EXPORT_COMPRESSION):
+    """Writer with write_batch() and close() for a path or file object"""
+    pa = import_pyarrow()
+    if file_format == "parquet":
+        return pa.parquet.ParquetWriter(sink, schema, compression=compression)
+    options = pa.ipc.IpcWriteOptions(compression=compression if compression != "none" else None)
+    return pa.ipc.new_stream(sink, schema, options=options)
+
+
+class Export:
+    """
+    One export of the rows after a watermark, up to the settled end;
+    watermark is where the next export starts
+    """
+
+    def __init__(self, db, after: tuple, until: datetime.datetime,
+                 include_text: bool = False, include_transcripts: bool = False,
+                 batch_rows: int = EXPORT_BATCH_ROWS):
+        self.db = db
+        self.after = after
+        self.until = until
+        self.schema = arrow_schema(include_text, include_transcripts)
+        self.batch_rows = batch_rows
+        self.rows = 0
+        columns = EXPORT_COLUMNS + (TEXT_COLUMNS if include_text else ())
+        columns += (TRANSCRIPT_COLUMN,) if include_transcripts else ()
+        self.query = f"""
+            SELECT {", ".join(columns)} FROM call_records
+            WHERE (created_at, id) > ($1, $2) AND created_at < $3
+            ORDER BY created_at, id
+        """
+
+    @property
+    def watermark(self) -> str:
+        if self.until <= self.after[0]:
+            # Nothing settled since the last export; keep its watermark
+            return encode_cursor(*self.after)
+        # ids are positive, so (until, 0) sorts before every row created at until
+        return encode_cursor(self.until, 0)
+
+    async def _row_batches(self):
+        if self.until <= self.after[0]:
+            return
+        async for rows in self.db.stream(self.query, *self.after, self.until, batch_size=self.batch_rows):
+            yield rows
+
+    async def stream(self, file_format: str):
+        """The export as chunks of bytes in file_format, for a streaming response"""
+        sink = BytesSink()
+        writer = open_writer(sink, self.schema, file_format)
+
+        def write(rows):
+            writer.write_batch(record_batch(rows, self.schema))
+            return sink.take()
+
+        async for rows in self._row_batches():
+            # Encoding and compression run off the event loop
+            chunk = await asyncio.to_thread(write, rows)
+            self.rows += len(rows)
+            EXPORTED_ROWS.inc(len(rows), format=file_format)
+            if chunk:
+                yield chunk
+        writer.close()
+        yield sink.take()
+
+    async def write_file(self, path: str, file_format: str) -> int:
+        """Write the export to path; returns the number of rows"""
+        # Written beside the target and renamed, so a failed export leaves no partial file
+        partial = f"{path}.tmp"
+        writer = open_writer(partial, self.schema, file_format)
+        try:
+            async for rows in self._row_batches():
+                writer.write_batch(record_batch(rows, self.schema))
+                self.rows += len(rows)
+                EXPORTED_ROWS.inc(len(rows), format=file_format)
+        finally:
+            writer.close()
+        os.replace(partial, path)
+        return self.rows
+
+
+async def prepare_export(db, after: str = None, since: datetime.datetime = None,
+                         until: datetime.datetime = None, include_text: bool = False,
+                         include_transcripts: bool = False, settle_seconds: float = EXPORT_SETTLE_SECONDS) -> Export:
+    """An Export starting at the watermark after (or at since, or the first row), ending at until at the latest"""
+    if after and since:
+        raise InvalidQuery("Pass either a watermark or 'since', not both")
+    import_pyarrow()
+    since, until = await db_local_bounds(db, since, until)
+    start = decode_cursor(after) if after else (since or datetime.datetime.min, 0)
+    rows = await db.fetch(SETTLED_UNTIL, settle_seconds)
+    return Export(db, start, min(rows[0][0], until), include_text, include_transcripts)
+
+
+def read_watermark(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["watermark"]
+    except FileNotFoundError:
+        return None
+
+
+def write_watermark(path: str, watermark: str, until: datetime.datetime, output: str, rows: int):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump({"watermark": watermark, "until": until.isoformat(), "output": output, "rows": rows}, f, indent=2)
+        f.write("\n")
+    os.replace(partial, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export call_records insights as Parquet or Arrow")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--output", help="Output file (default: exports/call_records-<end>.<ext>)")
+    parser.add_argument("--watermark-file",
+                        help="Start after the watermark stored here and store the new one on success")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat,
+                        help="Start at this created_at when there is no watermark yet")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="End before this created_at")
+    parser.add_argument("--include-text", action="store_true",
+                        help="Also export key_results, summary and the other free-text fields")
+    parser.add_argument("--include-transcripts", action="store_true", help="Also export the transcripts")
+    parser.add_argument("--settle-seconds", type=float, default=EXPORT_SETTLE_SECONDS,
+                        help="Leave rows younger than this for the next export")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-statement timeout in seconds")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL not found in .env")
+
+    after = read_watermark(args.watermark_file) if args.watermark_file else None
+    db = Database(dsn, min_size=1, max_size=1, command_timeout=args.timeout, health_check_interval=0)
+    await db.connect()
+    try:
+        export = await prepare_export(db, after=after, since=None if after else args.since, until=args.until,
+                                      include_text=args.include_text,
+                                      include_transcripts=args.include_transcripts,
+                                      settle_seconds=args.settle_seconds)
+        output = args.output or os.path.join(
+            EXPORT_DIR, f"call_records-{export.until:%Y%m%dT%H%M%S}.{FORMATS[args.format][1]}")
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        rows = await export.write_file(output, args.format)
+    finally:
+        await db.close()
+
+    print(f"Exported {rows} rows up to {export.until} to {output} ({os.path.getsize(output)} bytes)")
+    if args.watermark_file:
+        write_watermark(args.watermark_file, export.watermark, export.until, output, rows)
+        print(f"Next export starts after {export.until} (watermark saved to {args.watermark_file})")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run(parse_args()))
+    except (InvalidQuery, ExportUnavailable) as e:
+        raise SystemExit(str(e))
@@ -0,0 +1,248 @@
+"""
+Asynchronous analysis jobs backed by the analysis_jobs table.
+
+POST /jobs stores the transcript and returns a job id at once. JobWorkerPool
+runs JOB_WORKERS workers per replica that claim queued jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of replicas share one queue
+without handing the same job to two workers. A job is retried after
+JOB_RETRY_DELAY seconds when it fails with a temporary error (LLM or database
+unavailable) and fails for good after JOB_MAX_ATTEMPTS claims. A claim is a
+lease of JOB_LEASE seconds, renewed every third of it while the job runs:
+jobs left running by a replica that died are picked up again when it runs
+out, however long a live worker's LLM calls take.
+
+Clients poll GET /jobs/{id}, or pass webhook_url to receive the same job
+document in a POST once the job is done or has failed. Webhooks are
+delivered at most once per finished job, retried JOB_WEBHOOK_RETRIES times.
+"""
+
+import os
+import asyncio
+import datetime
+
+from db import Database, DatabaseUnavailable
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+
+CLEANUP_INTERVAL = 3600
+
+
+class JobError(Exception):
+    """Raised by the job handler; retryable errors put the job back in the queue"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def job_document(job: dict) -> dict:
+    """The JSON shape of a job for GET /jobs/{id} and webhooks"""
+    document = {
+        "job_id": str(job["id"]),
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["webhook_status"] is not None:
+        document["webhook_status"] = job["webhook_status"]
+    return document
+
+
+class JobWorkerPool:
+    """
+    handler(job) analyzes one claimed job row (id, transcript, bypass_cache,
+    webhook_url, attempts, priority, tenant) and returns the result document, raising JobError
+    when it cannot.
+    """
+
+    def __init__(self, db: Database, handler,
+                 workers: int = JOB_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL,
+                 lease: float = JOB_LEASE,
+                 max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_delay: float = JOB_RETRY_DELAY):
+        self.db = db
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost_claims = 0
+        self.webhooks_delivered = 0
+        self.webhooks_failed = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = []
+        self._webhook_tasks = set()
+        self._client = None
+        self._last_cleanup = 0.0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    def notify(self):
+        """Wake idle workers after a job was enqueued by this replica"""
+        self._wakeup.set()
+
+    async def stop(self):
+        """Let running jobs finish; jobs still queued stay for the other replicas"""
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        if self._webhook_tasks:
+            await asyncio.gather(*self._webhook_tasks)
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                jobs = await self.db.claim_jobs(1, self.lease)
+            except Exception as e:
+                # Keep the worker alive; the next poll tries again
+                print("Job claim failed:", e)
+                jobs = []
+            if jobs:
+                await self._process(dict(jobs[0]))
+                continue
+
+            await self._cleanup()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, job: dict):
+        job_id, attempt = job["id"], job["attempts"]
+        self.busy += 1
+        try:
+            if attempt > self.max_attempts:
+                # Claimed again after its worker died mid-job too often
+                finished = await self.db.fail_job(job_id, attempt, "Job exceeded its attempts")
+                succeeded = False
+            else:
+                heartbeat = asyncio.create_task(self._hold_lease(job_id, attempt))
+                try:
+                    result = await self.handler(job)
+                except Exception as e:
+                    if not isinstance(e, JobError):
+                        print(f"Job {job_id} failed unexpectedly: {e}")
+                    if getattr(e, "retryable", False) and attempt < self.max_attempts:
+                        if await self.db.fail_job(job_id, attempt, str(e), retry_after=self.retry_delay * attempt):
+                            self.retried += 1
+                        return
+                    finished = await self.db.fail_job(job_id, attempt, str(e))
+                    succeeded = False
+                else:
+                    finished = await self.db.finish_job(job_id, attempt, result)
+                    succeeded = True
+                finally:
+                    heartbeat.cancel()
+            if not finished:
+                self.lost_claims += 1
+                print(f"Job {job_id} was claimed by another worker before attempt {attempt} finished")
+                return
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if job["webhook_url"]:
+                task = asyncio.create_task(self._deliver_webhook(job_id, job["webhook_url"]))
+                self._webhook_tasks.add(task)
+                task.add_done_callback(self._webhook_tasks.discard)
+        except Exception as e:
+            # The lease runs out and another worker picks the job up again
+            print(f"Job {job_id} could not be updated: {e}")
+        finally:
+            self.busy -= 1
+
+    async def _hold_lease(self, job_id, attempt: int):
+        """Renew the claim while the handler runs, so a slow job is not taken over"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self.db.extend_job_lease(job_id, attempt, self.lease):
+                    # finish_job / fail_job will find the claim lost as well
+                    return
+            except Exception as e:
+                # The lease still has two thirds left; try again next time
+                print(f"Job {job_id} lease renewal failed: {e}")
+
+    def _webhook_client(self):
+        # httpx is only imported once a job asks for a webhook
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT)
+        return self._client
+
+    async def _deliver_webhook(self, job_id, url: str):
+        delay = 1.0
+        try:
+            document = job_document(await self.db.get_job(job_id))
+            body = {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in document.items()}
+            for attempt in range(1, JOB_WEBHOOK_RETRIES + 2):
+                try:
+                    response = await self._webhook_client().post(url, json=body)
+                    if response.status_code < 500:
+                        delivered = response.status_code < 300
+                        break
+                    print(f"Webhook for job {job_id} returned {response.status_code} (attempt {attempt})")
+                except Exception as e:
+                    print(f"Webhook for job {job_id} failed (attempt {attempt}): {e}")
+                delivered = False
+                if attempt <= JOB_WEBHOOK_RETRIES:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+            await self.db.set_webhook_status(job_id, "delivered" if delivered else "failed")
+        except DatabaseUnavailable as e:
+            print(f"Webhook for job {job_id} skipped: {e}")
+            delivered = False
+        if delivered:
+            self.webhooks_delivered += 1
+        else:
+            self.webhooks_failed += 1
+
+    async def _cleanup(self):
+        """Delete finished jobs older than JOB_RETENTION_HOURS, at most once an hour"""
+        now = asyncio.get_running_loop().time()
+        if JOB_RETENTION_HOURS <= 0 or now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            deleted = await self.db.delete_finished_jobs(JOB_RETENTION_HOURS)
+            if deleted:
+                print(f"Deleted {deleted} finished jobs older than {JOB_RETENTION_HOURS:g} hours")
+        except Exception as e:
+            # Like a failed claim, this must not end the worker
+            print("Job cleanup failed:", e)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "busy": self.busy,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lost_claims": self.lost_claims,
+            "webhooks_delivered": self.webhooks_delivered,
+            "webhooks_failed": self.webhooks_failed,
+        }
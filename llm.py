@@ -0,0 +1,300 @@
+"""
+Resilient wrapper around the LLM backend (see backends.py).
+
+Every LLM call goes through LLMClient, which
+- paces requests and input tokens with shared RPM/TPM token buckets,
+- retries 429s, 5xx and network errors with exponential backoff and jitter,
+- adapts its concurrency limit AIMD-style: it halves when throttled and
+  grows back by one slot per window of successful calls,
+- opens a circuit breaker after repeated upstream failures so requests
+  fail fast instead of piling up behind a broken dependency.
+"""
+
+import os
+import time
+import random
+import asyncio
+
+from ratelimit import TokenBucket
+
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+LLM_CIRCUIT_RESET = float(os.getenv("LLM_CIRCUIT_RESET", "30"))
+
+THROTTLED_CODES = {429}
+TRANSIENT_CODES = {408, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting prompts
+    return len(text) // 4 + 1
+
+
+def classify_error(e: Exception) -> str:
+    """'throttled', 'transient' or 'fatal'"""
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        if code in THROTTLED_CODES:
+            return "throttled"
+        if code in TRANSIENT_CODES:
+            return "transient"
+        return "fatal"
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return "transient"
+    # httpx transport errors, without importing httpx here
+    if type(e).__module__.startswith("httpx"):
+        return "transient"
+    return "fatal"
+
+
+def retry_after(e: Exception):
+    """Seconds from a Retry-After header on the error's HTTP response, if any"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: +1 slot per `limit` successes, halved when throttled"""
+
+    def __init__(self, initial: int = LLM_INITIAL_CONCURRENCY,
+                 min_limit: int = LLM_MIN_CONCURRENCY,
+                 max_limit: int = LLM_MAX_CONCURRENCY):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._cond = asyncio.Condition()
+
+    def adjust(self, outcome: str):
+        if outcome == "throttled":
+            self.throttle_events += 1
+            self.limit = max(self.min_limit, self.limit / 2)
+        elif outcome == "success":
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    async def acquire(self):
+        """Wait for a slot; returns the ticket to pass to release()"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, outcome: str, ticket=None):
+        async with self._cond:
+            self.in_flight -= 1
+            self.adjust(outcome)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after reset_timeout lets one probe through"""
+
+    def __init__(self, failure_threshold: int = LLM_CIRCUIT_FAILURES,
+                 reset_timeout: float = LLM_CIRCUIT_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.times_opened += 1
+                print(f"LLM circuit breaker opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def end_probe(self):
+        """
+        Called when the half-open probe's call is over, however it ended. A probe
+        that did not succeed (fatal error, cancellation, retries spent on
+        throttling) re-opens the breaker instead of leaving it half-open for good.
+        """
+        if self.probing:
+            self.record_failure()
+
+
+class LLMClient:
+    def __init__(self, backend,
+                 rpm: float = LLM_RPM,
+                 tpm: float = LLM_TPM,
+                 timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 limiter: AdaptiveConcurrencyLimiter = None,
+                 requests: TokenBucket = None,
+                 tokens: TokenBucket = None):
+        """limiter, requests and tokens replace the per-process defaults, e.g. with coordinator.py's"""
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.requests = requests or (TokenBucket(rpm) if rpm else None)
+        self.tokens = tokens or (TokenBucket(tpm) if tpm else None)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def backoff(self, attempt: int, e: Exception) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        server_delay = retry_after(e)
+        return max(delay, server_delay) if server_delay else delay
+
+    async def _pace(self, prompt_tokens: int):
+        if self.requests:
+            await self.requests.acquire()
+        if self.tokens:
+            await self.tokens.acquire(prompt_tokens)
+
+    def _on_error(self, e: Exception, attempt: int):
+        """Returns the delay before retrying a failed attempt, or raises"""
+        kind = classify_error(e)
+        if kind == "transient":
+            self.breaker.record_failure()
+        if kind == "fatal":
+            self.failures += 1
+            raise e
+        if attempt == self.max_retries or self.breaker.state == "open":
+            self.failures += 1
+            raise LLMUnavailable(f"LLM call failed after {attempt + 1} attempts: {e}") from e
+        delay = self.backoff(attempt, e)
+        print(f"LLM {kind} error (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+        return delay
+
+    async def generate(self, model: str, prompt: str, **kwargs) -> str:
+        """Backend text generation with pacing, retries, adaptive concurrency and a circuit breaker"""
+        if not self.breaker.allow():
+            raise LLMUnavailable("LLM circuit breaker is open")
+        probe = self.breaker.probing
+
+        self.calls += 1
+        prompt_tokens = estimate_tokens(prompt)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._pace(prompt_tokens)
+                ticket = await self.limiter.acquire()
+                outcome = "error"
+                try:
+                    text = await asyncio.wait_for(
+                        self.backend.generate(model, prompt, **kwargs),
+                        timeout=self.timeout,
+                    )
+                    outcome = "success"
+                    self.breaker.record_success()
+                    return text
+                except Exception as e:
+                    outcome = "throttled" if classify_error(e) == "throttled" else "error"
+                    delay = self._on_error(e, attempt)
+                finally:
+                    await self.limiter.release(outcome, ticket)
+
+                self.retries += 1
+                await asyncio.sleep(delay)
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    async def stream(self, model: str, prompt: str, **kwargs):
+        """
+        Backend streaming under the same controls, yielding text chunks.
+        Only failures before the first chunk are retried; once output has
+        been handed to the caller a failure is raised as-is.
+        """
+        if not self.breaker.allow():
+            raise LLMUnavailable("LLM circuit breaker is open")
+        probe = self.breaker.probing
+
+        self.calls += 1
+        prompt_tokens = estimate_tokens(prompt)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._pace(prompt_tokens)
+                ticket = await self.limiter.acquire()
+                outcome = "error"
+                started = False
+                try:
+                    chunks = self.backend.stream(model, prompt, **kwargs).__aiter__()
+                    try:
+                        # The timeout covers the wait for the first chunk
+                        first = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        first = None
+                    started = True
+                    if first is not None:
+                        yield first
+                        async for text in chunks:
+                            yield text
+                    outcome = "success"
+                    self.breaker.record_success()
+                    return
+                except Exception as e:
+                    if started:
+                        self.failures += 1
+                        raise
+                    outcome = "throttled" if classify_error(e) == "throttled" else "error"
+                    delay = self._on_error(e, attempt)
+                finally:
+                    await self.limiter.release(outcome, ticket)
+
+                self.retries += 1
+                await asyncio.sleep(delay)
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "throttle_events": self.limiter.throttle_events,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+        }
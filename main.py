@@ -2,6 +2,7 @@
 AI Internship Assignment - Conversational Insights Generator
 
 Commands to run:
+python storage.py migrate
 uvicorn main:app --reload
 
 Test using curl:
@@ -12,23 +13,79 @@ curl -X POST http://127.0.0.1:8000/analyze_call \
 
 import os
 import json
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Literal
+import time
+import uuid
+import asyncio
+import datetime
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import ClassVar, List, Literal, Optional
 from dotenv import load_dotenv
-import asyncpg
 
-# Load .env
+# Load .env before the app modules below, which read their settings from the environment on import
 load_dotenv()
 
-# ENV Variables
+from db import Database, DatabaseUnavailable, WriteBehindWriter
+from cache import InsightCache, SingleFlight, insight_cache_key
+from llm import LLMClient, LLMUnavailable, estimate_tokens
+from backends import LLM_CONTEXT_CACHE, LLM_CONTEXT_CACHE_MIN_TOKENS, create_backend
+from scheduler import PriorityScheduler, priority
+from coordinator import LLM_COORDINATOR_SOCKET, CoordinatedLimiter, CoordinatorClient, RemoteBucket
+from streaming import IncrementalObjectParser, sse_event
+from parsing import PARSE_STATS, normalize_insight, parse_llm_json
+from chunking import chunk_transcript
+from prompts import PromptTemplate, get_template
+from classifier import LOCAL_CLASSIFIER_ENABLED, LocalClassifier
+from similarity import SIMILARITY_ENABLED, SIMILARITY_INDEX_FILE, SimilarityIndex, load_recent_insights
+from analytics import InvalidQuery, call_record_stats, list_call_records
+from export import FORMATS, ExportUnavailable, prepare_export
+from rollups import ROLLUPS_ENABLED, RollupAccumulator
+from jobs import JobError, JobWorkerPool, job_document
+from metrics import REGISTRY, LOCAL_CLASSIFICATIONS, PROMPT_TOKENS, VALIDATION_FAILURES, Counter, Gauge, MetricsMiddleware, stats_metrics, timed
+
+# ENV Variables. Missing ones are reported by the warm-up and /health/ready,
+# not on import, so tooling can import this module without a configured service
 DB_URL = os.getenv("DATABASE_URL")
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 
-if not DB_URL:
-    raise Exception("DATABASE_URL not found in .env")
-if not GEMINI_KEY:
-    raise Exception("GEMINI_API_KEY not found in .env")
+# "gemini", or "replay" / "synthetic" to run without network access
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_RECORD_FILE = os.getenv("LLM_RECORD_FILE")
+LLM_REPLAY_FILE = os.getenv("LLM_REPLAY_FILE")
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Prompt template from the registry in prompts.py (PROMPT_TEMPLATE). Its
+# version is part of the cache key, so cached insights are not reused across prompts
+prompt_template = get_template()
+PROMPT_VERSION = prompt_template.version
+
+# "prompt" asks for JSON in the prompt text; "schema" also sends a response
+# schema derived from CallInsight with the JSON mime type
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "prompt")
+if EXTRACTION_MODE not in ("prompt", "schema"):
+    raise Exception("EXTRACTION_MODE must be 'prompt' or 'schema'")
+
+# Concurrent identical requests share one LLM call. With "shared" they also
+# share one call_records row; with "separate" each still gets its own row.
+COALESCE_ROW_POLICY = os.getenv("COALESCE_ROW_POLICY", "separate")
+if COALESCE_ROW_POLICY not in ("shared", "separate"):
+    raise Exception("COALESCE_ROW_POLICY must be 'shared' or 'separate'")
+
+# Batch analysis: short transcripts are packed into one prompt up to this budget
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "6000"))
+BATCH_MAX_ITEMS_PER_PROMPT = int(os.getenv("BATCH_MAX_ITEMS_PER_PROMPT", "10"))
+BATCH_MAX_TRANSCRIPTS = int(os.getenv("BATCH_MAX_TRANSCRIPTS", "100"))
+
+# Transcripts estimated above this many tokens are chunked and map-reduced
+LONG_TRANSCRIPT_TOKENS = int(os.getenv("LONG_TRANSCRIPT_TOKENS", "8000"))
+TRANSCRIPT_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_CHUNK_TOKENS", "4000"))
+
+# Write-behind mode: respond before the call_records row is written
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+
+# Add a Server-Timing header with the per-stage breakdown to every response
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "false").lower() == "true"
 
 # Pydantic Model
 class CallInsight(BaseModel):
@@ -46,122 +103,821 @@ class CallInsight(BaseModel):
     action_required: bool
     summary: str
 
+    # Stored with the call record; not part of the LLM's schema or the response
+    classified_locally: ClassVar[bool] = False
+
+class LocalCallInsight(CallInsight):
+    """Insight from the local pre-classifier: its rating and start/end sentiments are placeholders"""
+    classified_locally: ClassVar[bool] = True
+
 # FastAPI App
 app = FastAPI(title="Conversational Insights Analyzer")
-db = None
+app.add_middleware(MetricsMiddleware, timing_header=TIMING_HEADER_ENABLED)
+db = Database(DB_URL)
+writer = WriteBehindWriter(db) if WRITE_BEHIND_ENABLED else None
+rollups = RollupAccumulator(db) if ROLLUPS_ENABLED else None
+insight_cache = InsightCache(db)
+inflight_insights = SingleFlight()
+inflight_records = SingleFlight()
+
+
+# AI Layer - Gemini or an offline backend. Under serve.py the concurrency
+# and rate budget is shared with the other worker processes
+if LLM_COORDINATOR_SOCKET:
+    coordinator = CoordinatorClient(LLM_COORDINATOR_SOCKET)
+    llm_budget = dict(limiter=CoordinatedLimiter(coordinator),
+                      requests=RemoteBucket(coordinator, "requests"), tokens=RemoteBucket(coordinator, "tokens"))
+else:
+    llm_budget = dict(limiter=PriorityScheduler())
+llm = LLMClient(create_backend(LLM_BACKEND, api_key=GEMINI_KEY,
+                               record_file=LLM_RECORD_FILE, replay_file=LLM_REPLAY_FILE),
+                **llm_budget)
+local_classifier = LocalClassifier.from_env() if LOCAL_CLASSIFIER_ENABLED else None
+similarity_index = SimilarityIndex(insights_from=f"{PROMPT_VERSION}/{GEMINI_MODEL}") if SIMILARITY_ENABLED else None
+similarity_bootstrap = None
+
+# Set by serve.py; worker 0 alone does what one process does for all of them
+SERVE_WORKER_ID = int(os.getenv("SERVE_WORKER_ID", "0"))
+
+# Warm-up: the database pool and the LLM backend are opened after startup,
+# in the background. Requests arriving earlier open them on first use
+STARTED_AT = time.monotonic()
+WARMUP_RETRY_INTERVAL = 5.0
+warmup = None
+warmup_state = {"done": False, "seconds": None, "llm": False, "errors": {}}
+
+class BatchCallInsight(CallInsight):
+    transcript_id: int
+
+
+def structured_output_schema(schema):
+    return schema if EXTRACTION_MODE == "schema" else None
+
 
+def build_prompt(prompt: tuple, template: PromptTemplate = None) -> tuple:
+    """(static prefix, full prompt text) for a template's (kind, body), counting its tokens"""
+    template = template or prompt_template
+    kind, body = prompt
+    prefix = template.prefixes[kind]
+    PROMPT_TOKENS.observe(template.prefix_tokens[kind] + estimate_tokens(body), template=template.version, kind=kind)
+    return prefix, prefix + body
 
-# AI Layer - Gemini
-from google import genai
-client = genai.Client(api_key=GEMINI_KEY)
 
-async def generate_insights(transcript: str) -> CallInsight:
+async def generate_content_text(prompt: tuple, response_schema=None, model: str = None,
+                                template: PromptTemplate = None) -> str:
+    prefix, text = build_prompt(prompt, template)
+    with timed("llm"):
+        return await llm.generate(model or GEMINI_MODEL, text, prefix=prefix, response_schema=response_schema)
+
+
+def validate_insight(data: dict) -> CallInsight:
+    with timed("validate"):
+        try:
+            return CallInsight(**data)
+        except ValidationError:
+            VALIDATION_FAILURES.inc()
+            raise
+
+
+async def extract_insight(prompt: tuple, model: str = None, template: PromptTemplate = None) -> CallInsight:
     try:
-        prompt = f"""
-        Analyze the following call transcript and return ONLY a valid JSON object with these exact fields:
-        
-        - customer_intent: string (the main intent/purpose of the customer's call)
-        - call_purpose: string (determine the primary purpose of this call - e.g., payment reminder, collection, dispute resolution)
-        - call_objective_met: boolean (assess whether the call objective was achieved)
-        - key_results: string (identify key outcomes like promises to pay, dispute resolutions, settlement agreements)
-        - customer_statements_analysis: string (analyze customer statements for intentions and circumstances)
-        - non_payment_reasons: string (identify reasons for non-payment, financial hardships, job loss, etc.)
-        - sentiment_start: string (customer sentiment at the beginning - "Negative", "Neutral", or "Positive")
-        - sentiment_end: string (customer sentiment at the end - "Negative", "Neutral", or "Positive")
-        - overall_sentiment: string (overall call sentiment - "Negative", "Neutral", or "Positive")
-        - agent_performance_rating: number (rate agent performance 1-10, where 10 is excellent)
-        - agent_performance_feedback: string (feedback on agent's conversation quality, professionalism, problem resolution)
-        - action_required: boolean (true if follow-up action is needed)
-        - summary: string (comprehensive summary of the call)
-
-        Transcript: {transcript}
-
-        Return only the JSON object, no additional text or formatting:
-        """
-
-        response = await client.aio.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        
-        if not response.candidates:
-            raise Exception("No content returned from LLM")
-        content_text = response.candidates[0].content.parts[0].text
-        
-        content_text = content_text.strip()
-        if content_text.startswith('```json'):
-            content_text = content_text[7:-3]  
-        elif content_text.startswith('```'):
-            content_text = content_text[3:-3]  
-        
-        content_text = content_text.strip()
-        # Parse JSON
-        data = json.loads(content_text)
-        return CallInsight(**data)
+        content_text = await generate_content_text(prompt, structured_output_schema(CallInsight), model, template)
+        # Parse JSON, repairing fences, trailing text, quotes and out-of-range values
+        with timed("parse"):
+            data = normalize_insight(parse_llm_json(content_text))
+        return validate_insight(data)
 
     except json.JSONDecodeError as e:
         print(f"JSON Parse Error: {e}")
         print(f"Raw content: {content_text if 'content_text' in locals() else 'No content'}")
         raise HTTPException(status_code=500, detail="Invalid JSON response from LLM")
+    except LLMUnavailable as e:
+        print("LLM Unavailable:", e)
+        raise HTTPException(status_code=503, detail="LLM temporarily unavailable.")
     except Exception as e:
         print("LLM Error:", e)
         raise HTTPException(status_code=500, detail="LLM extraction failed.")
 
 
+async def generate_insights(transcript: str, example=None, model: str = None,
+                            template: PromptTemplate = None) -> CallInsight:
+    """model and template default to GEMINI_MODEL and PROMPT_TEMPLATE; eval_matrix.py varies them"""
+    # A near-duplicate earlier call, when there is one, goes in as a worked example
+    return await extract_insight((template or prompt_template).single(transcript, example), model, template)
+
+
+# Long Transcripts - map-reduce over speaker-turn chunks
+async def generate_chunk_insights(chunk: str, part: int, parts: int) -> CallInsight:
+    return await extract_insight(prompt_template.chunk(chunk, part, parts))
+
+
+def merge_chunk_insights(insights: list) -> CallInsight:
+    """Deterministic reduce, used when the LLM reduce step fails"""
+    first, last = insights[0], insights[-1]
+    sentiments = [i.overall_sentiment for i in insights]
+    return CallInsight(
+        customer_intent=last.customer_intent,
+        call_purpose=first.call_purpose,
+        call_objective_met=last.call_objective_met,
+        key_results=" ".join(i.key_results for i in insights),
+        customer_statements_analysis=" ".join(i.customer_statements_analysis for i in insights),
+        non_payment_reasons=" ".join(i.non_payment_reasons for i in insights),
+        sentiment_start=first.sentiment_start,
+        sentiment_end=last.sentiment_end,
+        overall_sentiment=max(set(sentiments), key=sentiments.count),
+        agent_performance_rating=round(sum(i.agent_performance_rating for i in insights) / len(insights)),
+        agent_performance_feedback=" ".join(i.agent_performance_feedback for i in insights),
+        action_required=any(i.action_required for i in insights),
+        summary=" ".join(i.summary for i in insights),
+    )
+
+
+async def reduce_chunk_insights(insights: list) -> CallInsight:
+    parts = json.dumps([i.model_dump() for i in insights], ensure_ascii=False)
+    try:
+        merged = await extract_insight(prompt_template.reduce(parts))
+    except HTTPException as e:
+        print(f"Reduce step failed ({e.detail}), merging chunk insights directly")
+        merged = merge_chunk_insights(insights)
+
+    # How the call opened and closed is only visible in the first and last parts
+    merged.sentiment_start = insights[0].sentiment_start
+    merged.sentiment_end = insights[-1].sentiment_end
+    return merged
+
+
+async def analyze_transcript(transcript: str, example=None) -> CallInsight:
+    """Single-shot extraction for normal calls, map-reduce above LONG_TRANSCRIPT_TOKENS"""
+    if estimate_tokens(transcript) <= LONG_TRANSCRIPT_TOKENS:
+        return await generate_insights(transcript, example)
+
+    chunks = chunk_transcript(transcript, TRANSCRIPT_CHUNK_TOKENS)
+    if len(chunks) == 1:
+        return await generate_insights(transcript)
+    insights = await asyncio.gather(*(
+        generate_chunk_insights(chunk, part, len(chunks)) for part, chunk in enumerate(chunks, 1)
+    ))
+    return await reduce_chunk_insights(list(insights))
+
+
+# Local Pre-classifier - routine short calls without an LLM call
+def classify_locally(transcript: str):
+    """CallInsight when the local classifier is confident enough, else None"""
+    if local_classifier is None:
+        return None
+    with timed("local"):
+        data, confidence = local_classifier.classify(transcript)
+    if confidence is None:
+        LOCAL_CLASSIFICATIONS.inc(result="ineligible")
+    elif data is None:
+        LOCAL_CLASSIFICATIONS.inc(result="fallback")
+    else:
+        LOCAL_CLASSIFICATIONS.inc(result="accepted")
+        return LocalCallInsight(**data)
+    return None
+
+
+# Near-duplicates - templated calls reuse an earlier call's insight
+def find_similar(transcript: str):
+    """Match for the most similar earlier call, or None"""
+    if similarity_index is None:
+        return None
+    with timed("similarity"):
+        return similarity_index.query(transcript)
+
+
+def remember_insight(transcript: str, insight: CallInsight):
+    """Index an insight the LLM produced so later near-duplicates can use it"""
+    if similarity_index is not None:
+        similarity_index.add(transcript, insight.model_dump())
+
+
+async def build_similarity_index():
+    """Load the saved index, or index the most recent stored calls when there is none"""
+    # Parsing and MinHashing run in a thread; only the inserts touch the live index
+    entries = await asyncio.to_thread(similarity_index.read, SIMILARITY_INDEX_FILE)
+    if entries is not None:
+        await insert_similarity_entries(entries)
+        print(f"Loaded {len(similarity_index.entries)} transcripts into the similarity index")
+        return
+    if os.path.exists(SIMILARITY_INDEX_FILE):
+        # call_records does not say which prompt or model analyzed a call, and after
+        # a change most stored insights come from the old ones; start empty instead
+        print("Similarity index starts empty for the new prompt version or model")
+        return
+    try:
+        rows = await load_recent_insights(db, similarity_index.max_entries)
+    except DatabaseUnavailable as e:
+        print("Similarity index not built:", e)
+        return
+    # Oldest first, so the most recent calls are the last to be evicted
+    entries = await asyncio.to_thread(lambda: [similarity_index.entry(t, i) for t, i in reversed(rows)])
+    await insert_similarity_entries(entries)
+    print(f"Indexed {len(rows)} stored transcripts for near-duplicate detection")
+
+
+async def insert_similarity_entries(entries: list, batch: int = 500):
+    for start in range(0, len(entries), batch):
+        similarity_index.insert(entries[start:start + batch])
+        await asyncio.sleep(0)  # keep serving requests while indexing
+
+
+# Insight Cache - skip the LLM for transcripts we have already analyzed
+async def cached_insights(transcript: str, bypass_cache: bool = False) -> CallInsight:
+    key = insight_cache_key(transcript, PROMPT_VERSION, GEMINI_MODEL)
+    match = None
+    if not bypass_cache:
+        with timed("cache"):
+            cached = await insight_cache.get(key)
+        if cached is not None:
+            return CallInsight(**cached)
+        # Cheaper to recompute than to cache, so local results are not cached
+        local = classify_locally(transcript)
+        if local is not None:
+            return local
+        match = find_similar(transcript)
+        if match is not None and match.reusable:
+            return CallInsight(**match.insight)
+
+    async def extract():
+        insight = await analyze_transcript(transcript, example=match)
+        await insight_cache.put(key, insight.model_dump())
+        remember_insight(transcript, insight)
+        return insight
+
+    # A bypass_cache request must not be handed a result that came from the cache
+    insight, _ = await inflight_insights.do(f"{key}:bypass" if bypass_cache else key, extract)
+    return insight
+
+
+
+
+# Batch Analysis - several transcripts per LLM request
+def pack_transcripts(items: list, token_budget: int = BATCH_TOKEN_BUDGET,
+                     max_items: int = BATCH_MAX_ITEMS_PER_PROMPT) -> list:
+    """Greedily group (index, transcript) pairs so each group fits one prompt"""
+    prompt_overhead = prompt_template.prefix_tokens["batch"] + 50
+    groups, current, used = [], [], prompt_overhead
+    for index, transcript in items:
+        tokens = estimate_tokens(transcript)
+        if current and (used + tokens > token_budget or len(current) >= max_items):
+            groups.append(current)
+            current, used = [], prompt_overhead
+        current.append(index)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def generate_batch_insights(transcripts: dict) -> dict:
+    """
+    Analyze {transcript_id: transcript} in one LLM call. Returns
+    {transcript_id: CallInsight} for the items that came back valid;
+    anything missing is left for the caller to retry on its own.
+    """
+    try:
+        content_text = await generate_content_text(prompt_template.batch(transcripts),
+                                                   structured_output_schema(List[BatchCallInsight]))
+        with timed("parse"):
+            items = parse_llm_json(content_text)
+    except Exception as e:
+        print("Batch LLM Error:", e)
+        return {}
+    if not isinstance(items, list):
+        print("Batch LLM Error: expected a JSON array")
+        return {}
+
+    results = {}
+    for item in items:
+        try:
+            transcript_id = int(item.pop("transcript_id"))
+            if transcript_id in transcripts:
+                results[transcript_id] = validate_insight(normalize_insight(item))
+        except Exception as e:
+            print(f"Batch item parse error: {e}")
+    return results
+
+
+async def batch_insights(transcripts: list, bypass_cache: bool = False) -> list:
+    """CallInsight or HTTPException for every transcript, in input order"""
+    results = [None] * len(transcripts)
+    keys = [insight_cache_key(t, PROMPT_VERSION, GEMINI_MODEL) for t in transcripts]
+
+    pending = []
+    for index, key in enumerate(keys):
+        with timed("cache"):
+            cached = None if bypass_cache else await insight_cache.get(key)
+        if cached is not None:
+            results[index] = CallInsight(**cached)
+        elif not bypass_cache and (local := classify_locally(transcripts[index])) is not None:
+            results[index] = local
+        elif not bypass_cache and (match := find_similar(transcripts[index])) is not None and match.reusable:
+            results[index] = CallInsight(**match.insight)
+        else:
+            pending.append(index)
+
+    async def analyze_single(index):
+        try:
+            results[index] = await cached_insights(transcripts[index], bypass_cache=True)
+        except HTTPException as e:
+            results[index] = e
+
+    async def analyze_group(group):
+        if len(group) == 1:
+            return await analyze_single(group[0])
+        parsed = await generate_batch_insights({n: transcripts[i] for n, i in enumerate(group, 1)})
+        retries = []
+        for n, index in enumerate(group, 1):
+            if n in parsed:
+                results[index] = parsed[n]
+                await insight_cache.put(keys[index], parsed[n].model_dump())
+                remember_insight(transcripts[index], parsed[n])
+            else:
+                retries.append(analyze_single(index))
+        await asyncio.gather(*retries)
+
+    groups = pack_transcripts([(i, transcripts[i]) for i in pending])
+    await asyncio.gather(*(analyze_group(group) for group in groups))
+    return results
 
 
 # Startup - PostgreSQL Setup
+async def warm_up_llm():
+    if LLM_CONTEXT_CACHE and LLM_BACKEND == "gemini" and \
+            min(prompt_template.prefix_tokens.values()) < LLM_CONTEXT_CACHE_MIN_TOKENS:
+        print(f"LLM_CONTEXT_CACHE: prompt template {PROMPT_VERSION} has prefixes below "
+              f"{LLM_CONTEXT_CACHE_MIN_TOKENS} tokens, which are sent in full; use PROMPT_TEMPLATE=v3 to cache them")
+    try:
+        # Loading the Gemini SDK blocks for a while, so it runs in a thread
+        await asyncio.to_thread(llm.backend.warm_up)
+        warmup_state["llm"] = True
+        warmup_state["errors"].pop("llm", None)
+    except Exception as e:
+        warmup_state["errors"]["llm"] = str(e)
+        print("LLM backend warm-up failed:", e)
+
+
+async def warm_up_database():
+    # Keeps trying, so the replica becomes ready once the database is reachable
+    while True:
+        try:
+            await db.open()
+            warmup_state["errors"].pop("database", None)
+            # Claiming needs the database, so the job workers start once it is reachable
+            job_workers.start()
+            return
+        except Exception as e:
+            warmup_state["errors"]["database"] = str(e)
+            print("Database warm-up failed:", e)
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+
+async def warm_up():
+    started = time.perf_counter()
+    await asyncio.gather(warm_up_llm(), warm_up_database())
+    warmup_state["done"] = True
+    warmup_state["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Warm-up finished in {warmup_state['seconds']}s")
+
+
 @app.on_event("startup")
 async def startup():
-    global db
-    db = await asyncpg.connect(DB_URL)
-
-    await db.execute("""
-        CREATE TABLE IF NOT EXISTS call_records (
-            id SERIAL PRIMARY KEY,
-            transcript TEXT NOT NULL,
-            intent TEXT NOT NULL,
-            call_purpose TEXT NOT NULL,
-            call_objective_met BOOLEAN NOT NULL,
-            key_results TEXT NOT NULL,
-            customer_statements_analysis TEXT NOT NULL,
-            non_payment_reasons TEXT NOT NULL,
-            sentiment_start TEXT NOT NULL,
-            sentiment_end TEXT NOT NULL,
-            overall_sentiment TEXT NOT NULL,
-            agent_performance_rating INTEGER NOT NULL,
-            agent_performance_feedback TEXT NOT NULL,
-            action_required BOOLEAN NOT NULL,
-            summary TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-
-    print("Database initialized successfully")
+    # Nothing here waits for the database or the LLM SDK, so the server
+    # accepts connections (and answers /health/live) right away
+    global similarity_bootstrap, warmup
+    # The service keeps the partitions ahead (one worker under serve.py);
+    # bulk_process shares db without it
+    db.maintenance = SERVE_WORKER_ID == 0
+    warmup = asyncio.create_task(warm_up())
+    if similarity_index:
+        similarity_bootstrap = asyncio.create_task(build_similarity_index())
+    if writer:
+        writer.start()
+    if rollups:
+        rollups.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if warmup and not warmup.done():
+        warmup.cancel()
+    await job_workers.stop()
+    if writer:
+        await writer.drain()
+    if rollups:
+        await rollups.stop()
+    if similarity_index:
+        if similarity_bootstrap and not similarity_bootstrap.done():
+            similarity_bootstrap.cancel()
+        # Under serve.py one worker writes the file, rather than each overwriting the last
+        if SERVE_WORKER_ID == 0:
+            try:
+                similarity_index.save(SIMILARITY_INDEX_FILE)
+            except OSError as e:
+                print("Similarity index not saved:", e)
+    await db.close()
 
 
 # API Endpoint
+# LLM priority class; the request field wins over the X-Priority header
+Priority = Literal['interactive', 'near_real_time', 'bulk']
+
+
 class TranscriptRequest(BaseModel):
     transcript: str
+    bypass_cache: bool = False  # force a fresh LLM extraction
+    priority: Optional[Priority] = None
+
+
+def priority_headers(x_priority: Optional[Priority] = Header(default=None),
+                     x_tenant_id: Optional[str] = Header(default=None)) -> tuple:
+    return x_priority, x_tenant_id
+
+
+def request_priority(req, headers: tuple, default: str) -> tuple:
+    """(priority class, tenant) for a request"""
+    header_priority, tenant = headers
+    return req.priority or header_priority or default, tenant
 
 @app.post("/analyze_call")
-async def analyze_call(req: TranscriptRequest):
-    insight = await generate_insights(req.transcript)
-
-    result = await db.fetchrow("""
-        INSERT INTO call_records (transcript, intent, call_purpose, call_objective_met, key_results, 
-                                customer_statements_analysis, non_payment_reasons, sentiment_start, 
-                                sentiment_end, overall_sentiment, agent_performance_rating, 
-                                agent_performance_feedback, action_required, summary)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
-        RETURNING id
-    """, req.transcript, insight.customer_intent, insight.call_purpose, insight.call_objective_met,
-       insight.key_results, insight.customer_statements_analysis, insight.non_payment_reasons,
-       insight.sentiment_start, insight.sentiment_end, insight.overall_sentiment, 
-       insight.agent_performance_rating, insight.agent_performance_feedback, 
-       insight.action_required, insight.summary)
+async def analyze_call(req: TranscriptRequest, headers: tuple = Depends(priority_headers)):
+    with priority(*request_priority(req, headers, "interactive")):
+        if COALESCE_ROW_POLICY == "shared":
+            key = insight_cache_key(req.transcript, PROMPT_VERSION, GEMINI_MODEL)
+            if req.bypass_cache:
+                key += ":bypass"
+            response, _ = await inflight_records.do(key, lambda: analyze_and_store(req))
+            return response
+        return await analyze_and_store(req)
+
+
+async def store_insight(transcript: str, insight: CallInsight):
+    """Persist one call record; returns (record_id, record_uuid)"""
+    # record_uuid is generated here so write-behind callers still get an id
+    record_uuid = uuid.uuid4()
+    record_id = None
+    with timed("db"):
+        if writer:
+            await writer.submit(record_uuid, transcript, insight)
+        else:
+            record_id = await db.insert_call_record(record_uuid, transcript, insight)
+    if rollups:
+        rollups.add(insight)
+    return record_id, record_uuid
+
+
+async def analyze_and_store(req: TranscriptRequest) -> dict:
+    insight = await cached_insights(req.transcript, req.bypass_cache)
+
+    try:
+        record_id, record_uuid = await store_insight(req.transcript, insight)
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
 
     return {
-        "record_id": result["id"],
+        "record_id": record_id,
+        "record_uuid": str(record_uuid),
         "insights": insight
     }
+
+
+@app.post("/analyze_call/stream")
+async def analyze_call_stream(req: TranscriptRequest, headers: tuple = Depends(priority_headers)):
+    return StreamingResponse(
+        stream_analysis(req, request_priority(req, headers, "interactive")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_analysis(req: TranscriptRequest, scheduling: tuple):
+    """
+    SSE stream: one "field" event per CallInsight field as soon as the model
+    has written it, then "complete" with the persisted record, or "error"
+    """
+    # Set here because the body runs after the endpoint has returned
+    with priority(*scheduling):
+        async for event in stream_events(req):
+            yield event
+
+
+async def stream_events(req: TranscriptRequest):
+    key = insight_cache_key(req.transcript, PROMPT_VERSION, GEMINI_MODEL)
+    with timed("cache"):
+        cached = None if req.bypass_cache else await insight_cache.get(key)
+    reused = None
+    if cached is None and not req.bypass_cache:
+        reused = classify_locally(req.transcript)
+        if reused is None and (match := find_similar(req.transcript)) is not None and match.reusable:
+            reused = CallInsight(**match.insight)
+
+    if cached is not None or reused is not None:
+        insight = reused or CallInsight(**cached)
+        for name, value in insight.model_dump().items():
+            yield sse_event("field", {"name": name, "value": value})
+    else:
+        prefix, prompt = build_prompt(prompt_template.stream(req.transcript))
+        parser = IncrementalObjectParser()
+        try:
+            # JSON mime type only: a response schema would impose its own field order
+            with timed("llm"):
+                async for text in llm.stream(GEMINI_MODEL, prompt, prefix=prefix,
+                                             json_output=EXTRACTION_MODE == "schema"):
+                    for name, value in parser.feed(text):
+                        if name in CallInsight.model_fields:
+                            yield sse_event("field", {"name": name, "value": value})
+            with timed("parse"):
+                data = normalize_insight(parse_llm_json(parser.text))
+            insight = validate_insight(data)
+        except (json.JSONDecodeError, ValidationError) as e:
+            print(f"JSON Parse Error: {e}")
+            print(f"Raw content: {parser.text}")
+            yield sse_event("error", {"detail": "Invalid JSON response from LLM"})
+            return
+        except LLMUnavailable as e:
+            print("LLM Unavailable:", e)
+            yield sse_event("error", {"detail": "LLM temporarily unavailable."})
+            return
+        except Exception as e:
+            print("LLM Error:", e)
+            yield sse_event("error", {"detail": "LLM extraction failed."})
+            return
+        await insight_cache.put(key, insight.model_dump())
+        remember_insight(req.transcript, insight)
+
+    try:
+        record_id, record_uuid = await store_insight(req.transcript, insight)
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        yield sse_event("error", {"detail": "Database unavailable."})
+        return
+
+    yield sse_event("complete", {
+        "record_id": record_id,
+        "record_uuid": str(record_uuid),
+        "insights": insight.model_dump()
+    })
+
+
+class BatchTranscriptRequest(BaseModel):
+    transcripts: List[str] = Field(min_length=1, max_length=BATCH_MAX_TRANSCRIPTS)
+    bypass_cache: bool = False
+    priority: Optional[Priority] = None
+
+@app.post("/analyze_calls")
+async def analyze_calls(req: BatchTranscriptRequest, headers: tuple = Depends(priority_headers)):
+    with priority(*request_priority(req, headers, "near_real_time")):
+        insights = await batch_insights(req.transcripts, req.bypass_cache)
+
+    record_uuids = [uuid.uuid4() for _ in req.transcripts]
+    stored = [(record_uuids[i], req.transcripts[i], insight)
+              for i, insight in enumerate(insights) if isinstance(insight, CallInsight)]
+    record_ids = {}
+    try:
+        with timed("db"):
+            if writer:
+                for record in stored:
+                    await writer.submit(*record)
+            else:
+                record_ids = await db.bulk_insert_call_records(stored)
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+    if rollups:
+        for _, _, insight in stored:
+            rollups.add(insight)
+
+    results = []
+    for record_uuid, insight in zip(record_uuids, insights):
+        if isinstance(insight, HTTPException):
+            results.append({"error": insight.detail})
+        else:
+            results.append({
+                "record_id": record_ids.get(record_uuid),
+                "record_uuid": str(record_uuid),
+                "insights": insight
+            })
+    return {"results": results}
+
+
+# Async Jobs - queue a transcript, poll GET /jobs/{id} or get a webhook
+class JobRequest(TranscriptRequest):
+    webhook_url: Optional[str] = Field(default=None, pattern=r"^https?://")
+
+
+async def run_job(job: dict) -> dict:
+    try:
+        with priority(job["priority"], job["tenant"]):
+            insight = await cached_insights(job["transcript"], job["bypass_cache"])
+    except HTTPException as e:
+        raise JobError(e.detail, retryable=e.status_code == 503)
+    try:
+        # The job id is the record_uuid, so a job rerun after a lost lease stores one row
+        with timed("db"):
+            inserted = await db.bulk_insert_call_records_if_absent([(job["id"], job["transcript"], insight)])
+    except DatabaseUnavailable as e:
+        raise JobError(f"Database unavailable: {e}", retryable=True)
+    if rollups and inserted:
+        rollups.add(insight)
+    return {"record_uuid": str(job["id"]), "insights": insight.model_dump()}
+
+
+job_workers = JobWorkerPool(db, run_job)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: JobRequest, response: Response, headers: tuple = Depends(priority_headers)):
+    job_id = uuid.uuid4()
+    job_priority, tenant = request_priority(req, headers, "near_real_time")
+    try:
+        await db.enqueue_job(job_id, req.transcript, req.bypass_cache, req.webhook_url, job_priority, tenant)
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+    job_workers.notify()
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return {"job_id": str(job_id), "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: uuid.UUID):
+    try:
+        job = await db.get_job(job_id)
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_document(job)
+
+
+# Analytics - read API over call_records
+Sentiment = Literal['Negative', 'Neutral', 'Positive']
+
+
+@app.get("/call_records")
+async def get_call_records(since: Optional[datetime.datetime] = None,
+                           until: Optional[datetime.datetime] = None,
+                           overall_sentiment: Optional[Sentiment] = None,
+                           action_required: Optional[bool] = None,
+                           call_purpose: Optional[str] = None,
+                           call_objective_met: Optional[bool] = None,
+                           limit: int = 50,
+                           cursor: Optional[str] = None,
+                           include_transcript: bool = False):
+    filters = {"since": since, "until": until, "overall_sentiment": overall_sentiment,
+               "action_required": action_required, "call_purpose": call_purpose,
+               "call_objective_met": call_objective_met}
+    try:
+        return await list_call_records(db, filters, limit, cursor, include_transcript)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+
+
+@app.get("/call_records/stats")
+async def get_call_record_stats(since: Optional[datetime.datetime] = None,
+                                until: Optional[datetime.datetime] = None,
+                                overall_sentiment: Optional[Sentiment] = None,
+                                action_required: Optional[bool] = None,
+                                call_purpose: Optional[str] = None,
+                                call_objective_met: Optional[bool] = None,
+                                group_by: Literal['none', 'call_purpose', 'hour', 'day'] = "none",
+                                source: Optional[Literal['rollup', 'raw']] = None):
+    filters = {"since": since, "until": until, "overall_sentiment": overall_sentiment,
+               "action_required": action_required, "call_purpose": call_purpose,
+               "call_objective_met": call_objective_met}
+    try:
+        # Rollups by default; "raw" gives exact counts for arbitrary windows
+        source = source or ("rollup" if rollups else "raw")
+        return await call_record_stats(db, filters, group_by, source)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+
+
+@app.get("/call_records/export")
+async def export_call_records(file_format: Literal['arrow', 'parquet'] = Query("arrow", alias="format"),
+                              after: Optional[str] = None,
+                              since: Optional[datetime.datetime] = None,
+                              until: Optional[datetime.datetime] = None,
+                              include_text: bool = False,
+                              include_transcripts: bool = False):
+    """
+    Insights after the watermark `after` (or from `since`) as an Arrow IPC
+    stream or Parquet file; X-Export-Watermark is the `after` of the next export
+    """
+    try:
+        export = await prepare_export(db, after, since, until, include_text, include_transcripts)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except DatabaseUnavailable as e:
+        print("Database Error:", e)
+        raise HTTPException(status_code=503, detail="Database unavailable.")
+
+    media_type, extension = FORMATS[file_format]
+    filename = f"call_records-{export.until:%Y%m%dT%H%M%S}.{extension}"
+    return StreamingResponse(export.stream(file_format), media_type=media_type, headers={
+        "X-Export-Watermark": export.watermark,
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+
+
+# Metrics - Prometheus text format
+def collect_component_metrics() -> list:
+    """Component state read at scrape time instead of on every request"""
+    parse_results = Counter("llm_parse_results_total", "LLM outputs by JSON parse outcome", ["result"])
+    for result, count in PARSE_STATS.items():
+        parse_results.inc(count, result=result)
+    metrics = [parse_results]
+    metrics += stats_metrics("db_pool", db.stats())
+    metrics += stats_metrics("llm", {k: v for k, v in llm.stats().items() if k != "backend"},
+                             counters=("calls", "retries", "failures", "throttle_events", "circuit_opened"))
+    metrics += stats_metrics("insight_cache", insight_cache.stats(),
+                             counters=("memory_hits", "db_hits", "misses", "evictions", "db_errors"))
+    metrics += stats_metrics("coalesce_insights", inflight_insights.stats(), counters=("leaders", "coalesced"))
+    metrics += stats_metrics("coalesce_records", inflight_records.stats(), counters=("leaders", "coalesced"))
+    if writer:
+        metrics += stats_metrics("write_behind", writer.stats(),
+                                 counters=("rows_flushed", "flushes", "failed_flushes", "rows_dropped"))
+    if rollups:
+        metrics += stats_metrics("rollups", rollups.stats(),
+                                 counters=("calls_added", "flushes", "failed_flushes"))
+    scheduled = llm.limiter.stats()
+    for name in ("in_flight", "queued", "limit"):
+        gauge = Gauge(f"llm_scheduler_{name}", f"LLM scheduler {name} per priority class", ["priority"])
+        for priority_class, values in scheduled.items():
+            gauge.set(values[name], priority=priority_class)
+        metrics.append(gauge)
+    if similarity_index:
+        metrics += stats_metrics("similarity", similarity_index.stats(), counters=("reused", "few_shot", "misses"))
+    metrics += stats_metrics("jobs", job_workers.stats(),
+                             counters=("completed", "failed", "retried", "lost_claims",
+                                       "webhooks_delivered", "webhooks_failed"))
+    return metrics
+
+
+REGISTRY.add_collector(collect_component_metrics)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def readiness_checks() -> dict:
+    return {
+        "database": db.pool is not None and db.healthy,
+        "schema": db.schema_current,
+        "llm": warmup_state["llm"],
+    }
+
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop responds; dependencies are not checked"""
+    return {"status": "alive", "uptime_seconds": round(time.monotonic() - STARTED_AT, 1)}
+
+
+@app.get("/health/ready")
+async def readiness(response: Response):
+    """503 until the warm-up has opened the database pool and the LLM backend"""
+    checks = readiness_checks()
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "checks": checks, "schema_version": db.schema_version, "warmup": warmup_state}
+
+
+@app.get("/health")
+async def health():
+    status = {
+        "ready": readiness_checks(),
+        "database": db.stats(),
+        "insight_cache": insight_cache.stats(),
+        "llm": llm.stats(),
+        "parsing": {"mode": EXTRACTION_MODE, **PARSE_STATS},
+        "prompt": prompt_template.stats(),
+        "coalescing": {
+            "row_policy": COALESCE_ROW_POLICY,
+            "insights": inflight_insights.stats(),
+            "records": inflight_records.stats(),
+        },
+    }
+    if writer:
+        status["write_behind"] = writer.stats()
+    if rollups:
+        status["rollups"] = rollups.stats()
+    status["jobs"] = job_workers.stats()
+    status["scheduler"] = llm.limiter.stats()
+    if similarity_index:
+        status["similarity"] = similarity_index.stats()
+    return status
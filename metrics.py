@@ -0,0 +1,242 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms are updated on the hot path; state owned by
+other components (pool sizes, cache hit counts, queue depths) is read by
+collectors only when /metrics is scraped. timed(stage) records how long a
+stage of the insight pipeline took, both into a histogram and into the
+current request's breakdown, which MetricsMiddleware can return as a
+Server-Timing header.
+"""
+
+import time
+import bisect
+import contextlib
+import contextvars
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> value
+        if not self.labelnames and self.kind in ("counter", "gauge"):
+            self.values[()] = 0  # unlabeled series are exported before the first update
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": f"{bound:g}"}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """collect() returns metrics built fresh at scrape time"""
+        self.collectors.append(collect)
+
+    def render(self) -> str:
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "insight_stage_duration_seconds", "Time spent per insight pipeline stage", ["stage"])
+HTTP_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response starts", ["method", "path", "status"])
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled")
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "LLM tokens by direction; estimated for non-Gemini backends", ["backend", "direction"])
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a concurrency slot", ["priority"])
+PROMPT_TOKENS = REGISTRY.histogram(
+    "llm_prompt_tokens", "Estimated prompt tokens per LLM call by prompt template version and kind",
+    ["template", "kind"], buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+LOCAL_CLASSIFICATIONS = REGISTRY.counter(
+    "local_classifier_results_total", "Local pre-classifier outcomes: accepted, fallback or ineligible", ["result"])
+VALIDATION_FAILURES = REGISTRY.counter(
+    "insight_validation_failures_total", "LLM output that parsed as JSON but failed CallInsight validation")
+EXPORTED_ROWS = REGISTRY.counter(
+    "call_records_exported_rows_total", "call_records rows written by columnar exports", ["format"])
+
+
+def stats_metrics(prefix: str, stats: dict, counters=()) -> list:
+    """
+    Metrics for a component's stats() dict, built at scrape time: keys in
+    counters become <prefix>_<key>_total counters, other numbers and bools
+    become gauges, and a string becomes a gauge set to 1 with the string as
+    its "state" label.
+    """
+    metrics = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if key in counters:
+            metric = Counter(f"{name}_total", f"{prefix} {key}")
+            metric.inc(value)
+        elif isinstance(value, str):
+            metric = Gauge(name, f"{prefix} {key}", ["state"])
+            metric.set(1, state=value)
+        elif isinstance(value, (int, float)):
+            metric = Gauge(name, f"{prefix} {key}")
+            metric.set(value)
+        else:
+            continue
+        metrics.append(metric)
+    return metrics
+
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """Time a pipeline stage into STAGE_DURATION and the request's breakdown"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def server_timing(timings: dict, total: float) -> str:
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template and the
+    number of requests in flight. With timing_header it adds a
+    Server-Timing header listing the stages timed while handling the
+    request; for streamed responses that is only the work done before the
+    first byte.
+    """
+
+    def __init__(self, app, timing_header: bool = False):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+        HTTP_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                route = scope.get("route")
+                HTTP_DURATION.observe(elapsed, method=scope["method"],
+                                      path=getattr(route, "path", "unmatched"), status=message["status"])
+                if self.timing_header:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(timings, elapsed).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            _request_timings.reset(token)
@@ -0,0 +1,119 @@
+"""
+Tolerant parsing of LLM JSON output.
+
+parse_llm_json tries the cheap path first (plain json.loads after removing
+code fences) and only falls back to repairs when that fails:
+- trailing text after the JSON value is ignored (raw_decode),
+- single-quoted strings, Python literals (True/False/None) and trailing
+  commas are rewritten into valid JSON.
+normalize_insight then fixes values the model commonly gets slightly wrong,
+such as an agent_performance_rating outside 1-10.
+"""
+
+import json
+
+SENTIMENTS = ("Negative", "Neutral", "Positive")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+# How often each path was needed; reported by /health
+PARSE_STATS = {"clean": 0, "repaired": 0, "failed": 0}
+
+
+def strip_code_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text[3:]
+        end = text.rfind("```")
+        if end != -1:
+            text = text[:end]
+    return text.strip()
+
+
+def _json_start(text: str) -> int:
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return min(starts) if starts else -1
+
+
+def repair_json(text: str) -> str:
+    """Rewrite single-quoted strings, Python literals and trailing commas"""
+    out = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch in "\"'":
+            quote = ch
+            i += 1
+            chars = []
+            while i < n and text[i] != quote:
+                if text[i] == "\\" and i + 1 < n:
+                    # \' is not a valid JSON escape; other escapes pass through
+                    chars.append("'" if text[i + 1] == "'" else text[i:i + 2])
+                    i += 2
+                    continue
+                chars.append('\\"' if text[i] == '"' and quote == "'" else text[i])
+                i += 1
+            out.append('"' + "".join(chars) + '"')
+            i += 1
+        elif ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j < n and text[j] in "}]":
+                i += 1
+                continue
+            out.append(ch)
+            i += 1
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def parse_llm_json(text: str):
+    """Parse the JSON value in an LLM reply, repairing common defects"""
+    text = strip_code_fences(text)
+    try:
+        value = json.loads(text)
+        PARSE_STATS["clean"] += 1
+        return value
+    except json.JSONDecodeError as e:
+        error = e
+
+    start = _json_start(text)
+    if start != -1:
+        decoder = json.JSONDecoder()
+        for candidate in (text, repair_json(text[start:])):
+            try:
+                value, _ = decoder.raw_decode(candidate, start if candidate is text else 0)
+                PARSE_STATS["repaired"] += 1
+                return value
+            except json.JSONDecodeError:
+                continue
+
+    PARSE_STATS["failed"] += 1
+    raise error
+
+
+def normalize_insight(data: dict) -> dict:
+    """Coerce near-miss field values into what CallInsight accepts"""
+    if not isinstance(data, dict):
+        return data
+    rating = data.get("agent_performance_rating")
+    if rating is not None:
+        try:
+            data["agent_performance_rating"] = min(10, max(1, round(float(rating))))
+        except (TypeError, ValueError):
+            pass
+    for field in ("sentiment_start", "sentiment_end", "overall_sentiment"):
+        value = data.get(field)
+        if isinstance(value, str) and value.strip().capitalize() in SENTIMENTS:
+            data[field] = value.strip().capitalize()
+    return data
@@ -0,0 +1,192 @@
+"""
+Versioned prompt templates for insight extraction.
+
+Every prompt is a static prefix (the instructions and the field list) followed
+by the per-call body (the transcript and the closing instruction). Prefixes
+are built once when the module loads. Because the prefix comes first and never
+changes within a version, backends with context caching can register it once
+and send only the body; see LLM_CONTEXT_CACHE in backends.py.
+
+Select a template with PROMPT_TEMPLATE:
+- v2: fields with full descriptions,
+- v2-compact: terse field list, roughly half the prefix tokens,
+- v3: v2 plus a labelling guide and two worked examples. Its prefixes are
+  over the 1,024 tokens Gemini needs before it caches content, so this is
+  the template to use with LLM_CONTEXT_CACHE.
+The version is part of the insight cache key, so switching templates never
+serves insights extracted with another one.
+"""
+
+import os
+import json
+
+from llm import estimate_tokens
+
+PROMPT_TEMPLATE = os.getenv("PROMPT_TEMPLATE", "v2")
+
+INSIGHT_FIELDS = """
+- customer_intent: string (the main intent/purpose of the customer's call)
+- call_purpose: string (determine the primary purpose of this call - e.g., payment reminder, collection, dispute resolution)
+- call_objective_met: boolean (assess whether the call objective was achieved)
+- key_results: string (identify key outcomes like promises to pay, dispute resolutions, settlement agreements)
+- customer_statements_analysis: string (analyze customer statements for intentions and circumstances)
+- non_payment_reasons: string (identify reasons for non-payment, financial hardships, job loss, etc.)
+- sentiment_start: string (customer sentiment at the beginning - "Negative", "Neutral", or "Positive")
+- sentiment_end: string (customer sentiment at the end - "Negative", "Neutral", or "Positive")
+- overall_sentiment: string (overall call sentiment - "Negative", "Neutral", or "Positive")
+- agent_performance_rating: number (rate agent performance 1-10, where 10 is excellent)
+- agent_performance_feedback: string (feedback on agent's conversation quality, professionalism, problem resolution)
+- action_required: boolean (true if follow-up action is needed)
+- summary: string (comprehensive summary of the call)"""
+
+COMPACT_INSIGHT_FIELDS = """
+- customer_intent: str
+- call_purpose: str (e.g. payment reminder, collection, dispute resolution)
+- call_objective_met: bool
+- key_results: str (promises to pay, resolutions, settlements)
+- customer_statements_analysis: str
+- non_payment_reasons: str
+- sentiment_start: "Negative"|"Neutral"|"Positive"
+- sentiment_end: "Negative"|"Neutral"|"Positive"
+- overall_sentiment: "Negative"|"Neutral"|"Positive"
+- agent_performance_rating: int 1-10
+- agent_performance_feedback: str
+- action_required: bool (follow-up needed)
+- summary: str"""
+
+# Stable labelling conventions and worked examples; long enough that every v3
+# prefix can be stored as Gemini cached content
+LABELLING_GUIDE = """Labelling guide:
+- call_purpose: name the stage of the loan the call is about, e.g. "Payment reminder" before the due date, \
+"Collection" once an EMI is overdue, "Recovery" when legal action, field visits or long delinquency come up, \
+"Dispute resolution" when the customer contests the amount or a charge.
+- call_objective_met: true when the customer committed to a specific payment, the dispute was resolved, or \
+the information the agent called to deliver was acknowledged; false when the call ended without it.
+- key_results: the concrete outcomes, with amounts and dates as stated, e.g. "PTP of 5,000 by 10th". Write \
+"No commitment made" when there is none.
+- customer_statements_analysis: what the customer's statements reveal about willingness and ability to pay, \
+quoting or paraphrasing the decisive statement.
+- non_payment_reasons: the reasons the customer gives (salary delay, job loss, medical expenses, dispute), \
+or "None stated".
+- Sentiment is the customer's, not the agent's. Negative: anger, frustration, refusal, complaints of \
+harassment. Neutral: matter-of-fact, polite or hesitant. Positive: cooperative and appreciative. \
+sentiment_start and sentiment_end describe the first and last customer turns; overall_sentiment weighs \
+the whole call.
+- agent_performance_rating: 9-10 clear, empathetic and compliant, with the outcome confirmed; 7-8 \
+professional with minor gaps; 5-6 incomplete information or no confirmation of the outcome; 3-4 pushy, \
+confusing or dismissive; 1-2 abusive, threatening or non-compliant. agent_performance_feedback explains \
+the rating in one or two sentences.
+- action_required: true when someone must follow up: a promised payment to verify, a callback, a dispute \
+to investigate, a document to send, a complaint to escalate.
+- summary: two or three sentences covering purpose, outcome and next step.
+- Transcripts mix Hindi and English; write every value in English.
+
+Example transcript: Agent: Namaste, main ABC Finance se bol raha hoon, aapki EMI of 4,500 ki due date 5th \
+hai, bas reminder ke liye call kiya. Customer: Haan ji, pata hai. Salary 3rd ko aati hai, main 4th tak pay \
+kar dunga. Agent: Bahut badhiya, app se pay kar sakte hain. Dhanyavaad. Customer: Thank you.
+Example analysis: {"customer_intent": "Acknowledge the reminder and commit to pay", \
+"call_purpose": "Payment reminder", "call_objective_met": true, "key_results": "PTP of 4,500 by 4th", \
+"customer_statements_analysis": "Customer is aware of the due date and willing to pay once the salary \
+arrives on the 3rd.", "non_payment_reasons": "None stated", "sentiment_start": "Neutral", \
+"sentiment_end": "Positive", "overall_sentiment": "Positive", "agent_performance_rating": 8, \
+"agent_performance_feedback": "Polite and clear; confirmed the amount and date and pointed to the app, \
+but did not confirm the payment channel details.", "action_required": true, "summary": "Pre-due \
+reminder for an EMI of 4,500. The customer promised to pay by the 4th after the salary arrives; the \
+payment should be verified after the due date."}
+
+Example transcript: Agent: Sir, aapki EMI 45 din se overdue hai, late fees lag rahi hai. Customer: Maine \
+pichhle mahine hi bola tha, meri job chali gayi hai. Aap log roz call karke harass kar rahe ho. Agent: Sir \
+main samajh sakta hoon, kya aap part payment kar sakte hain? Customer: Abhi kuch nahi ho sakta, next \
+month dekhte hain.
+Example analysis: {"customer_intent": "Explain inability to pay and ask for time", \
+"call_purpose": "Collection", "call_objective_met": false, "key_results": "No commitment made; customer \
+may pay next month", "customer_statements_analysis": "Customer is willing in principle but unable to \
+pay after losing the job, and feels harassed by repeated calls.", "non_payment_reasons": "Job loss", \
+"sentiment_start": "Negative", "sentiment_end": "Neutral", "overall_sentiment": "Negative", \
+"agent_performance_rating": 7, "agent_performance_feedback": "Empathetic and offered a part payment, \
+but did not mention hardship or restructuring options.", "action_required": true, "summary": "Collection \
+call on an EMI 45 days overdue. The customer lost the job, complained about repeated calls and made no \
+commitment; a hardship review and a callback next month are needed."}"""
+
+# Streaming asks for the fields agent-assist shows first ahead of the long text ones
+STREAM_FIELD_ORDER = [
+    "sentiment_start", "action_required", "overall_sentiment", "sentiment_end",
+    "call_purpose", "call_objective_met", "customer_intent", "agent_performance_rating",
+    "non_payment_reasons", "key_results", "customer_statements_analysis",
+    "agent_performance_feedback", "summary",
+]
+
+RETURN_OBJECT = "\n\nReturn only the JSON object, no additional text or formatting:"
+RETURN_ARRAY = "\n\nReturn only the JSON array, no additional text or formatting:"
+
+
+def order_insight_fields(fields: str, order: list) -> str:
+    """A field list with its lines rearranged to follow order"""
+    lines = {line.split(":")[0].strip(" -"): line for line in fields.strip("\n").split("\n")}
+    return "\n" + "\n".join(lines[name] for name in order)
+
+
+class PromptTemplate:
+    """The static prefixes of one prompt version, by prompt kind"""
+
+    def __init__(self, version: str, fields: str, guide: str = None):
+        self.version = version
+        self.fields = fields
+        stream_fields = order_insight_fields(fields, STREAM_FIELD_ORDER)
+        if guide:
+            # Part of every prefix, so the whole of it is cached with the instructions
+            fields += f"\n\n{guide}"
+            stream_fields += f"\n\n{guide}"
+        self.prefixes = {
+            "single": "Analyze the following call transcript and return ONLY a valid JSON object "
+                      f"with these exact fields:{fields}\n\n",
+            "stream": "Analyze the following call transcript and return ONLY a valid JSON object "
+                      f"with these exact fields, in this order:{stream_fields}\n\n",
+            "chunk": "The following is one part of a longer call transcript; the parts are analyzed "
+                      "separately and merged afterwards.\nAnalyze this part and return ONLY a valid "
+                      f"JSON object with these exact fields:{fields}\n\n",
+            "reduce": "The following JSON array holds insights extracted from consecutive parts of ONE "
+                      "call transcript, in order.\nMerge them into a single JSON object describing the "
+                      f"whole call, with these exact fields:{fields}\n\n",
+            "batch": "Analyze each of the following call transcripts and return ONLY a valid JSON array "
+                     "with one object per transcript.\nEach object must include \"transcript_id\" (the "
+                     f"number of the transcript it describes) and these exact fields:{fields}\n\n",
+        }
+        self.prefix_tokens = {kind: estimate_tokens(prefix) for kind, prefix in self.prefixes.items()}
+
+    def single(self, transcript: str, example=None) -> tuple:
+        """(kind, body) for one transcript, optionally with a similar earlier call as a worked example"""
+        reference = "" if example is None else (
+            "A similar earlier call and its analysis, for reference:\n"
+            f"Example transcript: {example.transcript}\n"
+            f"Example analysis: {json.dumps(example.insight, ensure_ascii=False)}\n\n")
+        return "single", f"{reference}Transcript: {transcript}{RETURN_OBJECT}"
+
+    def stream(self, transcript: str) -> tuple:
+        return "stream", f"Transcript: {transcript}{RETURN_OBJECT}"
+
+    def chunk(self, chunk: str, part: int, parts: int) -> tuple:
+        return "chunk", f"Transcript part {part}/{parts}: {chunk}{RETURN_OBJECT}"
+
+    def reduce(self, part_insights: str) -> tuple:
+        return "reduce", f"Part insights: {part_insights}{RETURN_OBJECT}"
+
+    def batch(self, transcripts: dict) -> tuple:
+        numbered = "\n\n".join(f"Transcript {n}: {t}" for n, t in transcripts.items())
+        return "batch", f"{numbered}{RETURN_ARRAY}"
+
+    def stats(self) -> dict:
+        return {"version": self.version, "prefix_tokens": self.prefix_tokens}
+
+
+TEMPLATES = {template.version: template for template in (
+    PromptTemplate("v2", INSIGHT_FIELDS),
+    PromptTemplate("v2-compact", COMPACT_INSIGHT_FIELDS),
+    PromptTemplate("v3", INSIGHT_FIELDS, LABELLING_GUIDE),
+)}
+
+
+def get_template(version: str = PROMPT_TEMPLATE) -> PromptTemplate:
+    if version not in TEMPLATES:
+        raise Exception(f"PROMPT_TEMPLATE must be one of: {', '.join(TEMPLATES)}")
+    return TEMPLATES[version]
@@ -0,0 +1,166 @@
+"""
+Incrementally maintained hourly rollups of call_records.
+
+RollupAccumulator counts every stored insight in memory by hour,
+call_purpose, overall_sentiment, call_objective_met and action_required,
+and adds the counts onto call_record_rollups with one batched upsert every
+ROLLUP_FLUSH_INTERVAL seconds. Day buckets are summed from the hours at
+query time, so dashboard reads cost O(buckets) instead of O(calls).
+
+Counts still in memory when a process dies are lost; rebuild the affected
+hours from call_records with the backfill command, which also fills the
+rollups for rows stored before they existed.
+
+Usage:
+python rollups.py --since 2025-01-01 --until 2025-07-01
+"""
+
+import os
+import asyncio
+import argparse
+import datetime
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Before db and the ROLLUP_* settings below are read
+load_dotenv()
+
+from db import Database, DatabaseUnavailable
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "5"))
+
+
+def hour_bucket(at: datetime.datetime) -> datetime.datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class RollupAccumulator:
+    def __init__(self, db: Database, flush_interval: float = ROLLUP_FLUSH_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval
+        # (bucket_start, purpose, sentiment, objective_met, action_required) -> [calls, rated_calls, rating_sum]
+        self.counts = {}
+        self.calls_added = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        # Database local time minus UTC; the app's own zone until the first flush measures it
+        self.clock_offset = datetime.datetime.now() - utc_now()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    def now(self) -> datetime.datetime:
+        """The database's local time, which created_at's CURRENT_TIMESTAMP default stores"""
+        return utc_now() + self.clock_offset
+
+    async def sync_clock(self):
+        rows = await self.db.fetch("SELECT LOCALTIMESTAMP")
+        self.clock_offset = rows[0][0] - utc_now()
+
+    def add(self, insight, at: datetime.datetime = None):
+        # Bucketed by the database's clock and zone, so the hours line up with created_at
+        key = (hour_bucket(at or self.now()), insight.call_purpose, insight.overall_sentiment,
+               insight.call_objective_met, insight.action_required)
+        counts = self.counts.setdefault(key, [0, 0, 0])
+        counts[0] += 1
+        # A locally classified call's rating is a placeholder, not an assessment
+        if not insight.classified_locally:
+            counts[1] += 1
+            counts[2] += insight.agent_performance_rating
+        self.calls_added += 1
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Let an in-progress flush finish, then flush what is left"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self):
+        counts, self.counts = self.counts, {}
+        if not counts:
+            return
+        rows = [(*key, *values) for key, values in counts.items()]
+        try:
+            await self.db.upsert_rollups(rows)
+            self.flushes += 1
+        except (DatabaseUnavailable, asyncpg.PostgresError) as e:
+            # Keep the counts for the next flush
+            self.failed_flushes += 1
+            print(f"Rollup flush of {len(rows)} buckets failed, retrying later: {e}")
+            for key, values in counts.items():
+                pending = self.counts.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(values):
+                    pending[i] += value
+            return
+        try:
+            # Follows DST changes and a database moved to another zone
+            await self.sync_clock()
+        except (DatabaseUnavailable, asyncpg.PostgresError) as e:
+            print("Rollup clock sync failed:", e)
+
+    def stats(self) -> dict:
+        return {
+            "pending_buckets": len(self.counts),
+            "calls_added": self.calls_added,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# Backfill
+async def backfill(db: Database, since: datetime.datetime, until: datetime.datetime, step_hours: int):
+    """Rebuild whole hours in [since, until) from call_records, one step per transaction"""
+    start = hour_bucket(since)
+    step = datetime.timedelta(hours=step_hours)
+    while start < until:
+        end = min(start + step, until)
+        await db.rebuild_rollups(start, end)
+        print(f"Rebuilt rollups for {start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}")
+        start = end
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild call_record_rollups from call_records")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, required=True)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat,
+                        help="Exclusive end (default: start of the current hour)")
+    parser.add_argument("--step-hours", type=int, default=24, help="Hours rebuilt per transaction")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-statement timeout in seconds")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL not found in .env")
+
+    db = Database(dsn, min_size=1, max_size=1, command_timeout=args.timeout, health_check_interval=0)
+    await db.connect()
+    try:
+        # The current hour (by the database's clock) is still being counted by running services
+        rows = await db.fetch("SELECT LOCALTIMESTAMP")
+        until = hour_bucket(args.until) if args.until else hour_bucket(rows[0][0])
+        await backfill(db, args.since, until, args.step_hours)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,184 @@
+"""
+Priority scheduling of LLM calls.
+
+PriorityScheduler takes the place of LLMClient's concurrency limiter, so it
+hands out the same AIMD-sized pool of slots, but decides who gets the next
+free slot instead of serving waiters in arrival order:
+- each call belongs to a priority class (interactive, near_real_time, bulk),
+  taken from the context set with priority(),
+- classes are served by weighted fair queuing, so under contention a class
+  gets slots in proportion to SCHEDULER_WEIGHTS,
+- a class may hold at most its SCHEDULER_MAX_SHARE of the limit, which keeps
+  slots free for interactive calls however large a backfill is,
+- a tenant may hold at most its quota of slots across all classes.
+
+Scheduling is per process; separate processes such as bulk_process.py have
+their own LLMClient and do not share it.
+"""
+
+import os
+import time
+import asyncio
+import contextlib
+import contextvars
+from collections import deque
+
+from llm import AdaptiveConcurrencyLimiter
+from metrics import LLM_QUEUE_WAIT
+
+PRIORITY_CLASSES = ("interactive", "near_real_time", "bulk")
+
+
+def parse_class_map(value: str, cast) -> dict:
+    """'interactive:8,bulk:1' -> {'interactive': 8, 'bulk': 1}"""
+    result = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, amount = item.partition(":")
+        result[name.strip()] = cast(amount)
+    return result
+
+
+SCHEDULER_WEIGHTS = parse_class_map(
+    os.getenv("SCHEDULER_WEIGHTS", "interactive:8,near_real_time:4,bulk:1"), float)
+SCHEDULER_MAX_SHARE = parse_class_map(
+    os.getenv("SCHEDULER_MAX_SHARE", "interactive:1.0,near_real_time:0.8,bulk:0.5"), float)
+SCHEDULER_TENANT_QUOTAS = parse_class_map(os.getenv("SCHEDULER_TENANT_QUOTAS", ""), int)
+SCHEDULER_TENANT_DEFAULT_QUOTA = int(os.getenv("SCHEDULER_TENANT_DEFAULT_QUOTA", "0"))
+
+_current_priority = contextvars.ContextVar("llm_priority", default=("interactive", None))
+
+
+@contextlib.contextmanager
+def priority(priority_class: str, tenant: str = None):
+    """Run the LLM calls made inside the block (and tasks started from it) at this priority"""
+    token = _current_priority.set((priority_class, tenant))
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> tuple:
+    """(priority class, tenant) of the innermost priority() block"""
+    return _current_priority.get()
+
+
+class Ticket:
+    __slots__ = ("priority_class", "tenant", "future", "queued_at")
+
+    def __init__(self, priority_class: str, tenant: str):
+        self.priority_class = priority_class
+        self.tenant = tenant
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+
+class PriorityScheduler(AdaptiveConcurrencyLimiter):
+    def __init__(self, weights: dict = None, max_share: dict = None,
+                 tenant_quotas: dict = None, tenant_default_quota: int = SCHEDULER_TENANT_DEFAULT_QUOTA,
+                 **limiter_kwargs):
+        super().__init__(**limiter_kwargs)
+        weights = weights or SCHEDULER_WEIGHTS
+        max_share = max_share or SCHEDULER_MAX_SHARE
+        self.weights = {c: weights.get(c, 1.0) for c in PRIORITY_CLASSES}
+        self.max_share = {c: max_share.get(c, 1.0) for c in PRIORITY_CLASSES}
+        self.tenant_quotas = tenant_quotas if tenant_quotas is not None else SCHEDULER_TENANT_QUOTAS
+        self.tenant_default_quota = tenant_default_quota
+        self.queues = {c: deque() for c in PRIORITY_CLASSES}
+        self.class_in_flight = {c: 0 for c in PRIORITY_CLASSES}
+        self.granted = {c: 0 for c in PRIORITY_CLASSES}
+        self.tenant_in_flight = {}
+        # Start-time fair queuing: virtual start time of each class's next
+        # call, which advances by 1/weight per call; the smallest goes next
+        self.virtual_time = {c: 0.0 for c in PRIORITY_CLASSES}
+        self.clock = 0.0
+
+    def class_limit(self, priority_class: str) -> int:
+        return max(1, int(int(self.limit) * self.max_share[priority_class]))
+
+    def tenant_quota(self, tenant: str) -> int:
+        return self.tenant_quotas.get(tenant, self.tenant_default_quota) if tenant else 0
+
+    def _tenant_allows(self, tenant: str) -> bool:
+        quota = self.tenant_quota(tenant)
+        return not quota or self.tenant_in_flight.get(tenant, 0) < quota
+
+    def _eligible(self, priority_class: str):
+        """First queued ticket of the class that may run now, if any"""
+        if self.class_in_flight[priority_class] >= self.class_limit(priority_class):
+            return None
+        for ticket in self.queues[priority_class]:
+            # Cancelled tickets stay queued until their waiter removes them
+            if not ticket.future.done() and self._tenant_allows(ticket.tenant):
+                return ticket
+        return None
+
+    def _grant(self, ticket: Ticket):
+        c = ticket.priority_class
+        self.in_flight += 1
+        self.class_in_flight[c] += 1
+        self.granted[c] += 1
+        if ticket.tenant:
+            self.tenant_in_flight[ticket.tenant] = self.tenant_in_flight.get(ticket.tenant, 0) + 1
+        self.clock = self.virtual_time[c]
+        self.virtual_time[c] += 1 / self.weights[c]
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - ticket.queued_at, priority=c)
+        ticket.future.set_result(None)
+
+    def _return(self, ticket: Ticket):
+        c = ticket.priority_class
+        self.in_flight -= 1
+        self.class_in_flight[c] -= 1
+        if ticket.tenant:
+            self.tenant_in_flight[ticket.tenant] -= 1
+            if not self.tenant_in_flight[ticket.tenant]:
+                del self.tenant_in_flight[ticket.tenant]
+
+    def _dispatch(self):
+        while self.in_flight < int(self.limit):
+            candidates = [(self.virtual_time[c], ticket) for c in PRIORITY_CLASSES
+                          if (ticket := self._eligible(c)) is not None]
+            if not candidates:
+                return
+            _, ticket = min(candidates, key=lambda candidate: candidate[0])
+            self.queues[ticket.priority_class].remove(ticket)
+            self._grant(ticket)
+
+    async def acquire(self) -> Ticket:
+        priority_class, tenant = _current_priority.get()
+        if priority_class not in self.queues:
+            priority_class = "interactive"
+        ticket = Ticket(priority_class, tenant)
+        queue = self.queues[priority_class]
+        if not queue:
+            # A class that was idle does not get credit for the time it had nothing to send
+            self.virtual_time[priority_class] = max(self.virtual_time[priority_class], self.clock)
+        queue.append(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self._return(ticket)
+                self._dispatch()
+            else:
+                queue.remove(ticket)
+            raise
+        return ticket
+
+    async def release(self, outcome: str, ticket: Ticket = None):
+        self._return(ticket)
+        self.adjust(outcome)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            c: {
+                "weight": self.weights[c],
+                "limit": self.class_limit(c),
+                "in_flight": self.class_in_flight[c],
+                "queued": len(self.queues[c]),
+                "granted": self.granted[c],
+            }
+            for c in PRIORITY_CLASSES
+        }
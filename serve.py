@@ -0,0 +1,158 @@
+"""
+Production serving with several worker processes.
+
+`uvicorn main:app` runs one process, and one Python process uses one core.
+serve.py binds the listening socket once and starts SERVE_WORKERS worker
+processes that all accept connections on it. Each worker runs the full
+app with its own event loop, LLM client and database pool, and the workers
+coordinate through the parent process:
+- LLM concurrency and the LLM_RPM / LLM_TPM rate budget are global. The
+  parent runs the coordinator from coordinator.py, so N workers together
+  never exceed the limits one process would keep to.
+- DB_MAX_CONNECTIONS is split evenly into each worker's DB_POOL_MAX_SIZE;
+  every worker needs at least one, so there can be no more workers than that.
+- Only worker 0 runs the periodic partition maintenance and saves the
+  similarity index on shutdown.
+- A worker that crashes is restarted.
+
+On SIGTERM (or Ctrl-C) every worker stops accepting connections, lets
+in-flight requests, streams and running jobs finish for up to
+SERVE_DRAIN_TIMEOUT seconds, then flushes write-behind rows and rollups.
+The coordinator stays up until the last worker has exited, so draining
+requests can still get LLM slots.
+
+Usage:
+python serve.py --workers 4 --port 8000
+"""
+
+import os
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+from dotenv import load_dotenv
+
+# Before the settings below; workers inherit the environment and load .env again on import
+load_dotenv()
+
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(min(os.cpu_count() or 1, DB_MAX_CONNECTIONS))))
+SERVE_DRAIN_TIMEOUT = float(os.getenv("SERVE_DRAIN_TIMEOUT", "30"))
+
+RESTART_CHECK_INTERVAL = 1.0
+
+
+def worker_environment(worker_id: int, workers: int, coordinator_socket: str) -> dict:
+    pool_max = DB_MAX_CONNECTIONS // workers
+    env = {
+        "LLM_COORDINATOR_SOCKET": coordinator_socket,
+        # The coordinator enforces the rate limits for all workers
+        "LLM_RPM": "0",
+        "LLM_TPM": "0",
+        "DB_POOL_MAX_SIZE": str(pool_max),
+        "DB_POOL_MIN_SIZE": str(min(int(os.getenv("DB_POOL_MIN_SIZE", "2")), pool_max)),
+        "SERVE_WORKER_ID": str(worker_id),
+    }
+    return env
+
+
+def run_worker(sock: socket.socket, env: dict, log_level: str, drain_timeout: float):
+    """Child process: the app on the shared listening socket"""
+    os.environ.update(env)
+    import uvicorn
+    import main
+
+    config = uvicorn.Config(main.app, log_level=log_level, timeout_graceful_shutdown=drain_timeout)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, args):
+        self.args = args
+        self.coordinator_socket = args.coordinator_socket or os.path.join(
+            tempfile.gettempdir(), f"insights-llm-{os.getpid()}.sock")
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.sock = None
+        self._stopping = asyncio.Event()
+
+    def spawn(self, worker_id: int):
+        env = worker_environment(worker_id, self.args.workers, self.coordinator_socket)
+        process = self.context.Process(target=run_worker, name=f"insights-worker-{worker_id}",
+                                       args=(self.sock, env, self.args.log_level, self.args.drain_timeout))
+        process.start()
+        self.processes[worker_id] = process
+
+    async def run(self):
+        # Imported here, not at the top: spawned workers re-import this module, and the
+        # app modules must not load before run_worker has set the worker environment
+        from coordinator import CoordinatorServer
+        coordinator = CoordinatorServer(self.coordinator_socket)
+        await coordinator.start()
+        self.sock = socket.create_server((self.args.host, self.args.port), backlog=2048)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopping.set)
+
+        for worker_id in range(self.args.workers):
+            self.spawn(worker_id)
+        print(f"Serving on http://{self.args.host}:{self.args.port} with {self.args.workers} workers")
+
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=RESTART_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive() and not self._stopping.is_set():
+                    print(f"Worker {worker_id} exited with code {process.exitcode}, restarting")
+                    self.spawn(worker_id)
+
+        await self.drain()
+        self.sock.close()
+        await coordinator.stop()
+
+    async def drain(self):
+        print(f"Draining {len(self.processes)} workers")
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        # Workers get the drain timeout for requests plus time for their shutdown handlers
+        deadline = asyncio.get_running_loop().time() + self.args.drain_timeout + 30
+        while any(p.is_alive() for p in self.processes.values()):
+            if asyncio.get_running_loop().time() > deadline:
+                for process in self.processes.values():
+                    if process.is_alive():
+                        print(f"{process.name} did not stop in time, killing it")
+                        process.kill()
+                break
+            await asyncio.sleep(0.2)
+        for process in self.processes.values():
+            process.join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the insights API with several worker processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--drain-timeout", type=float, default=SERVE_DRAIN_TIMEOUT,
+                        help="Seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--coordinator-socket", help="Unix socket path for the LLM coordinator")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    if not 1 <= args.workers <= DB_MAX_CONNECTIONS:
+        # Each worker's pool needs a connection; more workers would exceed DB_MAX_CONNECTIONS
+        parser.error(f"--workers must be between 1 and DB_MAX_CONNECTIONS ({DB_MAX_CONNECTIONS})")
+    return args
+
+
+def main():
+    asyncio.run(Supervisor(parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
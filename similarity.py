@@ -0,0 +1,321 @@
+"""
+Near-duplicate transcript detection.
+
+Campaign calls often follow one script and differ only in names, dates and
+amounts ("Mr. Singh ... ₹5,000 on Monday"), so their insight cache keys never
+match. SimilarityIndex keeps the transcripts the LLM analyzed recently in
+memory and finds earlier calls that are nearly the same:
+- transcripts are normalized with names, amounts, numbers and dates replaced
+  by placeholders and cut into word shingles,
+- a MinHash signature of the shingles is split into LSH bands, and
+  transcripts sharing any band are candidates,
+- candidates, at most SIMILARITY_MAX_CANDIDATES of the newest, are ranked
+  by the Jaccard similarity their signatures estimate, and the best few
+  are scored by the exact Jaccard similarity of their shingles.
+
+At SIMILARITY_REUSE_THRESHOLD the earlier insight is reused, with the names,
+amounts and dates it mentions swapped for the new call's. Between
+SIMILARITY_FEW_SHOT_THRESHOLD and that, the earlier call and its insight are
+given to the LLM as a worked example. The index is saved to
+SIMILARITY_INDEX_FILE on shutdown and loaded at startup, but only for the
+prompt version and model that produced its insights; without a file it is
+built from the most recent call_records.
+"""
+
+import os
+import re
+import json
+import base64
+import random
+import struct
+import hashlib
+import tempfile
+import unicodedata
+from collections import OrderedDict
+
+from llm import estimate_tokens
+from cache import transcript_fingerprint
+
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "false").lower() == "true"
+SIMILARITY_REUSE_THRESHOLD = float(os.getenv("SIMILARITY_REUSE_THRESHOLD", "0.9"))
+SIMILARITY_FEW_SHOT_THRESHOLD = float(os.getenv("SIMILARITY_FEW_SHOT_THRESHOLD", "0.6"))
+SIMILARITY_MAX_ENTRIES = int(os.getenv("SIMILARITY_MAX_ENTRIES", "50000"))
+SIMILARITY_MAX_TOKENS = int(os.getenv("SIMILARITY_MAX_TOKENS", "2000"))
+SIMILARITY_INDEX_FILE = os.getenv("SIMILARITY_INDEX_FILE", "similarity_index.json")
+SIMILARITY_MAX_CANDIDATES = int(os.getenv("SIMILARITY_MAX_CANDIDATES", "200"))
+
+NUM_PERM = 128
+BANDS = 32  # 4 rows per band: pairs above ~0.45 Jaccard become candidates
+SHINGLE_SIZE = 3
+MERSENNE_PRIME = (1 << 61) - 1
+EXACT_CANDIDATES = 3  # best estimates re-scored on their shingles
+INDEX_VERSION = 1
+
+# Values that vary between calls of one campaign, in the order they are replaced
+PLACEHOLDERS = [
+    ("<amount>", r"(?:₹|rs\.?|inr)\s*\d[\d,]*(?:\.\d+)?|\d[\d,]*(?:\.\d+)?\s*(?:rupees|rupaye|rs\b|/-)"),
+    ("<name>", r"\b(?:mr|mrs|ms|miss|shri|smt|dr)\.?\s+[a-z]+(?:\s+ji)?|\b[a-z]+\s+sahab\b"),
+    ("<date>", r"\b\d{1,2}(?:st|nd|rd|th)?\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b"
+               r"|\b\d{1,2}(?:st|nd|rd|th)\b|\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b"
+               r"|\b(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b"),
+    ("<number>", r"\b\d[\d,]*(?:\.\d+)?\b"),
+]
+PLACEHOLDER_PATTERN = re.compile("|".join(f"(?P<p{i}>{pattern})" for i, (_, pattern) in enumerate(PLACEHOLDERS)))
+
+# Insight fields whose text may quote the call's names, amounts and dates
+ADAPTED_FIELDS = ("customer_intent", "key_results", "customer_statements_analysis",
+                  "non_payment_reasons", "agent_performance_feedback", "summary")
+
+
+def normalize(transcript: str):
+    """(normalized text, values replaced by placeholders in order)"""
+    text = " ".join(unicodedata.normalize("NFKC", transcript).casefold().split())
+    values = []
+
+    def replace(match):
+        values.append(match.group(0))
+        return PLACEHOLDERS[int(match.lastgroup[1:])][0]
+
+    return PLACEHOLDER_PATTERN.sub(replace, text), values
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> set:
+    words = re.findall(r"<\w+>|\w+", normalized)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def shingle_hashes(items: set) -> list:
+    return [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in items]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def estimated_jaccard(a: tuple, b: tuple) -> float:
+    """Share of MinHash positions two signatures agree on"""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, items: set) -> tuple:
+        hashes = shingle_hashes(items) or [0]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations)
+
+
+def pack_signature(signature: tuple) -> str:
+    return base64.b64encode(struct.pack(f"<{len(signature)}Q", *signature)).decode("ascii")
+
+
+def unpack_signature(packed: str) -> tuple:
+    raw = base64.b64decode(packed)
+    return struct.unpack(f"<{len(raw) // 8}Q", raw)
+
+
+def _swap(found: str, replacements: dict) -> str:
+    new = replacements.get(found.casefold(), found)
+    return new.title() if found == found.title() else new
+
+
+def adapt_insight(insight: dict, old_values: list, new_values: list) -> dict:
+    """Swap the earlier call's names, amounts and dates for the new call's in the text fields"""
+    replacements = {old: new for old, new in zip(old_values, new_values) if old != new}
+    if not replacements:
+        return dict(insight)
+    pattern = re.compile("|".join(re.escape(old) for old in sorted(replacements, key=len, reverse=True)),
+                         re.IGNORECASE)
+    adapted = dict(insight)
+    for field in ADAPTED_FIELDS:
+        if isinstance(adapted.get(field), str):
+            adapted[field] = pattern.sub(lambda m: _swap(m.group(0), replacements), adapted[field])
+    return adapted
+
+
+class Match:
+    __slots__ = ("similarity", "transcript", "insight", "reusable")
+
+    def __init__(self, similarity: float, transcript: str, insight: dict, reusable: bool):
+        self.similarity = similarity
+        self.transcript = transcript
+        self.insight = insight
+        self.reusable = reusable
+
+
+class SimilarityIndex:
+    def __init__(self, reuse_threshold: float = SIMILARITY_REUSE_THRESHOLD,
+                 few_shot_threshold: float = SIMILARITY_FEW_SHOT_THRESHOLD,
+                 max_entries: int = SIMILARITY_MAX_ENTRIES,
+                 max_tokens: int = SIMILARITY_MAX_TOKENS,
+                 max_candidates: int = SIMILARITY_MAX_CANDIDATES,
+                 num_perm: int = NUM_PERM, bands: int = BANDS,
+                 insights_from: str = ""):
+        self.reuse_threshold = reuse_threshold
+        self.few_shot_threshold = few_shot_threshold
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.max_candidates = max_candidates
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Prompt version and model of the indexed insights; a saved index for others is not loaded
+        self.insights_from = insights_from
+        self.entries = OrderedDict()  # fingerprint -> (signature, transcript, insight), oldest first
+        self.buckets = {}  # (band, band hash) -> {fingerprint: None}, oldest first
+        self.reused = 0
+        self.few_shot = 0
+        self.misses = 0
+
+    def _band_keys(self, signature: tuple) -> list:
+        return [(band, hash(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def _insert(self, fingerprint: str, signature: tuple, transcript: str, insight: dict):
+        if fingerprint in self.entries:
+            self.entries.move_to_end(fingerprint)
+            return
+        self.entries[fingerprint] = (signature, transcript, insight)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, {})[fingerprint] = None
+        while len(self.entries) > self.max_entries:
+            old, (old_signature, _, _) = self.entries.popitem(last=False)
+            for key in self._band_keys(old_signature):
+                bucket = self.buckets[key]
+                bucket.pop(old, None)
+                if not bucket:
+                    del self.buckets[key]
+
+    def entry(self, transcript: str, insight: dict):
+        """
+        (fingerprint, signature, transcript, insight) ready for insert(), or None
+        for a transcript too long to index. Reads no index state, so it can run
+        in a thread while the index serves queries.
+        """
+        if estimate_tokens(transcript) > self.max_tokens:
+            return None
+        normalized, _ = normalize(transcript)
+        return transcript_fingerprint(transcript), self.hasher.signature(shingles(normalized)), transcript, insight
+
+    def insert(self, entries: list):
+        for entry in entries:
+            if entry is not None:
+                self._insert(*entry)
+
+    def add(self, transcript: str, insight: dict):
+        """Index an insight the LLM produced for transcript"""
+        self.insert([self.entry(transcript, insight)])
+
+    def query(self, transcript: str):
+        """Best earlier call at or above the few-shot threshold as a Match, or None"""
+        if not self.entries or estimate_tokens(transcript) > self.max_tokens:
+            self.misses += 1
+            return None
+        normalized, values = normalize(transcript)
+        items = shingles(normalized)
+        signature = self.hasher.signature(items)
+        # Templated campaigns put thousands of calls in the same buckets; the newest stand in for them
+        candidates = {}
+        for key in self._band_keys(signature):
+            for fingerprint in reversed(self.buckets.get(key, {})):
+                if len(candidates) >= self.max_candidates:
+                    break
+                candidates[fingerprint] = None
+        ranked = sorted(candidates, key=lambda fp: estimated_jaccard(signature, self.entries[fp][0]), reverse=True)
+
+        best, best_similarity = None, 0.0
+        for fingerprint in ranked[:EXACT_CANDIDATES]:
+            _, earlier, insight = self.entries[fingerprint]
+            similarity = jaccard(items, shingles(normalize(earlier)[0]))
+            if similarity > best_similarity:
+                best, best_similarity = (earlier, insight), similarity
+        if best is None or best_similarity < self.few_shot_threshold:
+            self.misses += 1
+            return None
+
+        earlier, insight = best
+        old_values = normalize(earlier)[1]
+        # Reused only when the calls differ in placeholder values that can be swapped one for one
+        if best_similarity >= self.reuse_threshold and len(old_values) == len(values):
+            self.reused += 1
+            return Match(best_similarity, earlier, adapt_insight(insight, old_values, values), True)
+        self.few_shot += 1
+        return Match(best_similarity, earlier, insight, False)
+
+    def save(self, path: str):
+        document = {
+            "version": INDEX_VERSION,
+            "num_perm": len(self.hasher.permutations),
+            "bands": self.bands,
+            "insights_from": self.insights_from,
+            "entries": [[fingerprint, pack_signature(signature), transcript, insight]
+                        for fingerprint, (signature, transcript, insight) in self.entries.items()],
+        }
+        # Written beside the target and renamed, so a crash never leaves half an index
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, partial = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(document, f, ensure_ascii=False)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+    def read(self, path: str):
+        """
+        Entries of a saved index for insert(); None when the file is missing or
+        was built with other settings or for another prompt version or model.
+        Like entry(), safe to run in a thread.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return None
+        if (document.get("version"), document.get("num_perm"), document.get("bands")) != (
+                INDEX_VERSION, len(self.hasher.permutations), self.bands):
+            print(f"Ignoring similarity index {path}: built with different settings")
+            return None
+        if document.get("insights_from") != self.insights_from:
+            print(f"Ignoring similarity index {path}: insights from {document.get('insights_from')}, "
+                  f"not {self.insights_from}")
+            return None
+        return [(fingerprint, unpack_signature(packed), transcript, insight)
+                for fingerprint, packed, transcript, insight in document["entries"]]
+
+    def load(self, path: str) -> bool:
+        """Load a saved index; False when the file is missing or was built with other settings"""
+        entries = self.read(path)
+        if entries is None:
+            return False
+        self.insert(entries)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "buckets": len(self.buckets),
+            "reused": self.reused,
+            "few_shot": self.few_shot,
+            "misses": self.misses,
+        }
+
+
+async def load_recent_insights(db, limit: int) -> list:
+    """(transcript, insight) pairs of the most recent LLM-analyzed call_records"""
+    rows = await db.fetch("""
+        SELECT t.transcript, r.intent AS customer_intent, r.call_purpose, r.call_objective_met, r.key_results,
+               r.customer_statements_analysis, r.non_payment_reasons, r.sentiment_start, r.sentiment_end,
+               r.overall_sentiment, r.agent_performance_rating, r.agent_performance_feedback,
+               r.action_required, r.summary
+        FROM call_records r JOIN call_transcripts t ON t.transcript_hash = r.transcript_hash
+        WHERE NOT r.classified_locally
+        ORDER BY r.created_at DESC
+        LIMIT $1
+    """, limit)
+    return [(row["transcript"], {k: v for k, v in dict(row).items() if k != "transcript"}) for row in rows]
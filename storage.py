@@ -0,0 +1,104 @@
+"""
+Schema migration and maintenance commands for the partitioned call_records layout.
+
+migrate         create or upgrade the tables and indexes to db.SCHEMA_VERSION.
+                The service runs no DDL at startup; run this on deploy, before
+                the new version starts (or set DB_MIGRATE_ON_STARTUP=true)
+maintain        create upcoming monthly partitions and apply retention now
+                (the service also does this every CALL_RECORDS_MAINTENANCE_INTERVAL)
+migrate-legacy  move rows from call_records_legacy, the unpartitioned table
+                renamed by migrate, into the partitioned layout in batches.
+                Each batch is one transaction, so the command can be stopped
+                and rerun; the legacy table is dropped once it is empty.
+
+Usage:
+python storage.py migrate
+python storage.py maintain --retention-months 24
+python storage.py migrate-legacy --batch-size 5000
+"""
+
+import os
+import time
+import asyncio
+import argparse
+
+from dotenv import load_dotenv
+
+# db reads the partition and pool settings on import
+load_dotenv()
+
+from db import CALL_RECORDS_RETENTION_MONTHS, SCHEMA_VERSION, Database
+
+
+async def migrate(db: Database, args):
+    started = time.perf_counter()
+    await db.migrate()
+    print(f"Schema is at version {SCHEMA_VERSION} ({time.perf_counter() - started:.1f}s)")
+
+
+async def maintain(db: Database, args):
+    await db.maintain_partitions(retention_months=args.retention_months)
+    print("Partitions are up to date")
+    deleted = await db.delete_expired_cached_insights()
+    print(f"Deleted {deleted} expired insight cache entries")
+
+
+async def migrate_legacy(db: Database, args):
+    exists = await db.fetch("SELECT 1 FROM pg_class WHERE oid = to_regclass('call_records_legacy')")
+    if not exists:
+        print("No call_records_legacy table, nothing to migrate")
+        return
+
+    # Every month the legacy rows span needs its partition first
+    bounds = await db.fetch("SELECT min(created_at) AS first, max(created_at) AS last FROM call_records_legacy")
+    if bounds[0]["first"] is not None:
+        await db.create_partitions(bounds[0]["first"], bounds[0]["last"])
+
+    moved, started = 0, time.perf_counter()
+    while True:
+        count = await db.migrate_legacy_batch(args.batch_size)
+        moved += count
+        if count:
+            print(f"Moved {moved} rows ({moved / (time.perf_counter() - started):.0f} rows/s)")
+        if count < args.batch_size:
+            break
+
+    await db.fetch("DROP TABLE call_records_legacy")
+    print(f"Migration complete: {moved} rows moved, call_records_legacy dropped")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the partitioned call_records storage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="Create or upgrade the schema")
+    maintain_parser = commands.add_parser("maintain", help="Create partitions and apply retention")
+    maintain_parser.add_argument("--retention-months", type=int, default=CALL_RECORDS_RETENTION_MONTHS,
+                                 help="Drop partitions older than this many months (0 keeps everything)")
+    migrate_parser = commands.add_parser("migrate-legacy", help="Move call_records_legacy rows into partitions")
+    migrate_parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=600, help="Per-statement timeout in seconds")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL not found in .env")
+
+    db = Database(dsn, min_size=1, max_size=1, command_timeout=args.timeout, health_check_interval=0)
+    if args.command == "migrate":
+        # DDL runs on its own connection; no pool needed
+        await migrate(db, args)
+        return
+    await db.connect()
+    try:
+        if args.command == "maintain":
+            await maintain(db, args)
+        else:
+            await migrate_legacy(db, args)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,82 @@
+"""
+Incremental parsing of a streamed JSON object and Server-Sent Events helpers.
+"""
+
+import json
+
+
+class IncrementalObjectParser:
+    """
+    Consumes the LLM's output chunk by chunk and returns each top-level
+    "key": value member of the JSON object as soon as it is complete, i.e.
+    when the comma or closing brace after it arrives. Text before the first
+    '{' (such as a ```json fence) is ignored. Only the member currently being
+    read is buffered besides the raw text kept for the final full parse.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.started = False
+        self.finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> list:
+        """Returns [(key, value), ...] for members completed by this chunk"""
+        self.chunks.append(chunk)
+        completed = []
+        for ch in chunk:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._member.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(completed)
+                    self.finished = True
+                    continue
+            elif ch == "," and self._depth == 1:
+                self._emit(completed)
+                continue
+            self._member.append(ch)
+        return completed
+
+    def _emit(self, completed: list):
+        member = "".join(self._member).strip()
+        self._member = []
+        if not member:
+            return
+        try:
+            completed.extend(json.loads("{" + member + "}").items())
+        except json.JSONDecodeError:
+            # Left for the final parse of the whole object to report
+            pass
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
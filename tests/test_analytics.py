@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+
+import pytest
+
+from analytics import (ANALYTICS_DEFAULT_WINDOW_HOURS, DB_LOCAL_BOUNDS, InvalidQuery, build_filters,
+                       call_record_stats, db_local_bounds, decode_cursor, encode_cursor, hour_window,
+                       list_call_records, time_window)
+
+SINCE = datetime.datetime(2025, 1, 1, 9, 30)
+UNTIL = datetime.datetime(2025, 1, 2, 17, 5)
+
+
+class FakeDB:
+    def __init__(self, rows=None, local=None):
+        self.rows = rows or []
+        self.local = local
+        self.queries = []
+
+    async def fetch(self, query, *args):
+        self.queries.append((query, args))
+        return [self.local] if query == DB_LOCAL_BOUNDS else self.rows
+
+
+def test_build_filters_numbers_parameters_in_order():
+    where, args = build_filters(SINCE, UNTIL, overall_sentiment="Negative", call_objective_met=False)
+    assert where == ("created_at >= $1 AND created_at < $2 AND overall_sentiment = $3 "
+                     "AND call_objective_met = $4")
+    assert args == [SINCE, UNTIL, "Negative", False]
+
+
+def test_build_filters_time_column():
+    where, _ = build_filters(SINCE, UNTIL, time_column="bucket_start")
+    assert where == "bucket_start >= $1 AND bucket_start < $2"
+
+
+def test_time_window_validation():
+    assert time_window(SINCE, UNTIL) == (SINCE, UNTIL)
+    with pytest.raises(InvalidQuery):
+        time_window(UNTIL, SINCE)
+    with pytest.raises(InvalidQuery):
+        time_window(SINCE, SINCE + datetime.timedelta(days=40), max_days=31)
+    assert time_window(SINCE, SINCE + datetime.timedelta(days=40), max_days=0)[1] > SINCE
+
+
+def test_aware_bounds_and_the_default_end_come_from_the_database():
+    aware = datetime.datetime(2025, 1, 1, 4, 0, tzinfo=datetime.timezone.utc)
+    db = FakeDB(local=(SINCE, UNTIL))
+    assert asyncio.run(db_local_bounds(db, aware, None)) == (SINCE, UNTIL)
+    # Only aware values are sent; naive ones are database-local already
+    assert asyncio.run(db_local_bounds(db, SINCE, aware)) == (SINCE, UNTIL)
+    assert db.queries == [(DB_LOCAL_BOUNDS, (aware, None)), (DB_LOCAL_BOUNDS, (None, aware))]
+    assert asyncio.run(db_local_bounds(db, SINCE, UNTIL)) == (SINCE, UNTIL) and len(db.queries) == 2
+
+
+def test_default_window_ends_at_the_database_clock():
+    db = FakeDB(local=(None, UNTIL))
+    asyncio.run(list_call_records(db, {}))
+    _, args = db.queries[1]
+    assert args == (UNTIL - datetime.timedelta(hours=ANALYTICS_DEFAULT_WINDOW_HOURS), UNTIL)
+
+
+def test_hour_window_widens_to_whole_hours():
+    assert hour_window(SINCE, UNTIL) == (datetime.datetime(2025, 1, 1, 9), datetime.datetime(2025, 1, 2, 18))
+    exact = datetime.datetime(2025, 1, 2, 17)
+    assert hour_window(exact, exact + datetime.timedelta(hours=1))[1] == datetime.datetime(2025, 1, 2, 18)
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    assert decode_cursor(encode_cursor(SINCE, 42)) == (SINCE, 42)
+    with pytest.raises(InvalidQuery):
+        decode_cursor("not-a-cursor")
+
+
+def test_listing_pages_with_a_keyset_cursor():
+    rows = [{"id": n, "record_uuid": None, "created_at": UNTIL - datetime.timedelta(minutes=n)} for n in range(3)]
+    db = FakeDB(rows)
+    page = asyncio.run(list_call_records(db, {"since": SINCE, "until": UNTIL, "action_required": True},
+                                         limit=2, cursor=encode_cursor(UNTIL, 99)))
+    query, args = db.queries[0]
+    assert "(created_at, id) < ($4, $5)" in query
+    assert "LIMIT 3" in query
+    assert args == (SINCE, UNTIL, True, UNTIL, 99)
+    assert [item["id"] for item in page["items"]] == [0, 1]
+    assert decode_cursor(page["next_cursor"]) == (rows[1]["created_at"], 1)
+
+
+def test_stats_from_rollups_use_whole_hours():
+    row = {"bucket": "payment reminder", "total": 4, "negative": 1, "neutral": 2, "positive": 1,
+           "objective_met": 3, "action_required": 2, "avg_agent_rating": 7.5}
+    db = FakeDB([row])
+    result = asyncio.run(call_record_stats(db, {"since": SINCE, "until": UNTIL}, group_by="call_purpose",
+                                           source="rollup"))
+    query, args = db.queries[0]
+    assert "FROM call_record_rollups" in query and "GROUP BY 1" in query
+    assert args == hour_window(SINCE, UNTIL)
+    assert result["groups"][0]["objective_met_rate"] == 0.75
+    assert result["groups"][0]["call_purpose"] == "payment reminder"
+
+
+def test_stats_reject_unknown_grouping():
+    with pytest.raises(InvalidQuery):
+        asyncio.run(call_record_stats(FakeDB(), {}, group_by="tenant"))
+
+
+def test_average_rating_leaves_out_locally_classified_calls():
+    db = FakeDB([{"total": 0, "negative": 0, "neutral": 0, "positive": 0, "objective_met": 0,
+                  "action_required": 0, "avg_agent_rating": None}])
+    asyncio.run(call_record_stats(db, {"since": SINCE, "until": UNTIL}))
+    asyncio.run(call_record_stats(db, {"since": SINCE, "until": UNTIL}, source="rollup"))
+    (raw, _), (rollup, _) = db.queries
+    assert "avg(agent_performance_rating) FILTER (WHERE NOT classified_locally)" in raw
+    assert "nullif(sum(rated_calls), 0)" in rollup
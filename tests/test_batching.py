@@ -0,0 +1,22 @@
+from llm import estimate_tokens
+from main import pack_transcripts, prompt_template
+
+
+def test_groups_fit_the_token_budget():
+    items = [(i, "Agent: hello. Customer: " + "x" * (200 * (i % 5 + 1))) for i in range(30)]
+    budget = prompt_template.prefix_tokens["batch"] + 50 + 700
+    groups = pack_transcripts(items, token_budget=budget, max_items=100)
+    assert sorted(i for group in groups for i in group) == list(range(30))
+    overhead = prompt_template.prefix_tokens["batch"] + 50
+    for group in groups:
+        assert len(group) == 1 or overhead + sum(estimate_tokens(items[i][1]) for i in group) <= budget
+
+
+def test_groups_respect_max_items():
+    groups = pack_transcripts([(i, "Agent: hi") for i in range(10)], token_budget=100000, max_items=4)
+    assert groups == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_oversized_transcript_gets_its_own_group():
+    groups = pack_transcripts([(0, "a" * 40000), (1, "Agent: hi")], token_budget=1000, max_items=10)
+    assert groups == [[0], [1]]
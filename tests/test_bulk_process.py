@@ -0,0 +1,65 @@
+import asyncio
+import json
+import types
+
+import bulk_process
+from bulk_process import BulkProcessor, parse_args, parse_record
+
+
+class Insight(types.SimpleNamespace):
+    def model_dump(self):
+        return dict(self.__dict__)
+
+
+def archive(tmp_path, count):
+    path = tmp_path / "calls.jsonl"
+    path.write_text("".join(json.dumps({"id": n, "transcript": f"Agent: call {n}"}) + "\n" for n in range(count)))
+    return path
+
+
+def output_line(offset):
+    return json.dumps({"offset": offset, "id": offset, "insights": {}}) + "\n"
+
+
+def test_parse_record():
+    assert parse_record('{"transcript": "hi"}\n') == {"transcript": "hi"}
+    assert parse_record("  \n") == {}
+    assert parse_record({"transcript": "hi"}) == {"transcript": "hi"}
+
+
+def test_open_output_skips_written_offsets_and_cuts_a_torn_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(output_line(1) + output_line(3) + output_line(4) + '{"offset": 5, "id"')
+    processor = BulkProcessor(parse_args([str(archive(tmp_path, 6)), "--output", str(path)]))
+    processor.start_offset = 3
+    processor.open_output(str(path)).close()
+    assert processor.written == {3, 4}
+    assert path.read_text() == output_line(1) + output_line(3) + output_line(4)
+
+
+def test_resume_writes_each_record_once(tmp_path, monkeypatch):
+    async def analyze(transcript):
+        return Insight(summary=transcript)
+
+    monkeypatch.setattr(bulk_process.main, "analyze_transcript", analyze)
+    source = archive(tmp_path, 6)
+    output = tmp_path / "out.jsonl"
+    # Interrupted run: records 0-1 checkpointed, 3 finished out of order, 4 torn mid-write
+    output.write_text(output_line(0) + output_line(1) + output_line(3) + '{"offset": 4')
+    (tmp_path / "calls.jsonl.checkpoint").write_text(json.dumps({"input": str(source), "next_offset": 2}))
+
+    processor = BulkProcessor(parse_args([str(source), "--output", str(output), "--resume"]))
+    asyncio.run(processor.run())
+
+    offsets = [json.loads(line)["offset"] for line in output.read_text().splitlines()]
+    assert sorted(offsets) == list(range(6))
+    assert processor.processed == 3 and processor.next_offset == 6
+    assert json.loads((tmp_path / "calls.jsonl.checkpoint").read_text())["next_offset"] == 6
+
+
+def test_watermark_advances_only_over_contiguous_offsets(tmp_path):
+    processor = BulkProcessor(parse_args([str(archive(tmp_path, 1)), "--output", str(tmp_path / "out.jsonl")]))
+    processor.mark_done([1, 2])
+    assert processor.next_offset == 0
+    processor.mark_done([0])
+    assert processor.next_offset == 3 and processor.done == set()
@@ -0,0 +1,91 @@
+import asyncio
+
+import cache
+from cache import InsightCache, LRUCache, insight_cache_key, normalize_transcript
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_ignores_case_and_whitespace_but_not_prompt_or_model():
+    assert normalize_transcript("  Agent:  Hello\n CUSTOMER: hi ") == "agent: hello customer: hi"
+    key = insight_cache_key("Agent: Hello", "v2", "gemini")
+    assert insight_cache_key("agent:   hello ", "v2", "gemini") == key
+    assert insight_cache_key("Agent: Hello", "v3", "gemini") != key
+    assert insight_cache_key("Agent: Hello", "v2", "other") != key
+
+
+def test_lru_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(cache.time, "monotonic", Clock())
+    lru = LRUCache(max_entries=2, ttl=60)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.evictions == 1 and len(lru) == 2
+
+
+def test_lru_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    lru = LRUCache(max_entries=10, ttl=60)
+    lru.put("a", 1)
+    clock.now += 59
+    assert lru.get("a") == 1
+    clock.now += 2
+    assert lru.get("a") is None and len(lru) == 0
+
+
+class FakeDB:
+    def __init__(self, stored=None, fail=False):
+        self.stored = dict(stored or {})
+        self.fail = fail
+
+    async def get_cached_insight(self, key, max_age):
+        if self.fail:
+            raise ConnectionError("down")
+        return self.stored.get(key)
+
+    async def put_cached_insight(self, key, insight):
+        if self.fail:
+            raise ConnectionError("down")
+        self.stored[key] = insight
+
+
+def test_database_tier_fills_memory():
+    async def run():
+        insights = InsightCache(FakeDB({"k": {"summary": "s"}}), persistent=True)
+        first = await insights.get("k")
+        insights.db.stored.clear()
+        return first, await insights.get("k"), await insights.get("other"), insights.stats()
+
+    first, second, missing, stats = asyncio.run(run())
+    assert first == second == {"summary": "s"} and missing is None
+    assert (stats["db_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_database_errors_degrade_to_misses():
+    async def run():
+        insights = InsightCache(FakeDB(fail=True), persistent=True)
+        await insights.put("k", {"summary": "s"})
+        insights.memory = LRUCache(10, 60)
+        return await insights.get("k"), insights.stats()
+
+    value, stats = asyncio.run(run())
+    assert value is None and stats["db_errors"] == 2 and stats["misses"] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    async def run():
+        insights = InsightCache(enabled=False)
+        await insights.put("k", {"summary": "s"})
+        return await insights.get("k")
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,39 @@
+from chunking import chunk_transcript, split_turns
+from llm import estimate_tokens
+
+
+def transcript(turns: int) -> str:
+    return " ".join(f"{'Agent' if i % 2 == 0 else 'Customer'}: turn number {i} " + "words " * 20
+                    for i in range(turns))
+
+
+def test_split_turns_keeps_speaker_markers():
+    assert split_turns("Agent: hello. Customer: hi there. agent : bye") == [
+        "Agent: hello.", "Customer: hi there.", "agent : bye"]
+
+
+def test_short_transcript_is_one_chunk():
+    text = transcript(3)
+    assert chunk_transcript(text, max_tokens=10000) == [" ".join(split_turns(text))]
+
+
+def test_chunks_respect_the_budget_and_overlap():
+    chunks = chunk_transcript(transcript(20), max_tokens=120, overlap_turns=1)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 120 for chunk in chunks)
+    for previous, following in zip(chunks, chunks[1:]):
+        # The last turn of a chunk opens the next one
+        assert following.startswith(split_turns(previous)[-1])
+
+
+def test_every_turn_is_kept_without_overlap():
+    text = transcript(20)
+    chunks = chunk_transcript(text, max_tokens=120, overlap_turns=0)
+    assert sum((split_turns(chunk) for chunk in chunks), []) == split_turns(text)
+
+
+def test_long_turn_is_split_at_words():
+    chunks = chunk_transcript("Agent: " + "word " * 500, max_tokens=50)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == ("Agent: " + "word " * 500).split()
@@ -0,0 +1,80 @@
+from classifier import LocalClassifier, NgramModel, normalize_purpose
+
+ROUTINE = ("Agent: Namaste, this is a reminder that your EMI due date is 5th. "
+           "Customer: Haan ji, main 5th ko pay kar dunga. Thank you.")
+NO_SENTIMENT_CUE = ("Agent: Namaste, this is a reminder that your EMI due date is 5th. "
+                    "Customer: Haan ji, main 5th ko pay kar dunga.")
+ANGRY = "Agent: Your EMI is 30 days se overdue. Customer: Harass mat karo, this is not fair, I am angry."
+HARDSHIP = "Agent: This is a reminder for your EMI. Customer: Mera job chali gayi, hardship hai."
+
+
+def test_routine_call_is_classified_locally():
+    insight, confidence = LocalClassifier(threshold=0.8).classify(ROUTINE)
+    assert confidence >= 0.8
+    assert insight["call_purpose"] == "Payment Reminder"
+    assert insight["overall_sentiment"] == "Neutral" and insight["action_required"] is True
+    assert insight["key_results"] == "PTP for 5th"
+    assert "Classified locally" in insight["summary"]
+
+
+def test_no_sentiment_evidence_falls_below_the_threshold():
+    classifier = LocalClassifier(threshold=0.8)
+    label, confidence = classifier.rule_predictions(NO_SENTIMENT_CUE)["overall_sentiment"]
+    assert label == "Neutral" and confidence < classifier.threshold
+    assert classifier.classify(NO_SENTIMENT_CUE) == (None, confidence)
+
+
+def test_threshold_decides_between_local_and_llm():
+    insight, confidence = LocalClassifier(threshold=0.5).classify(ANGRY)
+    assert insight["overall_sentiment"] == "Negative" and confidence == 0.6
+    assert LocalClassifier(threshold=0.61).classify(ANGRY) == (None, 0.6)
+
+
+def test_complex_or_long_calls_always_go_to_the_llm():
+    assert LocalClassifier(threshold=0).classify(HARDSHIP) == (None, None)
+    assert LocalClassifier(threshold=0, max_tokens=10).classify(ROUTINE) == (None, None)
+
+
+def test_model_disagreement_zeroes_the_confidence():
+    model = NgramModel()
+    model.train([(ROUTINE, {"call_purpose": "Collection", "overall_sentiment": "Neutral",
+                            "action_required": "True"})] * 5)
+    predictions = LocalClassifier(model).predict(ROUTINE)
+    assert predictions["call_purpose"] == ("Payment Reminder", 0.0)
+    assert predictions["overall_sentiment"][1] > 0.85
+    assert predictions["action_required"][0] is True
+
+
+def test_model_evidence_can_lift_a_call_without_sentiment_cues():
+    model = NgramModel()
+    model.train([(NO_SENTIMENT_CUE, {"overall_sentiment": "Neutral"}),
+                 (ANGRY, {"overall_sentiment": "Negative"})])
+    label, confidence = LocalClassifier(model).predict(NO_SENTIMENT_CUE)["overall_sentiment"]
+    assert label == "Neutral" and confidence > 0.5
+
+
+def test_model_round_trips(tmp_path):
+    model = NgramModel()
+    model.train([(ROUTINE, {"overall_sentiment": "Neutral"}), (ANGRY, {"overall_sentiment": "Negative"})])
+    model.save(str(tmp_path / "model.json"))
+    assert NgramModel.load(str(tmp_path / "model.json")).predict("overall_sentiment", ANGRY)[0] == "Negative"
+
+
+def test_normalize_purpose():
+    assert normalize_purpose("Pre-due payment reminder") == "Payment Reminder"
+    assert normalize_purpose("Legal recovery call") == "Recovery"
+    assert normalize_purpose("Greeting") is None
+
+
+def test_local_insights_are_stored_as_local():
+    import main
+    from db import CALL_RECORD_ARRAY_TYPES, CALL_RECORD_COLUMNS, call_record_values
+
+    insight, _ = LocalClassifier().classify(ROUTINE)
+    local = main.LocalCallInsight(**insight)
+    assert "classified_locally" not in local.model_dump()
+    assert "classified_locally" not in main.CallInsight.model_json_schema()["properties"]
+    values = call_record_values(None, ROUTINE, local)
+    assert len(values) == len(CALL_RECORD_COLUMNS) == len(CALL_RECORD_ARRAY_TYPES)
+    assert dict(zip(CALL_RECORD_COLUMNS, values))["classified_locally"] is True
+    assert call_record_values(None, ROUTINE, main.CallInsight(**insight))[-1] is False
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from coordinator import CoordinatedLimiter, CoordinatorClient, CoordinatorServer, RemoteBucket
+from scheduler import PriorityScheduler, priority
+
+
+def coordinated(tmp_path, limit=1, tenant_quotas=None, **kwargs):
+    """Run test(server, connect) against a coordinator with a fixed concurrency limit"""
+    def wrap(test):
+        async def run():
+            server = CoordinatorServer(str(tmp_path / "llm.sock"), **kwargs)
+            server.scheduler = PriorityScheduler(initial=limit, min_limit=limit, max_limit=limit,
+                                                 tenant_quotas=tenant_quotas)
+            await server.start()
+            clients = []
+
+            def connect():
+                clients.append(CoordinatorClient(server.path))
+                return clients[-1]
+
+            try:
+                return await test(server, connect)
+            finally:
+                for client in clients:
+                    if client._writer:
+                        client._writer.close()
+                while server.connections:
+                    await asyncio.sleep(0.005)
+                await server.stop()
+        return asyncio.run(run())
+    return wrap
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0.005)
+
+
+def test_slots_are_shared_between_clients(tmp_path):
+    @coordinated(tmp_path)
+    async def result(server, connect):
+        first, second = CoordinatedLimiter(connect()), CoordinatedLimiter(connect())
+        ticket = await first.acquire()
+        waiting = asyncio.create_task(second.acquire())
+        await settle()
+        blocked = not waiting.done()
+        await first.release("success", ticket)
+        await asyncio.wait_for(waiting, 1)
+        return blocked, first.limit, second.in_flight, server.connections
+
+    assert result == (True, 1, 1, 2)
+
+
+def test_disconnected_worker_gives_its_slots_back(tmp_path):
+    @coordinated(tmp_path)
+    async def result(server, connect):
+        client = connect()
+        await CoordinatedLimiter(client).acquire()
+        client._writer.close()
+        await asyncio.wait_for(CoordinatedLimiter(connect()).acquire(), 1)
+        return server.scheduler.in_flight
+
+    assert result == 1
+
+
+def test_cancelled_request_is_withdrawn(tmp_path):
+    @coordinated(tmp_path)
+    async def result(server, connect):
+        holder = CoordinatedLimiter(connect())
+        ticket = await holder.acquire()
+        waiter = asyncio.create_task(CoordinatedLimiter(connect()).acquire())
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await settle()
+        await holder.release("success", ticket)
+        await settle()
+        return server.scheduler.in_flight, sum(c["queued"] for c in server.scheduler.stats().values())
+
+    assert result == (0, 0)
+
+
+def test_priority_and_tenant_travel_with_the_request(tmp_path):
+    @coordinated(tmp_path, limit=2, tenant_quotas={"acme": 1})
+    async def result(server, connect):
+        limiter = CoordinatedLimiter(connect())
+        with priority("bulk", "acme"):
+            await limiter.acquire()
+            second = asyncio.create_task(limiter.acquire())
+        await settle()
+        result = limiter.stats()["bulk"]["in_flight"], dict(server.scheduler.tenant_in_flight), second.done()
+        second.cancel()
+        return result
+
+    assert result == (1, {"acme": 1}, False)
+
+
+def test_pace_draws_from_the_shared_bucket(tmp_path):
+    @coordinated(tmp_path, tpm=6000)
+    async def result(server, connect):
+        await RemoteBucket(connect(), "tokens").acquire(100)
+        await RemoteBucket(connect(), "tokens").acquire(100)
+        await RemoteBucket(connect(), "requests").acquire()  # no RPM limit configured
+        return server.buckets["tokens"].tokens
+
+    assert 5800 <= result < 5801
+
+
+def test_lost_coordinator_fails_waiting_requests(tmp_path):
+    async def run():
+        async def hang_up(reader, writer):
+            await reader.readline()
+            writer.close()
+
+        server = await asyncio.start_unix_server(hang_up, path=str(tmp_path / "gone.sock"))
+        async with server:
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(CoordinatedLimiter(CoordinatorClient(str(tmp_path / "gone.sock"))).acquire(), 1)
+
+    asyncio.run(run())
@@ -0,0 +1,141 @@
+import asyncio
+import types
+import uuid
+
+import pytest
+
+import db as db_module
+from db import CALL_RECORD_ID, INSERT_CALL_RECORD_IF_ABSENT, Database, DatabaseUnavailable
+
+
+class FakePool:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def connect(monkeypatch, **options):
+    async def create_pool(*args, **kwargs):
+        return FakePool()
+
+    async def fetch_schema_version(self):
+        return db_module.SCHEMA_VERSION
+
+    async def maintain_partitions(self, retention_months=None):
+        maintained.append(retention_months)
+
+    async def delete_expired_cached_insights(self):
+        return 0
+
+    maintained = []
+    monkeypatch.setattr(db_module.asyncpg, "create_pool", create_pool)
+    monkeypatch.setattr(Database, "fetch_schema_version", fetch_schema_version)
+    monkeypatch.setattr(Database, "maintain_partitions", maintain_partitions)
+    monkeypatch.setattr(Database, "delete_expired_cached_insights", delete_expired_cached_insights)
+
+    async def scenario():
+        database = Database("postgresql://test", health_check_interval=0, **options)
+        await database.connect()
+        running = database._maintenance_task is not None
+        await asyncio.sleep(0)
+        await database.close()
+        return running
+
+    return asyncio.run(scenario()), maintained
+
+
+def test_maintenance_is_off_unless_asked_for(monkeypatch):
+    running, maintained = connect(monkeypatch)
+    assert not running and maintained == []
+
+
+def test_maintenance_runs_when_enabled(monkeypatch):
+    running, maintained = connect(monkeypatch, maintenance=True)
+    assert running and len(maintained) == 1
+
+
+class DroppingStatement:
+    """A prepared insert whose connection drops once it has run"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetchval(self, *args):
+        self.conn.queries.append("insert")
+        raise ConnectionResetError("connection reset")
+
+
+class FakeConnection:
+    def __init__(self, queries):
+        self.queries = queries
+        self.call_record_insert = DroppingStatement(self)
+
+    async def execute(self, query, *args):
+        self.queries.append(query)
+
+    async def fetchval(self, query, *args):
+        self.queries.append(query)
+        return 42
+
+
+class FakeConnectionPool:
+    def __init__(self):
+        self.queries = []
+        self.expired = 0
+
+    async def acquire(self, timeout=None):
+        return FakeConnection(self.queries)
+
+    async def release(self, conn):
+        pass
+
+    async def expire_connections(self):
+        self.expired += 1
+
+
+def pooled_database():
+    database = Database("postgresql://test", health_check_interval=0)
+    database.pool = FakeConnectionPool()
+    return database
+
+
+def test_reads_are_retried_on_a_dropped_connection():
+    database = pooled_database()
+    attempts = []
+
+    async def read(conn):
+        attempts.append(conn)
+        if len(attempts) == 1:
+            raise ConnectionResetError("connection reset")
+        return "rows"
+
+    assert asyncio.run(database._run(read)) == "rows"
+    assert len(attempts) == 2 and database.pool.expired == 1
+
+
+def test_writes_that_must_not_run_twice_are_not_retried():
+    database = pooled_database()
+    attempts = []
+
+    async def write(conn):
+        attempts.append(conn)
+        raise ConnectionResetError("connection reset")
+
+    with pytest.raises(DatabaseUnavailable):
+        asyncio.run(database._run(write, retry=False))
+    assert len(attempts) == 1 and not database.healthy
+
+
+def test_insert_is_retried_only_if_the_row_is_absent():
+    database = pooled_database()
+    insight = types.SimpleNamespace(
+        customer_intent="Pay later", call_purpose="Payment reminder", call_objective_met=True, key_results="Promise",
+        customer_statements_analysis="Cooperative", non_payment_reasons="", sentiment_start="Neutral",
+        sentiment_end="Neutral", overall_sentiment="Neutral", agent_performance_rating=8,
+        agent_performance_feedback="Clear", action_required=False, summary="Will pay", classified_locally=False)
+    record_id = asyncio.run(database.insert_call_record(uuid.uuid4(), "Agent: hello", insight))
+    # The first insert may have committed before the connection dropped
+    assert database.pool.queries == ["insert", INSERT_CALL_RECORD_IF_ABSENT, CALL_RECORD_ID]
+    assert record_id == 42
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import uuid
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc
+import pyarrow.parquet
+
+from analytics import DB_LOCAL_BOUNDS, decode_cursor, encode_cursor
+from export import Export, arrow_schema, prepare_export, record_batch
+
+NOW = datetime.datetime(2025, 3, 1, 12, 0)
+
+
+def row(id, at, sentiment="Neutral", purpose="Payment reminder"):
+    return {
+        "id": id, "record_uuid": uuid.UUID(int=id), "created_at": at,
+        "intent": "Pay", "call_purpose": purpose,
+        "sentiment_start": sentiment, "sentiment_end": sentiment, "overall_sentiment": sentiment,
+        "call_objective_met": True, "action_required": False, "classified_locally": False,
+        "agent_performance_rating": 7,
+    }
+
+
+class FakeDB:
+    def __init__(self, rows=(), settled=NOW):
+        self.rows = list(rows)
+        self.settled = settled
+        self.streamed = []
+
+    async def fetch(self, query, *args):
+        if query == DB_LOCAL_BOUNDS:
+            return [(None, self.settled + datetime.timedelta(minutes=5))]
+        return [(self.settled,)]
+
+    async def stream(self, query, after_at, after_id, until, batch_size):
+        self.streamed.append((after_at, after_id, until))
+        selected = [r for r in self.rows if (r["created_at"], r["id"]) > (after_at, after_id) and r["created_at"] < until]
+        for i in range(0, len(selected), batch_size):
+            yield selected[i:i + batch_size]
+
+
+def test_record_batch_encodes_sentiments_against_one_dictionary():
+    schema = arrow_schema()
+    first = record_batch([row(1, NOW, "Negative")], schema)
+    second = record_batch([row(2, NOW, "Positive"), row(3, NOW, None)], schema)
+    assert first.schema == schema
+    assert first.column("overall_sentiment").dictionary.equals(second.column("overall_sentiment").dictionary)
+    assert second.column("overall_sentiment").to_pylist() == ["Positive", None]
+    assert second.column("record_uuid").to_pylist() == [str(uuid.UUID(int=2)), str(uuid.UUID(int=3))]
+    assert second.column("agent_performance_rating").type == pa.int8()
+
+
+def test_text_and_transcripts_only_on_request():
+    names = arrow_schema().names
+    assert "summary" not in names and "transcript" not in names
+    assert {"summary", "transcript"} <= set(arrow_schema(include_text=True, include_transcripts=True).names)
+
+
+def test_watermark_starts_the_next_export_after_the_settled_end():
+    rows = [row(1, NOW - datetime.timedelta(hours=2)), row(2, NOW - datetime.timedelta(hours=1)), row(3, NOW)]
+    db = FakeDB(rows)
+    export = asyncio.run(prepare_export(db))
+    chunks = asyncio.run(collect(export.stream("arrow")))
+    table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    # The row created at the settled end is left for the next export
+    assert table.column("id").to_pylist() == [1, 2] and export.rows == 2
+    assert decode_cursor(export.watermark) == (NOW, 0)
+
+    db.settled = NOW + datetime.timedelta(hours=1)
+    following = asyncio.run(prepare_export(db, after=export.watermark))
+    chunks = asyncio.run(collect(following.stream("arrow")))
+    assert pa.ipc.open_stream(b"".join(chunks)).read_all().column("id").to_pylist() == [3]
+
+
+def test_nothing_settled_keeps_the_watermark():
+    after = encode_cursor(NOW, 5)
+    db = FakeDB([row(6, NOW)], settled=NOW - datetime.timedelta(minutes=1))
+    export = asyncio.run(prepare_export(db, after=after))
+    assert asyncio.run(collect(export._row_batches())) == [] and db.streamed == []
+    assert export.watermark == after
+
+
+def test_parquet_file_is_written_in_batches(tmp_path):
+    rows = [row(i, NOW - datetime.timedelta(minutes=10 - i)) for i in range(1, 6)]
+    export = Export(FakeDB(rows), (datetime.datetime.min, 0), NOW, batch_rows=2)
+    path = tmp_path / "export.parquet"
+    assert asyncio.run(export.write_file(str(path), "parquet")) == 5
+    table = pyarrow.parquet.read_table(path)
+    assert table.column("id").to_pylist() == [1, 2, 3, 4, 5]
+    assert not (tmp_path / "export.parquet.tmp").exists()
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
@@ -0,0 +1,158 @@
+import asyncio
+
+from jobs import JobError, JobWorkerPool
+
+
+class FakeJobDB:
+    """In-memory analysis_jobs with the same claim/fencing rules as the SQL"""
+
+    def __init__(self, *job_ids):
+        self.jobs = {job_id: {"id": job_id, "status": "queued", "attempts": 0, "transcript": f"call {job_id}",
+                              "bypass_cache": False, "webhook_url": None, "priority": "bulk", "tenant": None,
+                              "result": None, "error": None, "retry_after": None}
+                     for job_id in job_ids}
+        self.renewals = []
+
+    async def claim_jobs(self, limit, lease):
+        for job in self.jobs.values():
+            if job["status"] == "queued":
+                job["status"] = "running"
+                job["attempts"] += 1
+                return [dict(job)]
+        return []
+
+    def _claimed(self, job_id, attempt):
+        job = self.jobs[job_id]
+        return job if job["attempts"] == attempt and job["status"] == "running" else None
+
+    async def extend_job_lease(self, job_id, attempt, lease):
+        self.renewals.append((job_id, attempt, lease))
+        return self._claimed(job_id, attempt) is not None
+
+    async def finish_job(self, job_id, attempt, result):
+        job = self._claimed(job_id, attempt)
+        if job:
+            job.update(status="done", result=result, error=None)
+        return job is not None
+
+    async def fail_job(self, job_id, attempt, error, retry_after=None):
+        job = self._claimed(job_id, attempt)
+        if job:
+            job.update(status="queued" if retry_after is not None else "failed", error=error, retry_after=retry_after)
+        return job is not None
+
+    async def delete_finished_jobs(self, older_than_hours):
+        return 0
+
+
+def run_jobs(db, handler, **kwargs):
+    async def run():
+        pool = JobWorkerPool(db, handler, workers=2, poll_interval=0.01, **kwargs)
+        pool.start()
+        while any(job["status"] in ("queued", "running") for job in db.jobs.values()):
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return pool
+
+    return asyncio.run(run())
+
+
+def test_jobs_are_claimed_and_finished():
+    async def handler(job):
+        return {"summary": job["transcript"]}
+
+    db = FakeJobDB("a", "b", "c")
+    pool = run_jobs(db, handler)
+    assert {job["status"] for job in db.jobs.values()} == {"done"}
+    assert db.jobs["b"]["result"] == {"summary": "call b"}
+    assert pool.stats()["completed"] == 3
+
+
+def test_retryable_errors_are_requeued_with_backoff():
+    async def handler(job):
+        if job["attempts"] < 3:
+            raise JobError("LLM unavailable", retryable=True)
+        return {}
+
+    db = FakeJobDB("a")
+    pool = run_jobs(db, handler, max_attempts=3, retry_delay=10)
+    assert db.jobs["a"]["status"] == "done" and db.jobs["a"]["attempts"] == 3
+    assert db.jobs["a"]["retry_after"] == 20
+    assert pool.retried == 2 and pool.completed == 1
+
+
+def test_permanent_errors_and_exhausted_attempts_fail_the_job():
+    async def handler(job):
+        raise JobError("bad transcript", retryable=job["id"] == "b")
+
+    db = FakeJobDB("a", "b")
+    pool = run_jobs(db, handler, max_attempts=2)
+    assert db.jobs["a"] == {**db.jobs["a"], "status": "failed", "attempts": 1, "error": "bad transcript"}
+    assert db.jobs["b"]["status"] == "failed" and db.jobs["b"]["attempts"] == 2
+    assert pool.failed == 2 and pool.retried == 1
+
+
+def test_lost_claim_is_not_reported_as_done():
+    db = FakeJobDB("a")
+
+    async def handler(job):
+        db.jobs["a"]["attempts"] += 1  # another worker reclaimed it after the lease ran out
+        return {}
+
+    async def run():
+        pool = JobWorkerPool(db, handler, workers=1)
+        job = (await db.claim_jobs(1, 300))[0]
+        await pool._process(job)
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.lost_claims == 1 and pool.completed == 0
+    assert db.jobs["a"]["status"] == "running"
+
+
+def test_claim_errors_do_not_stop_the_workers():
+    db = FakeJobDB("a")
+    claim = db.claim_jobs
+    failures = []
+
+    async def flaky_claim(limit, lease):
+        if len(failures) < 2:
+            failures.append(1)
+            raise ConnectionError("database down")
+        return await claim(limit, lease)
+
+    async def handler(job):
+        return {}
+
+    db.claim_jobs = flaky_claim
+    run_jobs(db, handler)
+    assert db.jobs["a"]["status"] == "done"
+
+
+def test_lease_is_renewed_while_the_job_runs():
+    async def handler(job):
+        await asyncio.sleep(0.1)
+        return {}
+
+    db = FakeJobDB("a")
+    run_jobs(db, handler, lease=0.06)
+    assert db.jobs["a"]["status"] == "done" and db.jobs["a"]["attempts"] == 1
+    assert len(db.renewals) >= 3 and set(db.renewals) == {("a", 1, 0.06)}
+
+
+def test_job_workers_start_once_the_database_is_reachable(monkeypatch):
+    import main
+
+    attempts, started = [], []
+
+    async def open_database():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("database down")
+
+    monkeypatch.setattr(main.db, "open", open_database)
+    monkeypatch.setattr(main.job_workers, "start", lambda: started.append(len(attempts)))
+    monkeypatch.setattr(main, "WARMUP_RETRY_INTERVAL", 0)
+    asyncio.run(main.warm_up_database())
+    # Not started while the database is down, started once when it comes up
+    assert started == [3]
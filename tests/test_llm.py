@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from llm import CircuitBreaker, LLMClient, LLMUnavailable, classify_error
+
+
+class StatusError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"{code} error")
+        self.code = code
+
+
+class ScriptedBackend:
+    """Raises StatusError(code) for each non-zero code in turn, answers "ok" for 0"""
+    name = "scripted"
+
+    def __init__(self, codes=()):
+        self.codes = list(codes)
+
+    async def generate(self, model, prompt, **kwargs):
+        code = self.codes.pop(0) if self.codes else 0
+        if code:
+            raise StatusError(code)
+        return "ok"
+
+
+def test_classify_error():
+    assert classify_error(StatusError(429)) == "throttled"
+    assert classify_error(StatusError(503)) == "transient"
+    assert classify_error(StatusError(400)) == "fatal"
+
+
+def test_breaker_opens_and_closes_after_a_successful_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "half_open"  # reset_timeout=0: the probe is due at once
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker():
+    async def run():
+        client = LLMClient(ScriptedBackend([503] * 3 + [400]), max_retries=0)
+        client.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+        for _ in range(3):
+            with pytest.raises(LLMUnavailable):
+                await client.generate("model", "prompt")
+        assert client.breaker.state == "open"
+        await asyncio.sleep(0.02)
+        with pytest.raises(StatusError):
+            await client.generate("model", "prompt")  # the probe hits a fatal error
+        assert not client.breaker.probing and client.breaker.state == "open"
+        await asyncio.sleep(0.02)
+        return await client.generate("model", "prompt"), client.breaker.state
+
+    assert asyncio.run(run()) == ("ok", "closed")
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from parsing import normalize_insight, parse_llm_json, repair_json, strip_code_fences
+
+
+def test_plain_json():
+    assert parse_llm_json('{"a": 1, "b": [true, null]}') == {"a": 1, "b": [True, None]}
+
+
+def test_code_fences_are_removed():
+    assert strip_code_fences('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert parse_llm_json('```json\n{"a": 1}\n```') == {"a": 1}
+
+
+def test_trailing_text_is_ignored():
+    assert parse_llm_json('Here you go: {"a": 1} Hope this helps!') == {"a": 1}
+
+
+def test_python_literals_single_quotes_and_trailing_commas():
+    text = "{'met': True, 'reason': None, 'items': [1, 2,],}"
+    assert parse_llm_json(text) == {"met": True, "reason": None, "items": [1, 2]}
+
+
+def test_repair_keeps_quotes_inside_strings():
+    repaired = repair_json("{'quote': 'he said \"pay\"', 'it\\'s': 'ok'}")
+    assert json.loads(repaired) == {"quote": 'he said "pay"', "it's": "ok"}
+
+
+def test_unparseable_reply_raises():
+    with pytest.raises(json.JSONDecodeError):
+        parse_llm_json("no json here")
+
+
+def test_normalize_insight_clamps_rating_and_sentiments():
+    data = normalize_insight({"agent_performance_rating": "11.4", "sentiment_start": " negative ",
+                              "overall_sentiment": "mixed"})
+    assert data["agent_performance_rating"] == 10
+    assert data["sentiment_start"] == "Negative"
+    assert data["overall_sentiment"] == "mixed"
+    assert normalize_insight({"agent_performance_rating": 0})["agent_performance_rating"] == 1
@@ -0,0 +1,93 @@
+import asyncio
+import types
+
+import pytest
+
+from backends import LLM_CONTEXT_CACHE_MIN_TOKENS, GeminiBackend
+from prompts import STREAM_FIELD_ORDER, TEMPLATES, get_template, order_insight_fields
+
+KINDS = ("single", "stream", "chunk", "reduce", "batch")
+
+
+def test_registry():
+    assert set(TEMPLATES) == {"v2", "v2-compact", "v3"}
+    assert get_template("v3").version == "v3"
+    with pytest.raises(Exception, match="PROMPT_TEMPLATE"):
+        get_template("v1")
+
+
+@pytest.mark.parametrize("version", sorted(TEMPLATES))
+def test_every_prompt_starts_with_its_kinds_prefix(version):
+    template = TEMPLATES[version]
+    prompts = [template.single("T"), template.stream("T"), template.chunk("T", 1, 2), template.reduce("[]"),
+               template.batch({1: "T", 2: "U"})]
+    assert [kind for kind, _ in prompts] == list(KINDS)
+    for kind, body in prompts:
+        prefix = template.prefixes[kind]
+        assert prefix.endswith("\n\n") and "Labelling guide:" not in body
+    assert template.batch({1: "T", 2: "U"})[1].startswith("Transcript 1: T\n\nTranscript 2: U")
+
+
+def test_compact_prefix_is_shorter():
+    assert TEMPLATES["v2-compact"].prefix_tokens["single"] < TEMPLATES["v2"].prefix_tokens["single"] / 2 + 20
+
+
+def test_v3_prefixes_are_long_enough_to_cache():
+    v3 = TEMPLATES["v3"]
+    assert min(v3.prefix_tokens.values()) >= LLM_CONTEXT_CACHE_MIN_TOKENS
+    assert all("Labelling guide:" in prefix for prefix in v3.prefixes.values())
+    assert all(max(t.prefix_tokens.values()) < LLM_CONTEXT_CACHE_MIN_TOKENS
+               for version, t in TEMPLATES.items() if version != "v3")
+
+
+def test_stream_prefix_follows_the_stream_field_order():
+    prefix = TEMPLATES["v3"].prefixes["stream"]
+    fields = prefix[:prefix.index("Labelling guide:")]
+    assert [fields.index(f"- {name}:") for name in STREAM_FIELD_ORDER] == \
+        sorted(fields.index(f"- {name}:") for name in STREAM_FIELD_ORDER)
+    assert order_insight_fields("\n- b: x\n- a: y", ["a", "b"]) == "\n- a: y\n- b: x"
+
+
+def test_similar_call_is_included_as_an_example():
+    example = types.SimpleNamespace(transcript="Agent: hi", insight={"summary": "s"})
+    kind, body = TEMPLATES["v2"].single("Agent: hello", example=example)
+    assert body.index("Example transcript: Agent: hi") < body.index("Transcript: Agent: hello")
+
+
+class FakeCaches:
+    def __init__(self):
+        self.created = []
+
+    async def create(self, model, config):
+        self.created.append((model, config))
+        return types.SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+
+def gemini(min_tokens=LLM_CONTEXT_CACHE_MIN_TOKENS):
+    backend = GeminiBackend(api_key="key", context_cache=True, context_cache_min_tokens=min_tokens)
+    backend._client = types.SimpleNamespace(aio=types.SimpleNamespace(caches=FakeCaches()))
+    backend.types = types.SimpleNamespace(CreateCachedContentConfig=lambda **kwargs: kwargs)
+    return backend
+
+
+def test_long_prefix_is_cached_once_and_sent_by_reference():
+    kind, body = TEMPLATES["v3"].single("Agent: hello")
+    prefix = TEMPLATES["v3"].prefixes[kind]
+
+    async def run():
+        backend = gemini()
+        first = await backend._contents("gemini-2.5-flash", prefix + body, prefix)
+        second = await backend._contents("gemini-2.5-flash", prefix + body, prefix)
+        return backend, first, second
+
+    backend, first, second = asyncio.run(run())
+    assert first == second == (body, "cachedContents/1")
+    assert len(backend._client.aio.caches.created) == 1
+
+
+def test_short_prefix_is_sent_in_full():
+    kind, body = TEMPLATES["v2"].single("Agent: hello")
+    prefix = TEMPLATES["v2"].prefixes[kind]
+    backend = gemini()
+    assert asyncio.run(backend._contents("gemini-2.5-flash", prefix + body, prefix)) == (prefix + body, None)
+    assert backend._client.aio.caches.created == []
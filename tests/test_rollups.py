@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+import types
+
+import asyncpg
+
+from db import DatabaseUnavailable
+from rollups import RollupAccumulator, backfill, hour_bucket
+
+AT = datetime.datetime(2025, 3, 1, 14, 25, 10)
+DB_NOW = datetime.datetime(2025, 3, 1, 20, 0)
+
+
+def insight(purpose="Payment reminder", sentiment="Neutral", rating=8, local=False):
+    return types.SimpleNamespace(call_purpose=purpose, overall_sentiment=sentiment, agent_performance_rating=rating,
+                                 call_objective_met=True, action_required=False, classified_locally=local)
+
+
+class FakeDB:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.upserts = []
+        self.rebuilt = []
+
+    async def upsert_rollups(self, rows):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.upserts.append(sorted(rows))
+
+    async def fetch(self, query, *args):
+        assert query == "SELECT LOCALTIMESTAMP"
+        return [(DB_NOW,)]
+
+    async def rebuild_rollups(self, since, until):
+        self.rebuilt.append((since, until))
+
+
+def test_calls_are_counted_per_hour_and_dimensions():
+    db = FakeDB()
+    rollups = RollupAccumulator(db)
+    rollups.add(insight(rating=8), at=AT)
+    rollups.add(insight(rating=6), at=AT.replace(minute=59))
+    rollups.add(insight(sentiment="Negative", rating=3), at=AT)
+    rollups.add(insight(rating=9), at=AT + datetime.timedelta(hours=1))
+    asyncio.run(rollups.flush())
+    hour = hour_bucket(AT)
+    assert db.upserts == [[
+        (hour, "Payment reminder", "Negative", True, False, 1, 1, 3),
+        (hour, "Payment reminder", "Neutral", True, False, 2, 2, 14),
+        (hour + datetime.timedelta(hours=1), "Payment reminder", "Neutral", True, False, 1, 1, 9),
+    ]]
+    assert rollups.counts == {} and rollups.stats()["calls_added"] == 4
+
+
+def test_failed_flush_keeps_the_counts():
+    db = FakeDB(errors=[DatabaseUnavailable("down"), asyncpg.PostgresError("deadlock")])
+    rollups = RollupAccumulator(db)
+    rollups.add(insight(), at=AT)
+    asyncio.run(rollups.flush())
+    rollups.add(insight(), at=AT)
+    asyncio.run(rollups.flush())
+    asyncio.run(rollups.flush())
+    assert db.upserts == [[(hour_bucket(AT), "Payment reminder", "Neutral", True, False, 2, 2, 16)]]
+    assert rollups.failed_flushes == 2 and rollups.flushes == 1
+
+
+def test_local_placeholder_ratings_are_not_rated():
+    db = FakeDB()
+    rollups = RollupAccumulator(db)
+    rollups.add(insight(rating=9), at=AT)
+    rollups.add(insight(rating=5, local=True), at=AT)
+    asyncio.run(rollups.flush())
+    assert db.upserts == [[(hour_bucket(AT), "Payment reminder", "Neutral", True, False, 2, 1, 9)]]
+
+
+def test_buckets_follow_the_database_clock():
+    rollups = RollupAccumulator(FakeDB())
+    rollups.add(insight(), at=AT)
+    asyncio.run(rollups.flush())
+    assert abs(rollups.now() - DB_NOW) < datetime.timedelta(minutes=1)
+
+
+def test_stop_flushes_what_is_left():
+    async def run():
+        db = FakeDB()
+        rollups = RollupAccumulator(db, flush_interval=60)
+        rollups.start()
+        rollups.add(insight(), at=AT)
+        await rollups.stop()
+        return db.upserts
+
+    assert len(asyncio.run(run())) == 1
+
+
+def test_backfill_rebuilds_whole_hours_in_steps():
+    db = FakeDB()
+    asyncio.run(backfill(db, AT, datetime.datetime(2025, 3, 2, 16), step_hours=12))
+    assert db.rebuilt == [
+        (datetime.datetime(2025, 3, 1, 14), datetime.datetime(2025, 3, 2, 2)),
+        (datetime.datetime(2025, 3, 2, 2), datetime.datetime(2025, 3, 2, 14)),
+        (datetime.datetime(2025, 3, 2, 14), datetime.datetime(2025, 3, 2, 16)),
+    ]
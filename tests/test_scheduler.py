@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from scheduler import PriorityScheduler, current_priority, parse_class_map, priority
+
+
+def scheduler(limit: int, **kwargs) -> PriorityScheduler:
+    return PriorityScheduler(initial=limit, min_limit=limit, max_limit=limit, **kwargs)
+
+
+async def hold(s: PriorityScheduler, priority_class: str, order: list, release: asyncio.Event, tenant=None):
+    with priority(priority_class, tenant):
+        ticket = await s.acquire()
+    order.append(priority_class)
+    await release.wait()
+    await s.release("success", ticket)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_parse_class_map():
+    assert parse_class_map("interactive:8, bulk:1,", float) == {"interactive": 8.0, "bulk": 1.0}
+
+
+def test_priority_context():
+    assert current_priority() == ("interactive", None)
+    with priority("bulk", "acme"):
+        assert current_priority() == ("bulk", "acme")
+    assert current_priority() == ("interactive", None)
+
+
+def test_weighted_fair_queuing():
+    async def run():
+        s = scheduler(1, weights={"interactive": 4, "near_real_time": 1, "bulk": 1},
+                      max_share={"interactive": 1, "near_real_time": 1, "bulk": 1})
+        order, go = [], asyncio.Event()
+        go.set()
+        blocker = asyncio.Event()
+        first = asyncio.create_task(hold(s, "bulk", [], blocker))
+        await settle()
+        tasks = [asyncio.create_task(hold(s, c, order, go)) for c in ["bulk"] * 10 + ["interactive"] * 10]
+        await settle()
+        blocker.set()
+        await asyncio.gather(first, *tasks)
+        return order
+
+    order = asyncio.run(run())
+    # Interactive gets about four slots for each bulk slot while both are queued
+    assert order[:10].count("interactive") >= 8
+    assert order[10:].count("bulk") >= 8
+
+
+def test_class_max_share_keeps_slots_free():
+    async def run():
+        s = scheduler(4, max_share={"interactive": 1.0, "near_real_time": 1.0, "bulk": 0.5})
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(s, "bulk", order, release)) for _ in range(4)]
+        await settle()
+        stats = s.stats()["bulk"]
+        interactive = asyncio.create_task(hold(s, "interactive", order, release))
+        await settle()
+        release.set()
+        await asyncio.gather(*tasks, interactive)
+        return stats, order
+
+    stats, order = asyncio.run(run())
+    assert stats["in_flight"] == 2 and stats["queued"] == 2
+    assert order.index("interactive") == 2
+
+
+def test_tenant_quota():
+    async def run():
+        s = scheduler(4, tenant_quotas={"acme": 1})
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(s, "interactive", order, release, tenant="acme")) for _ in range(3)]
+        await settle()
+        in_flight = dict(s.tenant_in_flight)
+        release.set()
+        await asyncio.gather(*tasks)
+        return in_flight, s.tenant_in_flight
+
+    in_flight, after = asyncio.run(run())
+    assert in_flight == {"acme": 1}
+    assert after == {}
+
+
+def test_cancelled_waiter_is_removed():
+    async def run():
+        s = scheduler(1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(s, "interactive", [], release))
+        await settle()
+        waiter = asyncio.create_task(hold(s, "bulk", [], release))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        queued = s.stats()["bulk"]["queued"]
+        release.set()
+        await holder
+        return queued, s.in_flight
+
+    assert asyncio.run(run()) == (0, 0)
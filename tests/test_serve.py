@@ -0,0 +1,31 @@
+import pytest
+
+import serve
+from serve import parse_args, worker_environment
+
+
+def test_connections_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(serve, "DB_MAX_CONNECTIONS", 20)
+    monkeypatch.setenv("DB_POOL_MIN_SIZE", "2")
+    pools = [int(worker_environment(n, 3, "/tmp/llm.sock")["DB_POOL_MAX_SIZE"]) for n in range(3)]
+    assert pools == [6, 6, 6] and sum(pools) <= 20
+    assert worker_environment(0, 20, "/tmp/llm.sock")["DB_POOL_MIN_SIZE"] == "1"
+
+
+def test_rate_limits_are_left_to_the_coordinator():
+    env = worker_environment(1, 4, "/tmp/llm.sock")
+    assert env["LLM_COORDINATOR_SOCKET"] == "/tmp/llm.sock"
+    assert env["LLM_RPM"] == env["LLM_TPM"] == "0"
+
+
+def test_more_workers_than_connections_is_refused(monkeypatch, capsys):
+    monkeypatch.setattr(serve, "DB_MAX_CONNECTIONS", 4)
+    assert parse_args(["--workers", "4"]).workers == 4
+    for workers in ("5", "0"):
+        with pytest.raises(SystemExit):
+            parse_args(["--workers", workers])
+    assert "DB_MAX_CONNECTIONS (4)" in capsys.readouterr().err
+
+
+def test_workers_know_their_id():
+    assert [worker_environment(n, 3, "/tmp/llm.sock")["SERVE_WORKER_ID"] for n in range(3)] == ["0", "1", "2"]
@@ -0,0 +1,91 @@
+from similarity import (MinHasher, SimilarityIndex, adapt_insight, estimated_jaccard, jaccard, normalize,
+                        pack_signature, shingles, unpack_signature)
+
+SCRIPT = ("Agent: Good morning {name}, this is about your loan EMI of {amount} due on the {day}. "
+          "Customer: Yes I know, my salary got delayed this month, I will pay by {weekday} for sure. "
+          "Agent: Thank you, please pay through the app and keep the receipt. Customer: Okay, bye.")
+
+
+def call(name="Mr. Singh", amount="₹5,000", day="5th", weekday="Monday"):
+    return SCRIPT.format(name=name, amount=amount, day=day, weekday=weekday)
+
+
+INSIGHT = {"summary": "Mr. Singh will pay ₹5,000 by Monday.", "overall_sentiment": "Neutral"}
+
+
+def test_normalize_replaces_call_specific_values():
+    normalized, values = normalize(call())
+    assert "<name>" in normalized and "<amount>" in normalized and "<date>" in normalized
+    assert values == ["mr. singh", "₹5,000", "5th", "monday"]
+    assert normalize(call("Mrs. Rao", "₹7,250", "12th", "Friday"))[0] == normalized
+
+
+def test_minhash_estimates_jaccard():
+    hasher = MinHasher()
+    a = shingles(normalize(call())[0])
+    b = shingles(normalize(call() + " Agent: one more thing about the late fee waiver.")[0])
+    assert hasher.signature(a) == hasher.signature(set(a))
+    assert abs(estimated_jaccard(hasher.signature(a), hasher.signature(b)) - jaccard(a, b)) < 0.15
+
+
+def test_signature_packing_round_trips():
+    signature = MinHasher(num_perm=16).signature({"a b c"})
+    assert unpack_signature(pack_signature(signature)) == signature
+
+
+def test_near_duplicate_is_reused_with_its_values_swapped():
+    index = SimilarityIndex(reuse_threshold=0.9, few_shot_threshold=0.5)
+    index.add(call(), INSIGHT)
+    match = index.query(call("Mrs. Rao", "₹7,250", "12th", "Friday"))
+    assert match.reusable and match.similarity == 1.0
+    assert match.insight["summary"] == "Mrs. Rao will pay ₹7,250 by Friday."
+
+
+def test_unrelated_call_misses():
+    index = SimilarityIndex()
+    index.add(call(), INSIGHT)
+    assert index.query("Agent: Your card was blocked. Customer: Please unblock it, I am travelling.") is None
+    assert index.stats()["misses"] == 1
+
+
+def test_eviction_removes_buckets():
+    index = SimilarityIndex(max_entries=2)
+    for n in range(3):
+        index.add(call() + f" Customer: reference {'x' * n} " + "unique words " * n * 5, {"n": n})
+    assert len(index.entries) == 2
+    fingerprints = set(index.entries)
+    assert all(set(bucket) <= fingerprints for bucket in index.buckets.values())
+
+
+def test_candidates_are_capped():
+    index = SimilarityIndex(max_candidates=5)
+    for n in range(50):
+        index.add(call(amount=f"₹{1000 + n}") + f" ref{n}", {"n": n})
+    assert index.query(call()) is not None
+
+
+def test_adapt_insight_keeps_title_case():
+    adapted = adapt_insight({"summary": "Mr. Singh agreed."}, ["mr. singh"], ["mr. rao"])
+    assert adapted["summary"] == "Mr. Rao agreed."
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = SimilarityIndex()
+    index.add(call(), INSIGHT)
+    index.save(path)
+    assert list(tmp_path.iterdir()) == [tmp_path / "index.json"]
+    loaded = SimilarityIndex()
+    assert loaded.load(path)
+    assert loaded.query(call()).reusable
+    assert not SimilarityIndex(bands=16).load(path)
+
+
+def test_index_is_not_loaded_for_another_prompt_or_model(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = SimilarityIndex(insights_from="v2/gemini-2.5-flash")
+    index.add(call(), INSIGHT)
+    index.save(path)
+    assert SimilarityIndex(insights_from="v2/gemini-2.5-flash").load(path)
+    assert not SimilarityIndex(insights_from="v3/gemini-2.5-flash").load(path)
+    assert not SimilarityIndex(insights_from="v2/gemini-2.5-pro").load(path)
@@ -0,0 +1,111 @@
+import asyncio
+import types
+
+import pytest
+
+from cache import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "insight"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return results, flight.stats()
+
+    results, stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False, True, True, True, True]
+    assert {result for result, _ in results} == {"insight"}
+    assert stats == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_different_keys_run_separately():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(flight.do("a", work), flight.do("b", work))
+
+    assert asyncio.run(run()) == [(2, False), (2, False)]
+    assert len(calls) == 2
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    attempts = []
+
+    async def work():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("LLM failed")
+        return "insight"
+
+    async def run():
+        flight = SingleFlight()
+        failed = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        return failed, await flight.do("key", work)
+
+    failed, retried = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in failed)
+    assert retried == ("insight", False) and len(attempts) == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def work():
+        await asyncio.sleep(0.02)
+        return "insight"
+
+    async def run():
+        flight = SingleFlight()
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == ("insight", True)
+
+
+def test_bypass_cache_requests_are_not_coalesced_with_cached_ones(monkeypatch):
+    import main
+
+    calls = []
+
+    async def analyze_transcript(transcript, example=None):
+        calls.append(transcript)
+        run = len(calls)
+        await asyncio.sleep(0.01)
+        return types.SimpleNamespace(run=run, model_dump=dict)
+
+    async def cache_miss(key):
+        return None
+
+    async def cache_put(key, value):
+        pass
+
+    monkeypatch.setattr(main, "analyze_transcript", analyze_transcript)
+    monkeypatch.setattr(main.insight_cache, "get", cache_miss)
+    monkeypatch.setattr(main.insight_cache, "put", cache_put)
+    monkeypatch.setattr(main, "classify_locally", lambda transcript: None)
+    monkeypatch.setattr(main, "find_similar", lambda transcript: None)
+    monkeypatch.setattr(main, "remember_insight", lambda transcript, insight: None)
+
+    async def run():
+        return await asyncio.gather(main.cached_insights("Agent: hi"), main.cached_insights("Agent: hi", True),
+                                    main.cached_insights("Agent: hi", True))
+
+    cached, fresh, also_fresh = asyncio.run(run())
+    assert len(calls) == 2 and cached != fresh and fresh == also_fresh
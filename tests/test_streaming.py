@@ -0,0 +1,41 @@
+import json
+
+from streaming import IncrementalObjectParser, sse_event
+
+
+def feed_all(parser, chunks):
+    members = []
+    for chunk in chunks:
+        members.extend(parser.feed(chunk))
+    return members
+
+
+def test_members_are_emitted_as_they_complete():
+    parser = IncrementalObjectParser()
+    assert parser.feed('```json\n{"summary": "Customer will') == []
+    assert parser.feed(' pay", "rating": 7') == [("summary", "Customer will pay")]
+    assert parser.feed("}") == [("rating", 7)]
+    assert parser.finished
+
+
+def test_nested_values_commas_and_escapes_in_strings():
+    text = json.dumps({"a": {"x": [1, 2]}, "b": 'say "hi", then {leave}', "c": [{"d": 1}]})
+    parser = IncrementalObjectParser()
+    # One character at a time, the worst case for chunk boundaries
+    members = feed_all(parser, list(text))
+    assert dict(members) == json.loads(text)
+    assert parser.text == text
+
+
+def test_text_after_the_object_is_ignored():
+    parser = IncrementalObjectParser()
+    assert feed_all(parser, ['{"a": 1}', ' trailing {"b": 2}']) == [("a", 1)]
+
+
+def test_malformed_member_is_left_for_the_final_parse():
+    parser = IncrementalObjectParser()
+    assert feed_all(parser, ['{"a": tru, "b": 2}']) == [("b", 2)]
+
+
+def test_sse_event():
+    assert sse_event("field", {"k": "ü"}) == 'event: field\ndata: {"k": "ü"}\n\n'
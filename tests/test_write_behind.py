@@ -0,0 +1,86 @@
+import asyncio
+import types
+import uuid
+
+import asyncpg
+
+from db import DatabaseUnavailable, WriteBehindWriter
+
+INSIGHT = types.SimpleNamespace(
+    customer_intent="Pay later", call_purpose="Payment reminder", call_objective_met=True, key_results="Promise",
+    customer_statements_analysis="Cooperative", non_payment_reasons="Salary delay", sentiment_start="Neutral",
+    sentiment_end="Positive", overall_sentiment="Neutral", agent_performance_rating=8,
+    agent_performance_feedback="Clear", action_required=False, summary="Will pay Monday", classified_locally=False)
+
+
+class FakeDB:
+    """Fails each call with the next scripted exception, then succeeds"""
+
+    def __init__(self, copy_errors=(), row_errors=()):
+        self.copy_errors = list(copy_errors)
+        self.row_errors = list(row_errors)
+        self.copied = []
+        self.inserted = []
+        self.retried = []
+
+    async def copy_call_records(self, rows):
+        if self.copy_errors:
+            raise self.copy_errors.pop(0)
+        self.copied.append(list(rows))
+
+    async def bulk_insert_call_record_rows_if_absent(self, rows):
+        self.retried.append(list(rows))
+
+    async def insert_call_record_rows_if_absent(self, rows):
+        if self.row_errors:
+            raise self.row_errors.pop(0)
+        self.inserted.append(list(rows))
+
+
+async def write(db, count, **kwargs):
+    writer = WriteBehindWriter(db, **kwargs)
+    writer.start()
+    for _ in range(count):
+        await writer.submit(uuid.uuid4(), "Agent: hello", INSIGHT)
+    await writer.drain(timeout=5)
+    return writer
+
+
+def test_rows_are_flushed_in_batches():
+    db = FakeDB()
+    writer = asyncio.run(write(db, 7, batch_size=3, flush_interval=0.05))
+    assert [len(batch) for batch in db.copied] == [3, 3, 1]
+    assert writer.stats()["rows_flushed"] == 7 and writer.stats()["flushes"] == 3
+
+
+def test_copy_failure_falls_back_to_row_inserts():
+    db = FakeDB(copy_errors=[asyncpg.PostgresError("duplicate key")])
+    writer = asyncio.run(write(db, 2, batch_size=2, flush_interval=0.05))
+    assert db.copied == [] and len(db.inserted[0]) == 2
+    assert writer.rows_flushed == 2 and writer.rows_dropped == 0
+
+
+def test_unavailable_database_is_retried_without_duplicates():
+    db = FakeDB(copy_errors=[DatabaseUnavailable("down")])
+    writer = asyncio.run(write(db, 1, batch_size=1, flush_interval=0.05))
+    # The failed COPY may have committed, so the retry skips rows already stored
+    assert db.copied == [] and len(db.retried) == 1
+    assert writer.failed_flushes == 1 and writer.rows_dropped == 0
+
+
+def test_failed_fallback_drops_the_batch_and_keeps_writing():
+    db = FakeDB(copy_errors=[asyncpg.PostgresError("bad row")], row_errors=[RuntimeError("boom")])
+    writer = asyncio.run(write(db, 3, batch_size=2, flush_interval=0.05))
+    assert writer.rows_dropped == 2 and writer.failed_flushes == 1
+    assert writer.rows_flushed == 1 and len(db.copied) == 1
+
+
+def test_submit_after_drain_is_rejected():
+    async def run():
+        writer = await write(FakeDB(), 0)
+        try:
+            await writer.submit(uuid.uuid4(), "Agent: hello", INSIGHT)
+        except DatabaseUnavailable:
+            return True
+
+    assert asyncio.run(run())